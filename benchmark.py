@@ -0,0 +1,1382 @@
+# Benchmarks for the Brewin# interpreter
+# usage: python benchmark.py [benchmark ...]
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import brewbatch
+import brewio
+import brewserver
+from brewcache import ParseCache
+from brewlex import get_ply_lexer, tokenize
+from element import Element
+from optimizerv4 import optimize_program
+from brewparse import parse_program
+import env_v4
+import quickenv4
+import type_valuev4
+from interpreterv4 import Interpreter
+
+LOOP_PROGRAM = """
+func main() {
+  i = 0;
+  total = 0;
+  while (i < 100000) {
+    if (i / 3 * 3 == i) {
+      total = total + i;
+    } else {
+      total = total - 1;
+    }
+    i = i + 1;
+  }
+  print(total);
+}
+"""
+
+FIB_PROGRAM = """
+func fib(n) {
+  if (n < 2) {
+    return n;
+  }
+  return fib(n - 1) + fib(n - 2);
+}
+
+func main() {
+  print(fib(20));
+}
+"""
+
+METHOD_PROGRAM = """
+func main() {
+  counter = @;
+  counter.n = 0;
+  counter.inc = lambda(by) { this.n = this.n + by; };
+  i = 0;
+  while (i < 50000) {
+    counter.inc(2);
+    i = i + 1;
+  }
+  print(counter.n);
+}
+"""
+
+# every block pushes a frame, so the innermost statements here read and write
+# variables that are several frames down
+NESTED_PROGRAM = """
+func main() {
+  total = 0;
+  i = 0;
+  while (i < 30) {
+    j = 0;
+    while (j < 30) {
+      k = 0;
+      while (k < 30) {
+        if (k / 2 * 2 == k) {
+          if (j != i) {
+            total = total + i + j + k;
+          }
+        }
+        k = k + 1;
+      }
+      j = j + 1;
+    }
+    i = i + 1;
+  }
+  print(total);
+}
+"""
+
+# creates lambdas in a loop while a linked list of 500 objects is live
+CAPTURE_PROGRAM = """
+func main() {
+  head = nil;
+  i = 0;
+  while (i < 500) {
+    node = @;
+    node.val = i;
+    node.next = head;
+    head = node;
+    i = i + 1;
+  }
+  total = 0;
+  i = 0;
+  while (i < 2000) {
+    f = lambda(x) { return x + head.val; };
+    total = f(total);
+    i = i + 1;
+  }
+  print(total);
+}
+"""
+
+# a closure factory called from a function with plenty of variables in scope
+ADDER_PROGRAM = """
+func make_adder(n) {
+  return lambda(x) { return x + n; };
+}
+
+func main() {
+  a = 1;
+  b = "two";
+  c = true;
+  o = @;
+  o.x = 4;
+  total = 0;
+  i = 0;
+  while (i < 5000) {
+    add = make_adder(i);
+    total = add(total);
+    square = lambda(x) { return x * x; };
+    total = total - square(2) + 4;
+    i = i + 1;
+  }
+  print(total);
+}
+"""
+
+# builds a binary tree of objects and walks it recursively, passing every
+# subtree by value; the walk only reads the subtrees, and the last pass
+# writes to each one
+TREE_PROGRAM = """
+func build(depth, node) {
+  node = @;
+  node.val = depth;
+  node.leaf = depth == 0;
+  if (depth > 0) {
+    node.left = build(depth - 1, nil);
+    node.right = build(depth - 1, nil);
+  }
+  return node;
+}
+
+func total(node) {
+  if (node.leaf) {
+    return node.val;
+  }
+  return node.val + total(node.left) + total(node.right);
+}
+
+func bump(node) {
+  node.val = node.val + 1;
+  if (node.leaf) {
+    return node.val;
+  }
+  return node.val + bump(node.left) + bump(node.right);
+}
+
+func main() {
+  tree = build(9, nil);
+  i = 0;
+  while (i < 5) {
+    print(total(tree));
+    i = i + 1;
+  }
+  print(bump(tree));
+}
+"""
+
+# builds thousands of objects with the same fields and reads them back
+OBJECTS_PROGRAM = """
+func make(i, point) {
+  point = @;
+  point.x = i;
+  point.y = i * 2;
+  point.z = i * 3;
+  point.next = nil;
+  return point;
+}
+
+func main() {
+  head = make(0, nil);
+  tail = head;
+  i = 1;
+  while (i < 3000) {
+    point = make(i, nil);
+    tail.next = point;
+    tail = point;
+    i = i + 1;
+  }
+  total = 0;
+  pass = 0;
+  while (pass < 10) {
+    node = head;
+    while (node != nil) {
+      total = total + node.x + node.y - node.z;
+      node = node.next;
+    }
+    pass = pass + 1;
+  }
+  print(total);
+}
+"""
+
+# calls a method and reads a field inherited through a 30-deep proto chain
+PROTO_PROGRAM = """
+func main() {
+  root = @;
+  root.step = 3;
+  root.add = lambda(x) { return x + this.step; };
+  obj = root;
+  depth = 0;
+  while (depth < 30) {
+    child = @;
+    child.proto = obj;
+    obj = child;
+    depth = depth + 1;
+  }
+  total = 0;
+  i = 0;
+  while (i < 5000) {
+    total = obj.add(total) - obj.step;
+    i = i + 1;
+  }
+  print(total);
+}
+"""
+
+SHAPES_PROGRAM = """
+func area(s) {
+  return s.area();
+}
+
+func main() {
+  square = @;
+  square.w = 3;
+  square.area = lambda() { return this.w * this.w; };
+  rect = @;
+  rect.w = 2;
+  rect.h = 5;
+  rect.area = lambda() { return this.w * this.h; };
+  circle = @;
+  circle.r = 2;
+  circle.area = lambda() { return 3 * this.r * this.r; };
+  tile = @;
+  tile.proto = square;
+  total = 0;
+  i = 0;
+  while (i < 5000) {
+    total = total + area(square) + area(rect) + area(circle) + area(tile);
+    total = total + square.area() + tile.area();
+    i = i + 1;
+  }
+  print(total);
+}
+"""
+# the kind of code a templating layer generates: constant expressions and
+# branches switched on and off by constants
+TEMPLATE_PROGRAM = """
+func main() {
+  total = 0;
+  i = 0;
+  while (i < 20000) {
+    if (true) {
+      total = total + (2 * 3 + 4) - 60 / 6;
+    }
+    if (false) {
+      print("debug: ", i);
+    }
+    if (1 == 1 && !false) {
+      total = total + 1;
+    } else {
+      total = total - 1;
+    }
+    if (3 > 4) {
+      print("never");
+    } else {
+      i = i + (10 - 9);
+    }
+  }
+  print(total);
+}
+"""
+# tail-recursive functions and methods, mutual recursion included
+TAILCALL_PROGRAM = """
+func sum(n, acc) {
+  if (n == 0) {
+    return acc;
+  }
+  return sum(n - 1, acc + n);
+}
+
+func even(n) {
+  if (n == 0) {
+    return true;
+  }
+  return odd(n - 1);
+}
+
+func odd(n) {
+  if (n == 0) {
+    return false;
+  }
+  return even(n - 1);
+}
+
+func main() {
+  counter = @;
+  counter.count = lambda(n, acc) {
+    if (n == 0) {
+      return acc;
+    }
+    return this.count(n - 1, acc + 2);
+  };
+  total = 0;
+  i = 0;
+  while (i < 20) {
+    total = total + sum(1000, 0) + counter.count(500, 0);
+    if (even(999)) {
+      total = total + 1;
+    }
+    i = i + 1;
+  }
+  print(total);
+}
+"""
+PROGRAMS = {
+    "loop": LOOP_PROGRAM,
+    "fib": FIB_PROGRAM,
+    "method": METHOD_PROGRAM,
+    "nested": NESTED_PROGRAM,
+    "capture": CAPTURE_PROGRAM,
+    "adder": ADDER_PROGRAM,
+    "tree": TREE_PROGRAM,
+    "objects": OBJECTS_PROGRAM,
+    "proto": PROTO_PROGRAM,
+    "shapes": SHAPES_PROGRAM,
+    "template": TEMPLATE_PROGRAM,
+    "tailcall": TAILCALL_PROGRAM,
+}
+
+
+# a large program made of many small functions, for the front-end benchmarks
+def generate_program(num_funcs):
+    funcs = []
+    for i in range(num_funcs):
+        funcs.append(
+            f"""
+/* helper number {i} */
+func helper{i}(a, ref b) {{
+  total = 0;
+  while (a > 0) {{
+    if (a / 2 * 2 == a) {{ total = total + a * {i}; }} else {{ b = b - 1; }}
+    a = a - 1;
+  }}
+  obj = @;
+  obj.f = lambda(x) {{ return x + total; }};
+  print("helper {i}: ", obj.f(total));
+  return total;
+}}
+"""
+        )
+    funcs.append("func main() { x = 1; print(helper0(3, x)); }")
+    return "".join(funcs)
+
+
+# best wall time of `repeat` runs, so one-off noise doesn't skew the numbers
+def time_run(program, repeat=3, **kwargs):
+    best = None
+    for _ in range(repeat):
+        interpreter = Interpreter(console_output=False, **kwargs)
+        start = time.perf_counter()
+        interpreter.run(program)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, interpreter.get_output()
+
+
+# (wall time, output, error type) of one run of a program that may not finish
+# on every engine, like one that recurses deeper than the python stack
+def run_once(program, **kwargs):
+    interpreter = Interpreter(console_output=False, **kwargs)
+    start = time.perf_counter()
+    try:
+        interpreter.run(program)
+    except Exception:
+        pass
+    elapsed = time.perf_counter() - start
+    error_type, _ = interpreter.get_error_type_and_line()
+    return elapsed, interpreter.get_output(), error_type
+
+
+def bench_engines():
+    print(f"{'program':<10}{'engine':<10}{'seconds':>10}{'speedup':>10}")
+    for name, program in PROGRAMS.items():
+        baseline, expected = time_run(program, engine="tree")
+        print(f"{name:<10}{'tree':<10}{baseline:>10.3f}{1.0:>9.2f}x")
+        for engine in sorted(Interpreter.ENGINES - {"tree"}):
+            elapsed, output = time_run(program, engine=engine)
+            if output != expected:
+                raise AssertionError(f"{engine} output differs on {name}")
+            print(f"{name:<10}{engine:<10}{elapsed:>10.3f}{baseline / elapsed:>9.2f}x")
+
+
+# Bindings captured by the lambdas each closure-heavy program creates, next to
+# the bindings they'd capture without free variable analysis (everything
+# visible where the lambda is evaluated)
+CLOSURE_PROGRAMS = ("method", "capture", "adder")
+
+
+def bench_captures():
+    print(f"{'program':<10}{'lambdas':>10}{'visible':>10}{'captured':>10}{'saved':>8}")
+    capture = type_valuev4.capture
+    for name in CLOSURE_PROGRAMS:
+        counts = {"lambdas": 0, "visible": 0, "captured": 0}
+
+        # the closures of top-level functions are made before main's frame
+        # is pushed; every lambda is evaluated inside some function's frame
+        def counting_capture(env, slots=None):
+            captured = capture(env, slots)
+            if len(env.frames) > 1:
+                counts["lambdas"] += 1
+                counts["visible"] += sum(1 for _ in env.bindings())
+                counts["captured"] += len(captured)
+            return captured
+
+        type_valuev4.capture = counting_capture
+        try:
+            Interpreter(console_output=False).run(PROGRAMS[name])
+        finally:
+            type_valuev4.capture = capture
+        saved = 1 - counts["captured"] / max(counts["visible"], 1)
+        print(
+            f"{name:<10}{counts['lambdas']:>10}{counts['visible']:>10}"
+            f"{counts['captured']:>10}{saved:>8.0%}"
+        )
+
+
+# Objects passed or returned by value next to the copies that had to be
+# made, for the call-heavy programs; a by-value object is only copied once
+# the callee reads its fields or something writes to the heap
+CALL_PROGRAMS = ("fib", "method", "tree")
+
+
+def bench_copies():
+    print(f"{'program':<10}{'seconds':>10}{'by value':>10}{'copied':>10}")
+    deepcopy = type_valuev4.Object.__deepcopy__
+    finish_copy = type_valuev4.Object.finish_copy
+    for name in CALL_PROGRAMS:
+        counts = {"by value": 0, "copied": 0}
+
+        def counting_deepcopy(self, memo):
+            counts["by value"] += 1
+            return deepcopy(self, memo)
+
+        def counting_finish_copy(self):
+            counts["copied"] += 1
+            finish_copy(self)
+
+        type_valuev4.Object.__deepcopy__ = counting_deepcopy
+        type_valuev4.Object.finish_copy = counting_finish_copy
+        try:
+            Interpreter(console_output=False).run(PROGRAMS[name])
+        finally:
+            type_valuev4.Object.__deepcopy__ = deepcopy
+            type_valuev4.Object.finish_copy = finish_copy
+        elapsed, _ = time_run(PROGRAMS[name])
+        print(
+            f"{name:<10}{elapsed:>10.3f}{counts['by value']:>10}"
+            f"{counts['copied']:>10}"
+        )
+
+
+# Values and Cells allocated by each engine on the loop- and call-heavy
+# programs, next to their run time. nil, true, false, small ints and literals
+# are shared Values and never show up in the counts.
+VALUE_PROGRAMS = ("loop", "fib", "tree")
+
+
+def bench_values():
+    print(f"{'program':<10}{'engine':<10}{'seconds':>10}{'values':>10}{'cells':>10}")
+    value_init = type_valuev4.Value.__init__
+    cell_init = type_valuev4.Cell.__init__
+    for name in VALUE_PROGRAMS:
+        for engine in sorted(Interpreter.ENGINES):
+            counts = {"values": 0, "cells": 0}
+
+            def counting_value_init(self, t, v=None):
+                counts["values"] += 1
+                value_init(self, t, v)
+
+            def counting_cell_init(self, value):
+                counts["cells"] += 1
+                cell_init(self, value)
+
+            type_valuev4.Value.__init__ = counting_value_init
+            type_valuev4.Cell.__init__ = counting_cell_init
+            try:
+                Interpreter(console_output=False, engine=engine).run(PROGRAMS[name])
+            finally:
+                type_valuev4.Value.__init__ = value_init
+                type_valuev4.Cell.__init__ = cell_init
+            elapsed, _ = time_run(PROGRAMS[name], engine=engine)
+            print(
+                f"{name:<10}{engine:<10}{elapsed:>10.3f}{counts['values']:>10}"
+                f"{counts['cells']:>10}"
+            )
+
+
+def best_time(f, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_parse_cache():
+    program = generate_program(500)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ParseCache(cache_dir)
+        cache.parse(program)  # warm the cache
+        parse_time = best_time(lambda: parse_program(program))
+        hit_time = best_time(lambda: cache.parse(program))
+    print(f"source: {len(program)} bytes")
+    print(f"parse_program: {parse_time:.4f}s")
+    print(f"cache hit:     {hit_time:.4f}s ({parse_time / hit_time:.1f}x faster)")
+
+
+def ply_tokens(program):
+    lexer = get_ply_lexer()
+    lexer.lineno = 1
+    lexer.input(program)
+    return list(iter(lexer.token, None))
+
+
+# Lexing throughput on multi-megabyte sources, against the PLY lexer built from
+# the same rules. Both must produce the same tokens, values and line numbers.
+LEXER_SOURCES = {
+    "code": lambda: generate_program(10000),
+    # long comment blocks are the case PLY's comment regex handles worst
+    "comments": lambda: generate_program(100)
+    + ("/*" + " lorem ipsum\n" * 20000 + "*/\n") * 10,
+}
+
+
+def bench_lexer():
+    print(
+        f"{'source':<10}{'MB':>6}{'tokens':>10}{'ply MB/s':>10}{'MB/s':>8}"
+        f"{'speedup':>10}"
+    )
+    for name, make_source in LEXER_SOURCES.items():
+        program = make_source()
+        megabytes = len(program) / (1024 * 1024)
+        expected = [(t.type, t.value, t.lineno, t.lexpos) for t in ply_tokens(program)]
+        actual = [(t.type, t.value, t.lineno, t.lexpos) for t in tokenize(program)]
+        if actual != expected:
+            raise AssertionError(f"tokenize() and the PLY lexer disagree on {name}")
+
+        ply_time = best_time(lambda: ply_tokens(program), repeat=3)
+        tokenize_time = best_time(lambda: list(tokenize(program)), repeat=3)
+        print(
+            f"{name:<10}{megabytes:>6.1f}{len(expected):>10}"
+            f"{megabytes / ply_time:>10.1f}{megabytes / tokenize_time:>8.1f}"
+            f"{ply_time / tokenize_time:>9.1f}x"
+        )
+
+
+# The AST node the parser used to build: a plain object holding its fields in
+# a per-node dict. Only kept here, to compare against the slotted node classes.
+class DictElement:
+    def __init__(self, elem_type, fields):
+        self.elem_type = elem_type
+        self.dict = fields
+
+
+def to_dict_elements(node):
+    if isinstance(node, Element):
+        fields = {}
+        for key in node.fields:
+            fields[key] = to_dict_elements(getattr(node, key))
+        return DictElement(node.elem_type, fields)
+    if isinstance(node, list):
+        return [to_dict_elements(item) for item in node]
+    return node
+
+
+# bytes still allocated once build() returns, with everything it allocated
+# along the way and then dropped already freed
+def resident_size(build):
+    tracemalloc.start()
+    try:
+        result = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return size, result
+
+
+def count_nodes(node):
+    if isinstance(node, Element):
+        return 1 + sum(count_nodes(getattr(node, key)) for key in node.fields)
+    if isinstance(node, list):
+        return sum(count_nodes(item) for item in node)
+    return 0
+
+
+# Resident size of the AST of a ~50k line program, as slotted nodes and as the
+# dict-based nodes they replaced. Both trees share the same strings and ints.
+def bench_ast_memory():
+    program = generate_program(4200)
+    parse_program(program)  # build the parser outside of the measurement
+
+    slotted_size, ast = resident_size(lambda: parse_program(program))
+    num_nodes = count_nodes(ast)
+    del ast
+    dict_size, _ = resident_size(lambda: to_dict_elements(parse_program(program)))
+
+    print(f"source: {program.count(chr(10))} lines, {num_nodes} nodes")
+    print(
+        f"dict nodes:    {dict_size / 1e6:>7.1f}MB "
+        f"({dict_size / num_nodes:.0f} bytes/node)"
+    )
+    print(
+        f"slotted nodes: {slotted_size / 1e6:>7.1f}MB "
+        f"({slotted_size / num_nodes:.0f} bytes/node, "
+        f"{dict_size / slotted_size:.1f}x smaller)"
+    )
+
+
+# The layout Object used to have: every instance keeps its fields in a dict
+# of its own, each in a cell. Only kept here, to compare against objects with
+# shapes.
+class DictObject:
+    def __init__(self):
+        self.fields_to_value = {"proto": None}
+        self.copy_of = None
+        self.type = type_valuev4.Type.OBJECT
+
+    def set_field(self, field_name, value):
+        self.fields_to_value[field_name] = type_valuev4.HeapCell(value)
+
+    def get(self, field_name):
+        if field_name in self.fields_to_value:
+            return self.fields_to_value[field_name].value
+        return None
+
+
+OBJECT_FIELDS = ("x", "y", "z", "next")
+
+
+def make_objects(object_class, count):
+    value = type_valuev4.int_value(1)
+    objects = []
+    for _ in range(count):
+        obj = object_class()
+        for field_name in OBJECT_FIELDS:
+            obj.set_field(field_name, value)
+        objects.append(obj)
+    return objects
+
+
+def read_fields(objects):
+    for obj in objects:
+        for field_name in OBJECT_FIELDS:
+            obj.get(field_name)
+
+
+# Resident size of many objects with the same four fields and the time it
+# takes to read every field back, as dict-based objects and as objects that
+# share a Shape. Every field holds the same Value, so only the objects count.
+def bench_objects(count=100000):
+    print(f"{'layout':<10}{'MB':>8}{'bytes/obj':>11}{'read s':>9}")
+    for name, object_class in (("dict", DictObject), ("shape", type_valuev4.Object)):
+        size, objects = resident_size(lambda: make_objects(object_class, count))
+        elapsed = best_time(lambda: read_fields(objects), repeat=3)
+        print(
+            f"{name:<10}{size / 1e6:>8.1f}{size / count:>11.0f}{elapsed:>9.3f}"
+        )
+        del objects
+
+
+# Every program on every engine with optimizerv4's pass off and on; the node
+# count is the size of the AST the engines run. (tests/test_optimizer.py
+# checks that the pass doesn't change what programs do.)
+def bench_optimizer():
+    print(
+        f"{'program':<10}{'engine':<10}{'nodes':>7}{'optimized':>11}"
+        f"{'plain s':>9}{'optimized s':>13}"
+    )
+    op_to_lambda = Interpreter(console_output=False).op_to_lambda
+    for name, program in PROGRAMS.items():
+        nodes = count_nodes(parse_program(program))
+        optimized_ast = optimize_program(parse_program(program), op_to_lambda)
+        optimized_nodes = count_nodes(optimized_ast)
+        for engine in sorted(Interpreter.ENGINES):
+            plain, _ = time_run(program, engine=engine, optimize=False)
+            optimized, _ = time_run(program, engine=engine)
+            print(
+                f"{name:<10}{engine:<10}{nodes:>7}{optimized_nodes:>11}"
+                f"{plain:>9.3f}{optimized:>13.3f}"
+            )
+
+
+# Env frames pushed and run time with every block getting a frame
+# (optimize=False) and with blocks that can't bind anything skipped, on the
+# benchmark programs. (tests/test_scopes.py checks that skipping them doesn't
+# change what scoping programs do.)
+def bench_scopes():
+    print(
+        f"{'program':<10}{'engine':<10}{'frames':>10}{'skipping':>10}"
+        f"{'plain s':>9}{'skipping s':>12}"
+    )
+    push = env_v4.EnvironmentManager.push
+    for name in ("loop", "nested", "method", "fib"):
+        program = PROGRAMS[name]
+        for engine in sorted(Interpreter.ENGINES):
+            counts = []
+            for optimize in (False, True):
+                pushes = [0]
+
+                def counting_push(env, bindings=None):
+                    pushes[0] += 1
+                    push(env, bindings)
+
+                env_v4.EnvironmentManager.push = counting_push
+                try:
+                    Interpreter(
+                        console_output=False, engine=engine, optimize=optimize
+                    ).run(program)
+                finally:
+                    env_v4.EnvironmentManager.push = push
+                counts.append(pushes[0])
+            plain, _ = time_run(program, engine=engine, optimize=False)
+            skipping, _ = time_run(program, engine=engine)
+            print(
+                f"{name:<10}{engine:<10}{counts[0]:>10}{counts[1]:>10}"
+                f"{plain:>9.3f}{skipping:>12.3f}"
+            )
+
+
+# Run time of the operator-heavy programs on each engine with binary operator
+# quickening turned off (a site that may never deoptimize never specializes)
+# and on.
+QUICKEN_PROGRAMS = ("loop", "fib", "nested")
+
+
+def bench_quickening():
+    print(f"{'program':<10}{'engine':<10}{'generic s':>11}{'quick s':>9}{'speedup':>9}")
+    max_deopts = quickenv4.BinaryOpSite.MAX_DEOPTS
+    for name in QUICKEN_PROGRAMS:
+        for engine in sorted(Interpreter.ENGINES):
+            quickenv4.BinaryOpSite.MAX_DEOPTS = 0
+            try:
+                generic, expected = time_run(PROGRAMS[name], engine=engine)
+            finally:
+                quickenv4.BinaryOpSite.MAX_DEOPTS = max_deopts
+            quick, output = time_run(PROGRAMS[name], engine=engine)
+            if output != expected:
+                raise AssertionError(f"quickening changes the output of {name}")
+            print(
+                f"{name:<10}{engine:<10}{generic:>11.3f}{quick:>9.3f}"
+                f"{generic / quick:>8.2f}x"
+            )
+
+
+# A method call site on objects that each inherit their method from one of
+# num_protos protos, num_protos deep.
+def make_call_site(num_protos, count=1000):
+    method = type_valuev4.int_value(1)
+    protos = []
+    for depth in range(1, num_protos + 1):
+        proto = type_valuev4.Object()
+        proto.set_field("m", method)
+        for _ in range(depth):
+            child = type_valuev4.Object()
+            proto_value = type_valuev4.Value(type_valuev4.Type.OBJECT, proto)
+            child.set_field("proto", proto_value)
+            proto = child
+        protos.append(type_valuev4.Value(type_valuev4.Type.OBJECT, proto))
+    objects = []
+    for i in range(count):
+        obj = type_valuev4.Object()
+        obj.set_field("proto", protos[i % num_protos])
+        objects.append(obj)
+    return objects
+
+
+def lookup_methods(objects, cache=None):
+    for obj in objects:
+        if cache is None:
+            obj.get("m")
+        else:
+            obj.get_cached("m", cache)
+
+
+# Time it takes one call site to look up inherited methods without an inline
+# cache (Object.get, which caches per object) and through the site's
+# InlineCache, for sites that see one proto, a few, and more than
+# InlineCache.MAX_ENTRIES. "first" times the first lookup on each object,
+# "again" a second lookup on the same objects.
+def bench_method_cache(count=100000):
+    print(f"{'site':<14}{'cache':<8}{'first s':>9}{'again s':>9}")
+    for name, num_protos in (("monomorphic", 1), ("polymorphic", 4), ("megamorphic", 8)):
+        for cache_name in ("none", "inline"):
+            first = again = float("inf")
+            for _ in range(3):
+                objects = make_call_site(num_protos, count)
+                cache = type_valuev4.InlineCache() if cache_name == "inline" else None
+                start = time.perf_counter()
+                lookup_methods(objects, cache)
+                middle = time.perf_counter()
+                lookup_methods(objects, cache)
+                end = time.perf_counter()
+                first = min(first, middle - start)
+                again = min(again, end - middle)
+            print(f"{name:<14}{cache_name:<8}{first:>9.3f}{again:>9.3f}")
+
+
+# Tail recursion deeper than the python stack: whether each engine runs it
+# (in constant stack depth) and how long it takes.
+DEEP_TAILCALL_PROGRAM = """
+func down(n) {
+  if (n == 0) {
+    return "done";
+  }
+  return down(n - 1);
+}
+
+func main() {
+  counter = @;
+  counter.down = lambda(n) {
+    if (n == 0) {
+      return "done";
+    }
+    return this.down(n - 1);
+  };
+  print(down(100000));
+  print(counter.down(100000));
+}
+"""
+
+
+def bench_tail_calls():
+    print(f"{'engine':<10}{'seconds':>10}")
+    for engine in sorted(Interpreter.ENGINES):
+        elapsed, output, error_type = run_once(DEEP_TAILCALL_PROGRAM, engine=engine)
+        if error_type is not None:
+            print(f"{engine:<10}{error_type.name:>16}")
+            continue
+        if output != ["done", "done"]:
+            raise AssertionError(f"{engine} output differs on deep tail calls")
+        print(f"{engine:<10}{elapsed:>10.3f}")
+
+
+# Run time of the call-heavy programs on the tree-walker, whose calls recurse
+# on the python stack, and on the stackless vm, which pushes and pops its own
+# call frames; "calls" and "recurse" do little but call, so they show what a
+# call costs. The engines take turns, and each gets its best of `repeat`
+# runs, so a slow patch on a busy machine doesn't land on one engine only.
+# Then a non-tail recursion a million calls deep on each engine, which only
+# the vm can finish (the others stop with a RESOURCE_ERROR once they run out
+# of python stack).
+CALLS_PROGRAM = """
+func f(x) {
+  return x;
+}
+
+func main() {
+  i = 0;
+  while (i < 100000) {
+    f(i);
+    i = i + 1;
+  }
+  print(i);
+}
+"""
+RECURSE_PROGRAM = """
+func down(n) {
+  if (n == 0) {
+    return 0;
+  }
+  return 1 + down(n - 1);
+}
+
+func main() {
+  i = 0;
+  total = 0;
+  while (i < 200) {
+    total = total + down(150);
+    i = i + 1;
+  }
+  print(total);
+}
+"""
+STACKLESS_PROGRAMS = {
+    "calls": CALLS_PROGRAM,
+    "recurse": RECURSE_PROGRAM,
+    "fib": FIB_PROGRAM,
+    "method": METHOD_PROGRAM,
+    "tree": TREE_PROGRAM,
+    "proto": PROTO_PROGRAM,
+    "tailcall": TAILCALL_PROGRAM,
+}
+DEEP_RECURSION_PROGRAM = """
+func sum(n) {
+  if (n == 0) {
+    return 0;
+  }
+  return n + sum(n - 1);
+}
+
+func main() {
+  print(sum(1000000));
+}
+"""
+
+
+def bench_stackless(repeat=5):
+    print(f"{'program':<10}{'tree s':>9}{'vm s':>9}{'speedup':>9}")
+    for name, program in STACKLESS_PROGRAMS.items():
+        best = {"tree": float("inf"), "vm": float("inf")}
+        outputs = {}
+        for _ in range(repeat):
+            for engine in best:
+                elapsed, outputs[engine] = time_run(program, repeat=1, engine=engine)
+                best[engine] = min(best[engine], elapsed)
+        if outputs["vm"] != outputs["tree"]:
+            raise AssertionError(f"vm output differs on {name}")
+        tree, vm = best["tree"], best["vm"]
+        print(f"{name:<10}{tree:>9.3f}{vm:>9.3f}{tree / vm:>8.2f}x")
+    print(f"{'deep':<10}{'engine':<10}{'seconds':>10}")
+    for engine in sorted(Interpreter.ENGINES):
+        elapsed, output, error_type = run_once(DEEP_RECURSION_PROGRAM, engine=engine)
+        if error_type is not None:
+            print(f"{'deep':<10}{engine:<10}{error_type.name:>16}")
+            continue
+        if output != ["500000500000"]:
+            raise AssertionError(f"{engine} output differs on deep recursion")
+        print(f"{'deep':<10}{engine:<10}{elapsed:>10.3f}")
+
+
+# Lines per second written straight to a sink, and then the run time of a
+# program that prints a line per iteration and the memory its interpreter
+# still holds afterwards. Output goes to a line-buffered file (like a
+# terminal), printed line by line and kept in full the way InterpreterBase
+# used to, or through a buffered brewio.OutputSink with the whole output log,
+# the last 1000 lines, and none.
+PRINT_PROGRAM = """
+func main() {
+  i = 0;
+  while (i < 100000) {
+    print("line ", i, ": ", i * i);
+    i = i + 1;
+  }
+}
+"""
+
+
+def bench_output(num_lines=1000000):
+    lines = [f"line {i}" for i in range(num_lines)]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "output.txt")
+        print(f"{'sink':<24}{'lines/s':>12}")
+        for name in ("print", "buffered"):
+
+            def write_lines():
+                with open(path, "w", buffering=1) as output_file:
+                    stdout = sys.stdout
+                    sys.stdout = output_file
+                    try:
+                        if name == "print":
+                            sink = brewio.ConsoleSink()
+                        else:
+                            sink = brewio.OutputSink(output_file)
+                        for line in lines:
+                            sink.write(line)
+                        sink.flush()
+                    finally:
+                        sys.stdout = stdout
+
+            elapsed = best_time(write_lines, repeat=3)
+            print(f"{name:<24}{num_lines / elapsed:>12.0f}")
+
+        print(f"{'sink':<24}{'seconds':>9}{'log lines':>11}{'held MB':>9}")
+        sinks = (
+            ("print, full log", "print", None),
+            ("buffered, full log", "buffered", None),
+            ("buffered, last 1000", "buffered", 1000),
+            ("buffered, no log", "buffered", 0),
+        )
+        for name, sink, log_size in sinks:
+
+            def run():
+                with open(path, "w", buffering=1) as output_file:
+                    if sink == "print":
+                        stdout = sys.stdout
+                        sys.stdout = output_file
+                        output = brewio.ConsoleSink()
+                    else:
+                        output = output_file
+                    try:
+                        interpreter = Interpreter(
+                            engine="vm", output=output, log_size=log_size
+                        )
+                        interpreter.run(PRINT_PROGRAM)
+                    finally:
+                        if sink == "print":
+                            sys.stdout = stdout
+                return interpreter
+
+            elapsed = best_time(run, repeat=3)
+            held, interpreter = resident_size(run)
+            with open(path) as output_file:
+                if sum(1 for _ in output_file) != 100000:
+                    raise AssertionError(f"{name} lost output")
+            log_lines = len(interpreter.get_output())
+            print(f"{name:<24}{elapsed:>9.3f}{log_lines:>11}{held / 1e6:>9.1f}")
+
+
+# Reading count integers, one per line, from a file: first through
+# Interpreter.get_input alone (lines per second and peak memory), then through
+# inputi in a program on the vm engine. "list" reads the file into a list of lines
+# first, the way inp had to be given before brewio.FileInput.
+SUM_INPUT_PROGRAM = """
+func main() {
+  total = 0;
+  n = inputi();
+  while (n > 0) {
+    total = total + inputi();
+    n = n - 1;
+  }
+  print(total);
+}
+"""
+
+
+def bench_input(count=10000000):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "input.txt")
+        with open(path, "w") as input_file:
+            input_file.write(f"{count}\n")
+            for start in range(0, count, 100000):
+                numbers = range(start, min(start + 100000, count))
+                input_file.write("".join(f"{i}\n" for i in numbers))
+        expected = [str(count * (count - 1) // 2)]
+        sources = {
+            "list": lambda: open(path).read().splitlines(),
+            "blocks": lambda: brewio.FileInput(path),
+            "mmap": lambda: brewio.FileInput(path, use_mmap=True),
+        }
+
+        def read_all(make_source):
+            get_input = Interpreter(console_output=False, inp=make_source()).get_input
+            total = 0
+            for _ in range(int(get_input())):
+                total += int(get_input())
+            return total
+
+        print(f"{'source':<10}{'lines/s':>12}{'peak MB':>9}")
+        for name, make_source in sources.items():
+            elapsed = best_time(lambda: read_all(make_source), repeat=1)
+            tracemalloc.start()
+            try:
+                read_all(make_source)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            print(f"{name:<10}{count / elapsed:>12.0f}{peak / 1e6:>9.1f}")
+
+        print(f"{'source':<10}{'inputi s':>10}")
+        for name, make_source in sources.items():
+            elapsed, output = time_run(
+                SUM_INPUT_PROGRAM, repeat=1, engine="vm", inp=make_source()
+            )
+            if output != expected:
+                raise AssertionError(f"{name} input gives the wrong sum")
+            print(f"{name:<10}{elapsed:>10.3f}")
+
+
+# a grading-style suite: many small programs, each with its own input file,
+# and a few that fail
+BATCH_PROGRAMS = {
+    "sum": SUM_INPUT_PROGRAM,
+    "fib": """
+func fib(n) {
+  if (n < 2) {
+    return n;
+  }
+  return fib(n - 1) + fib(n - 2);
+}
+
+func main() {
+  print(fib(inputi()));
+}
+""",
+    "name_error": "func main() { print(inputi() + missing); }",
+}
+
+
+def write_batch(directory, num_programs):
+    for i in range(num_programs):
+        name = list(BATCH_PROGRAMS)[i % len(BATCH_PROGRAMS)]
+        path = os.path.join(directory, f"{i:05}_{name}")
+        with open(path + brewbatch.PROGRAM_SUFFIX, "w") as program_file:
+            program_file.write(BATCH_PROGRAMS[name])
+        with open(path + brewbatch.INPUT_SUFFIX, "w") as input_file:
+            if name == "sum":
+                input_file.write("500\n" + "".join(f"{j}\n" for j in range(500)))
+            else:
+                input_file.write(f"{12 + i % 4}\n")
+
+
+def bench_batch(num_programs=600):
+    cores = os.cpu_count() or 1
+    counts = sorted({1, 2, 4, cores} | set(range(8, cores + 1, 8)))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        write_batch(temp_dir, num_programs)
+        jobs = brewbatch.find_jobs(temp_dir)
+        print(f"{cores} cores, {len(jobs)} programs")
+        print(f"{'workers':<10}{'seconds':>10}{'programs/s':>12}{'speedup':>10}")
+        expected = None
+        for workers in counts:
+            report = brewbatch.run_batch(jobs, workers=workers, engine="vm")
+            results = [
+                (entry["output"], entry["error"]) for entry in report["programs"]
+            ]
+            if expected is None:
+                expected = results
+                baseline = report["wall_time"]
+            elif results != expected:
+                raise AssertionError(f"results differ on {workers} workers")
+            elapsed = report["wall_time"]
+            print(
+                f"{workers:<10}{elapsed:>10.3f}{len(jobs) / elapsed:>12.1f}"
+                f"{baseline / elapsed:>9.2f}x"
+            )
+
+
+# Load on an interpreter server: each client sends the batch programs one
+# after another over its own connection, and every request's latency is
+# timed from sending it to its last message. The cold row starts a fresh
+# python process per program instead.
+SERVER_CLIENTS = (1, 4, 16, 64)
+
+
+def bench_server(requests_per_client=50):
+    programs = [
+        (BATCH_PROGRAMS["sum"], ["200"] + [str(i) for i in range(200)]),
+        (BATCH_PROGRAMS["fib"], ["12"]),
+        (BATCH_PROGRAMS["name_error"], ["1"]),
+    ]
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+    def percentiles(latencies):
+        cuts = statistics.quantiles(latencies, n=100)
+        return cuts[49] * 1000, cuts[98] * 1000
+
+    cold_run = "import interpreterv4; interpreterv4.Interpreter().run(input())"
+    cold = []
+    for i in range(20):
+        source, inp = programs[i % len(programs)]
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", cold_run],
+            cwd=repo_dir,
+            input="\n".join([source.replace("\n", " ")] + inp) + "\n",
+            capture_output=True,
+            text=True,
+        )
+        cold.append(time.perf_counter() - start)
+
+    async def client(path, latencies, errors):
+        connection = brewserver.Client(path)
+        await connection.connect()
+        try:
+            for i in range(requests_per_client):
+                source, inp = programs[i % len(programs)]
+                start = time.perf_counter()
+                _, result = await connection.run(source, inp)
+                latencies.append(time.perf_counter() - start)
+                if result["error"] is not None:
+                    errors[result["error"]] = errors.get(result["error"], 0) + 1
+        finally:
+            await connection.close()
+
+    async def load(path):
+        for num_clients in SERVER_CLIENTS:
+            latencies = []
+            errors = {}
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(client(path, latencies, errors) for _ in range(num_clients))
+            )
+            elapsed = time.perf_counter() - start
+            p50, p99 = percentiles(latencies)
+            # the name_error program is the last one, sent every len(programs)
+            expected = len(range(len(programs) - 1, requests_per_client, len(programs)))
+            if errors.get("NAME_ERROR", 0) != num_clients * expected:
+                raise AssertionError(f"unexpected errors {errors}")
+            print(
+                f"{num_clients:<10}{len(latencies) / elapsed:>12.1f}"
+                f"{p50:>10.2f}{p99:>10.2f}{errors.get('BUSY', 0):>8}"
+            )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "brewin.sock")
+        server = subprocess.Popen(
+            [sys.executable, "brewserver.py", path, "--cache-dir", temp_dir],
+            cwd=repo_dir,
+        )
+        try:
+            while not os.path.exists(path):
+                if server.poll() is not None:
+                    raise RuntimeError("the server exited")
+                time.sleep(0.05)
+            print(f"{os.cpu_count()} cores")
+            print(
+                f"{'clients':<10}{'requests/s':>12}{'p50 ms':>10}{'p99 ms':>10}"
+                f"{'busy':>8}"
+            )
+            p50, p99 = percentiles(cold)
+            print(
+                f"{'cold':<10}{len(cold) / sum(cold):>12.1f}{p50:>10.2f}{p99:>10.2f}"
+                f"{0:>8}"
+            )
+            asyncio.run(load(path))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+# Runaway programs, each stopped by the budget (see budgetv4) on every engine,
+# and the cost of running the benchmark programs with a budget that never
+# runs out: steps counted and memory sampled, against none at all
+RUNAWAY_PROGRAMS = {
+    "loop": "func main() { i = 0; while (true) { i = i + 1; } }",
+    "recursion": "func f(n) { return 1 + f(n + 1); } func main() { f(0); }",
+    "tail_calls": "func f(n) { return f(n + 1); } func main() { f(0); }",
+    "strings": 'func main() { s = "runaway"; while (true) { s = s + s; } }',
+    "objects": """
+func main() {
+  a = @;
+  while (true) {
+    b = @;
+    b.next = a;
+    b.f = lambda() { return a; };
+    a = b;
+  }
+}
+""",
+}
+RUNAWAY_BUDGET = {
+    "max_steps": 1000000,
+    "max_growth": 64 * 1024 * 1024,
+    "max_depth": 5000,
+}
+BUDGET_PROGRAMS = ("loop", "fib", "method", "tree", "template", "tailcall")
+
+
+def bench_budgets():
+    print(f"{'program':<12}{'engine':<10}{'seconds':>10}  error")
+    for name, program in RUNAWAY_PROGRAMS.items():
+        for engine in ("tree", "vm", "closure"):
+            interpreter = Interpreter(
+                console_output=False, engine=engine, **RUNAWAY_BUDGET
+            )
+            start = time.perf_counter()
+            try:
+                interpreter.run(program)
+            except Exception as exception:
+                message = str(exception)
+            else:
+                raise AssertionError(f"{name} wasn't stopped on {engine}")
+            elapsed = time.perf_counter() - start
+            print(f"{name:<12}{engine:<10}{elapsed:>10.3f}  {message}")
+
+    unlimited = {"max_steps": 10**15, "max_growth": 2**50}
+    print(f"{'program':<10}{'engine':<10}{'none':>10}{'budget':>10}{'overhead':>10}")
+    for name in BUDGET_PROGRAMS:
+        for engine in ("tree", "vm", "closure"):
+            baseline, expected = time_run(PROGRAMS[name], repeat=5, engine=engine)
+            elapsed, output = time_run(
+                PROGRAMS[name], repeat=5, engine=engine, **unlimited
+            )
+            if output != expected:
+                raise AssertionError(f"{name} output differs with a budget")
+            overhead = (elapsed / baseline - 1) * 100
+            print(
+                f"{name:<10}{engine:<10}{baseline:>10.3f}{elapsed:>10.3f}"
+                f"{overhead:>+9.1f}%"
+            )
+
+
+# Cold-start cost, measured in fresh interpreter processes so nothing is
+# already imported or built. "python" is the floor every other row pays.
+STARTUP_SNIPPETS = {
+    "python": "pass",
+    "import brewparse": "import brewparse",
+    "import interpreterv4": "import interpreterv4",
+    "first parse": "import brewparse; brewparse.parse_program('func main() { print(1); }')",
+    "first run": "import interpreterv4; interpreterv4.Interpreter().run('func main() { print(1); }')",
+}
+
+
+def bench_startup(runs=15):
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    floor = None
+    for name, snippet in STARTUP_SNIPPETS.items():
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, "-c", snippet],
+                cwd=repo_dir,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            times.append(time.perf_counter() - start)
+        median = statistics.median(times) * 1000
+        if floor is None:
+            floor = median
+        print(f"{name:<22}{median:>8.1f}ms{median - floor:>+9.1f}ms")
+
+
+BENCHMARKS = {
+    "engines": bench_engines,
+    "parse_cache": bench_parse_cache,
+    "lexer": bench_lexer,
+    "ast_memory": bench_ast_memory,
+    "captures": bench_captures,
+    "copies": bench_copies,
+    "values": bench_values,
+    "objects": bench_objects,
+    "quickening": bench_quickening,
+    "optimizer": bench_optimizer,
+    "scopes": bench_scopes,
+    "method_cache": bench_method_cache,
+    "tail_calls": bench_tail_calls,
+    "stackless": bench_stackless,
+    "output": bench_output,
+    "input": bench_input,
+    "batch": bench_batch,
+    "server": bench_server,
+    "budgets": bench_budgets,
+    "startup": bench_startup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Brewin# interpreter benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help=", ".join(BENCHMARKS))
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+    sys.setrecursionlimit(10000)
+    for name in args.benchmarks or BENCHMARKS:
+        print(f"== {name}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
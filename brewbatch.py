@@ -0,0 +1,207 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import brewparse
+from brewio import FileInput
+from interpreterv4 import Interpreter
+
+PROGRAM_SUFFIX = ".br"
+INPUT_SUFFIX = ".in"
+RECURSION_LIMIT = 10000
+LIMITS = ("max_steps", "max_growth", "max_depth")  # the Interpreter's budget
+
+
+# Runs many independent Brewin# programs across a pool of worker processes
+# and collects what each one did into a single report.
+#
+# A job is (program path, input path or None). Workers read the files
+# themselves, so only paths go to them and only results come back, and jobs
+# are handed out in chunks so a pool of short programs isn't bound by the
+# round trips to its workers.
+
+
+# the jobs for a directory (every *.br file under it, in sorted order, with
+# the .in file next to it as its input if there is one) or a manifest (one
+# program per line, optionally followed by its input file, relative to the
+# manifest; blank lines and lines starting with # are skipped)
+def find_jobs(path):
+    if os.path.isdir(path):
+        return jobs_in_directory(path)
+    return jobs_in_manifest(path)
+
+
+def jobs_in_directory(path):
+    jobs = []
+    for dir_path, dir_names, file_names in os.walk(path):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if not file_name.endswith(PROGRAM_SUFFIX):
+                continue
+            program_path = os.path.join(dir_path, file_name)
+            input_path = program_path[: -len(PROGRAM_SUFFIX)] + INPUT_SUFFIX
+            if not os.path.isfile(input_path):
+                input_path = None
+            jobs.append((program_path, input_path))
+    return jobs
+
+
+def jobs_in_manifest(path):
+    base = os.path.dirname(path)
+    jobs = []
+    with open(path) as manifest:
+        for line in manifest:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) > 2:
+                raise ValueError(f"Bad manifest line: {line.rstrip()}")
+            program_path = os.path.join(base, fields[0])
+            input_path = os.path.join(base, fields[1]) if len(fields) > 1 else None
+            jobs.append((program_path, input_path))
+    return jobs
+
+
+_options = None  # the Interpreter options of this worker's batch
+
+
+# set up once per worker: the parser is built here rather than by the first
+# program each worker runs, and every program after that reuses it
+def init_worker(options):
+    global _options
+    _options = options
+    sys.setrecursionlimit(RECURSION_LIMIT)
+    brewparse.get_parser()
+
+
+# runs one job and returns its entry in the report. An error the program runs
+# into is recorded by its ErrorType's name and line; anything else that stops
+# it (a syntax error, or a program or input file that can't be read, say) by
+# the exception's class name.
+def run_job(job):
+    program_path, input_path = job
+    entry = {"program": program_path, "input": input_path}
+    inp = None
+    interpreter = None
+    # the parser prints where a syntax error is, which mustn't end up in the
+    # middle of a report written to stdout
+    stray = io.StringIO()
+    start = time.perf_counter()
+    try:
+        # a program with no input file reads from an empty one, never from
+        # the runner's own stdin
+        inp = FileInput(input_path if input_path is not None else io.BytesIO())
+        interpreter = Interpreter(console_output=False, inp=inp, **_options)
+        with open(program_path) as program_file:
+            program = program_file.read()
+        with contextlib.redirect_stdout(stray):
+            interpreter.run(program)
+        error, line, message = None, None, None
+    except Exception as exception:
+        error_type, line = None, None
+        if interpreter is not None:
+            error_type, line = interpreter.get_error_type_and_line()
+        if error_type is not None:
+            error = error_type.name
+        else:
+            error = type(exception).__name__
+        message = stray.getvalue().strip() or str(exception)
+    finally:
+        if inp is not None:
+            inp.close()
+    entry["seconds"] = time.perf_counter() - start
+    entry["output"] = interpreter.get_output() if interpreter is not None else []
+    entry["error"] = error
+    entry["line"] = line
+    entry["message"] = message
+    return entry
+
+
+# runs every job on workers processes (all of them in this process for 1) and
+# returns the report, with the programs in the order of jobs. options are
+# passed to each Interpreter.
+def run_batch(jobs, workers=None, chunk_size=None, **options):
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1:
+        init_worker(options)
+        programs = [run_job(job) for job in jobs]
+    else:
+        if chunk_size is None:
+            # a few chunks per worker, so workers that draw short programs
+            # pick up more work instead of idling at the end
+            chunk_size = max(1, len(jobs) // (workers * 4))
+        with multiprocessing.Pool(workers, init_worker, (options,)) as pool:
+            programs = pool.map(run_job, jobs, chunk_size)
+    wall_time = time.perf_counter() - start
+
+    errors = {}
+    for entry in programs:
+        if entry["error"] is not None:
+            errors[entry["error"]] = errors.get(entry["error"], 0) + 1
+    return {
+        "workers": workers,
+        "options": options,
+        "wall_time": wall_time,
+        "program_time": sum(entry["seconds"] for entry in programs),
+        "summary": {"programs": len(programs), "errors": errors},
+        "programs": programs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run many Brewin# programs in parallel"
+    )
+    parser.add_argument(
+        "path", help=f"a directory of *{PROGRAM_SUFFIX} programs, or a manifest"
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, help="worker processes (default: one per core)"
+    )
+    parser.add_argument("--chunk-size", type=int, help="jobs handed out at a time")
+    parser.add_argument("--engine", default="tree", help="tree, vm or closure")
+    parser.add_argument(
+        "--no-optimize", action="store_true", help="skip the optimizer pass"
+    )
+    parser.add_argument("--max-steps", type=int, help="steps each program can run")
+    parser.add_argument(
+        "--max-growth", type=int, help="bytes the process can grow by per program"
+    )
+    parser.add_argument("--max-depth", type=int, help="how deep calls can go")
+    parser.add_argument("-o", "--output", help="write the report here, not stdout")
+    args = parser.parse_args()
+
+    limits = {}
+    for name in LIMITS:
+        if getattr(args, name) is not None:
+            limits[name] = getattr(args, name)
+    report = run_batch(
+        find_jobs(args.path),
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        engine=args.engine,
+        optimize=not args.no_optimize,
+        **limits,
+    )
+    if args.output:
+        with open(args.output, "w") as report_file:
+            json.dump(report, report_file, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    summary = report["summary"]
+    print(
+        f"{summary['programs']} programs, {sum(summary['errors'].values())} "
+        f"errors, {report['wall_time']:.2f}s on {report['workers']} workers",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import hashlib
+import marshal
+import os
+import tempfile
+
+from brewparse import parse_program
+from element import Element, make_node
+
+# bump whenever the on-disk layout of an entry changes
+CACHE_FORMAT = 2
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "brewin", "parse")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+ENTRY_SUFFIX = ".ast"
+
+
+# Every entry records the grammar it was parsed with, so tables regenerated
+# from a changed grammar never reuse an AST built by the old one
+def grammar_signature():
+    import parsetab
+
+    return hashlib.sha256(parsetab._lr_signature.encode("utf-8")).hexdigest()[:16]
+
+
+# ASTs are stored as nested tuples and lists of plain python values, which
+# marshal writes and reads much faster (and smaller) than pickled Elements:
+#   Element -> (elem_type, (value, ...)), values in the order of node.fields
+#   list    -> [value, ...]
+#   str, int, bool and None are stored as is
+def encode_ast(node):
+    if isinstance(node, Element):
+        return (
+            node.elem_type,
+            tuple(encode_ast(getattr(node, key)) for key in node.fields),
+        )
+    if isinstance(node, list):
+        return [encode_ast(item) for item in node]
+    return node
+
+
+def decode_ast(data):
+    if isinstance(data, tuple):
+        elem_type, values = data
+        return make_node(elem_type, [decode_ast(value) for value in values])
+    if isinstance(data, list):
+        return [decode_ast(item) for item in data]
+    return data
+
+
+# Caches parsed programs on disk, keyed by a hash of their source. A hit skips
+# lexing and parsing entirely. Entries are evicted least-recently-used first
+# once the cache directory holds more than max_bytes.
+class ParseCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.signature = grammar_signature()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def parse(self, program):
+        path = self.__path_for(program)
+        ast = self.__load(path)
+        if ast is not None:
+            self.hits += 1
+            return ast
+
+        self.misses += 1
+        ast = parse_program(program)
+        self.__store(path, ast)
+        return ast
+
+    def clear(self):
+        for name, _, _ in self.__entries():
+            self.__remove(os.path.join(self.cache_dir, name))
+
+    def __path_for(self, program):
+        digest = hashlib.sha256(program.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest + ENTRY_SUFFIX)
+
+    def __load(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        try:
+            cache_format, signature, encoded = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            self.__remove(path)  # corrupt or truncated entry
+            return None
+        if cache_format != CACHE_FORMAT or signature != self.signature:
+            self.__remove(path)
+            return None
+
+        try:
+            os.utime(path)  # the mtime is our LRU clock
+        except OSError:
+            pass
+        return decode_ast(encoded)
+
+    def __store(self, path, ast):
+        data = marshal.dumps((CACHE_FORMAT, self.signature, encode_ast(ast)))
+        if len(data) > self.max_bytes:
+            return
+
+        # write to a temp file and rename it into place, so concurrent readers
+        # never see a partially written entry
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            self.__remove(temp_path)
+            return
+        self.__evict()
+
+    def __evict(self):
+        entries = self.__entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        entries.sort(key=lambda entry: entry[2])
+        for name, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            self.__remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+    # (file name, size, mtime) for every entry in the cache directory
+    def __entries(self):
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((name, stat.st_size, stat.st_mtime))
+        return entries
+
+    def __remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
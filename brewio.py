@@ -0,0 +1,181 @@
+import io
+import mmap
+import os
+import sys
+from collections import deque
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+
+# Where a program's output goes. Lines are collected and written out together
+# once buffer_size characters are pending and on flush(), instead of one write
+# (and, on a terminal, one flush) per line. target is a text file-like object,
+# a binary one, or an fd; None writes to whatever sys.stdout is when the lines
+# are flushed.
+class OutputSink:
+    def __init__(self, target=None, buffer_size=DEFAULT_BUFFER_SIZE, encoding="utf-8"):
+        self.target = target
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+        self.pending = []
+        self.pending_size = 0
+        if isinstance(target, int):
+            self.__write = self.__write_fd
+        elif isinstance(target, (io.RawIOBase, io.BufferedIOBase)):
+            self.__write = self.__write_binary
+        else:
+            self.__write = self.__write_text
+
+    def write(self, line):
+        self.pending.append(line)
+        self.pending_size += len(line) + 1
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.pending.append("")
+        data = "\n".join(self.pending)
+        self.pending = []
+        self.pending_size = 0
+        self.__write(data)
+
+    def __write_text(self, data):
+        target = self.target if self.target is not None else sys.stdout
+        target.write(data)
+        target.flush()
+
+    def __write_binary(self, data):
+        self.target.write(data.encode(self.encoding))
+        self.target.flush()
+
+    def __write_fd(self, data):
+        data = data.encode(self.encoding)
+        while data:
+            data = data[os.write(self.target, data) :]
+
+
+# The sink InterpreterBase used to hard-code: print() every line as it's
+# output, so it shows up right away.
+class ConsoleSink:
+    def write(self, line):
+        print(line)
+
+    def flush(self):
+        pass
+
+
+# The sink for the output option of an interpreter: a sink as it is, or an
+# OutputSink writing to a file-like object or fd
+def make_sink(output):
+    if isinstance(output, (OutputSink, ConsoleSink)):
+        return output
+    return OutputSink(output)
+
+
+# The output log get_output() reads: every line when log_size is None, only
+# the last log_size lines otherwise (none at all for 0).
+def make_output_log(log_size):
+    if log_size is None:
+        return []
+    return deque(maxlen=log_size)
+
+
+# Input read lazily from a file, to pass as an interpreter's inp instead of a
+# list of lines. source is a path, an fd, or a binary or text file-like
+# object, read block_size bytes at a time; with use_mmap, a path or fd of a
+# regular file is mapped into memory and read from there instead. read_line()
+# returns the next line without its line ending, or None once the input has
+# run out, like a list of lines does. A file opened from a path is closed then.
+class FileInput:
+    def __init__(
+        self, source, block_size=DEFAULT_BLOCK_SIZE, use_mmap=False, encoding="utf-8"
+    ):
+        self.block_size = block_size
+        self.encoding = encoding
+        self.lines = []  # the lines of the last block read
+        self.index = 0  # the next one read_line() returns
+        self.carry = b""  # the start of a line the last block cut off
+        self.done = False
+        self.file = None  # a file opened here, closed at the end of input
+        self.map = None
+        self.offset = 0
+        if isinstance(source, str):
+            self.file = open(source, "rb")
+            source = self.file
+        if use_mmap:
+            fd = source if isinstance(source, int) else source.fileno()
+            if os.fstat(fd).st_size > 0:
+                self.map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            self.__read = self.__read_map
+        elif isinstance(source, int):
+            self.fd = source
+            self.__read = self.__read_fd
+        else:
+            # text streams like sys.stdin are read through their binary buffer
+            self.stream = getattr(source, "buffer", source)
+            if isinstance(self.stream, io.TextIOBase):
+                self.carry = ""
+            self.__read = self.__read_stream
+
+    def read_line(self):
+        index = self.index
+        if index < len(self.lines):
+            self.index = index + 1
+            return self.lines[index]
+        return self.__next_block()
+
+    def close(self):
+        self.done = True
+        self.lines = []
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    # reads blocks until one finishes a line, and returns its first line
+    def __next_block(self):
+        while not self.done:
+            block = self.__read(self.block_size)
+            if block:
+                data = self.carry + block
+                end = data.rfind("\n" if isinstance(data, str) else b"\n")
+                if end < 0:
+                    self.carry = data
+                    continue
+                self.carry = data[end + 1 :]
+                data = data[: end + 1]
+            else:
+                # the last line, if the input doesn't end with a line ending
+                data = self.carry
+                self.close()
+                if not data:
+                    return None
+            if not isinstance(data, str):
+                data = data.decode(self.encoding)
+            if "\r" in data:
+                data = data.replace("\r\n", "\n")
+            lines = data.split("\n")
+            if not lines[-1]:
+                lines.pop()
+            self.lines = lines
+            self.index = 1
+            return lines[0]
+        return None
+
+    def __read_map(self, size):
+        if self.map is None:
+            return b""
+        start = self.offset
+        self.offset = start + size
+        return self.map[start : start + size]
+
+    def __read_fd(self, size):
+        return os.read(self.fd, size)
+
+    def __read_stream(self, size):
+        return self.stream.read(size)
@@ -1,4 +1,10 @@
-from ply import lex
+import os
+import re
+import sys
+
+# In optimized mode (python -O or BREWIN_OPTIMIZE=1) PLY skips validating the
+# lexer rules and grammar and trusts the prebuilt tables in parsetab.py
+OPTIMIZE = sys.flags.optimize > 0 or os.environ.get("BREWIN_OPTIMIZE") == "1"
 
 reserved = (
     "FUNC",
@@ -126,5 +132,147 @@ def t_error(t):
     t.lexer.skip(1)
 
 
-# Build the lexer
-lex.lex()
+# The tokenizer. The t_ rules above are the reference definition of the token
+# language (and what yacc reads the token names from); tokenize() produces
+# exactly the tokens PLY would build from them, with the same values, line
+# numbers and "Illegal character" reports, but in a single left-to-right pass:
+# comments and strings are closed with str.find instead of a backtracking regex
+# and every other token is picked by its first character.
+
+# rules are tried in the same order PLY tries them: longest operator first
+TWO_CHAR_OPS = {
+    "||": "OR",
+    "&&": "AND",
+    "==": "EQ",
+    ">=": "GREATER_EQ",
+    "<=": "LESS_EQ",
+    "!=": "NOT_EQ",
+}
+
+ONE_CHAR_OPS = {
+    "(": "LPAREN",
+    ")": "RPAREN",
+    "{": "LBRACE",
+    "}": "RBRACE",
+    ".": "DOT",
+    "+": "PLUS",
+    "-": "MINUS",
+    "*": "MULTIPLY",
+    "@": "AT",
+    ",": "COMMA",
+    ";": "SEMI",
+    ">": "GREATER",
+    "<": "LESS",
+    "=": "ASSIGN",
+    "/": "DIVIDE",
+    "!": "NOT",
+}
+
+NAME_START = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_")
+TWO_CHAR_START = frozenset(op[0] for op in TWO_CHAR_OPS)
+OP_START = frozenset(ONE_CHAR_OPS) | TWO_CHAR_START
+
+_match_name = re.compile(t_NAME.__doc__).match
+_match_number = re.compile(t_NUMBER.__doc__).match
+_skip_blanks = re.compile(f"[{t_ignore}]+").match
+_skip_newlines = re.compile(t_newline.__doc__).match
+
+
+# the same fields as PLY's LexToken, which is all yacc looks at
+class Token:
+    __slots__ = ("type", "value", "lineno", "lexpos", "lexer")
+
+    def __init__(self, type, value, lineno, lexpos):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.lexpos = lexpos
+
+    def __repr__(self):
+        return f"LexToken({self.type},{self.value!r},{self.lineno},{self.lexpos})"
+
+
+def tokenize(source, lineno=1):
+    pos = 0
+    end = len(source)
+    find = source.find
+    count = source.count
+    while pos < end:
+        c = source[pos]
+        if c in NAME_START:
+            name = _match_name(source, pos).group()
+            yield Token(reserved_map.get(name, "NAME"), name, lineno, pos)
+            pos += len(name)
+        elif c == " " or c == "\t":
+            pos = _skip_blanks(source, pos).end()
+        elif c in OP_START:
+            if c == "/" and source.startswith("*", pos + 1):
+                close = find("*/", pos + 2)
+                if close != -1:
+                    lineno += count("\n", pos, close)
+                    pos = close + 2
+                    continue
+            if c in TWO_CHAR_START:
+                op = source[pos : pos + 2]
+                if op in TWO_CHAR_OPS:
+                    yield Token(TWO_CHAR_OPS[op], op, lineno, pos)
+                    pos += 2
+                    continue
+            if c in ONE_CHAR_OPS:
+                yield Token(ONE_CHAR_OPS[c], c, lineno, pos)
+            else:
+                print(f"Illegal character {c}")
+            pos += 1
+        elif c == "\n":
+            newlines = _skip_newlines(source, pos).end()
+            lineno += newlines - pos
+            pos = newlines
+        elif c.isdecimal():
+            digits = _match_number(source, pos).group()
+            yield Token("NUMBER", int(digits), lineno, pos)
+            pos += len(digits)
+        elif c == '"':
+            # a string can't span lines; an unclosed one lexes as a lone quote
+            close = find('"', pos + 1)
+            if close == -1 or find("\n", pos + 1, close) != -1:
+                yield Token('"', '"', lineno, pos)
+                pos += 1
+            else:
+                yield Token("STRING", source[pos + 1 : close], lineno, pos)
+                pos = close + 1
+        else:
+            print(f"Illegal character {c}")
+            pos += 1
+
+
+# Adapts tokenize() to the lexer interface yacc drives: input() then token()
+# until it returns None
+class Tokenizer:
+    def __init__(self):
+        self.__tokens = iter(())
+
+    def input(self, source):
+        self.__tokens = tokenize(source)
+
+    def token(self):
+        return next(self.__tokens, None)
+
+
+def get_lexer():
+    return Tokenizer()
+
+
+# The PLY lexer built from the same rules, kept as the reference tokenize() is
+# checked against. It's built the first time it's needed instead of at import
+# time, so importing this module (or brewparse) stays cheap.
+_ply_lexer = None
+
+
+def get_ply_lexer():
+    global _ply_lexer
+    if _ply_lexer is None:
+        from ply import lex
+
+        # an empty lextab keeps PLY from reading or writing a lextab.py module
+        _ply_lexer = lex.lex(module=sys.modules[__name__], optimize=OPTIMIZE, lextab="")
+    return _ply_lexer
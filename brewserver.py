@@ -0,0 +1,496 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import stat
+import sys
+import time
+
+from brewcache import DEFAULT_CACHE_DIR, ParseCache
+from brewio import OutputSink
+from brewparse import get_parser
+from interpreterv4 import Interpreter
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_QUEUE_SIZE = 64
+STREAM_BUFFER_SIZE = 4 * 1024
+MESSAGE_LIMIT = 64 * 1024 * 1024  # the longest request or message, in bytes
+RECURSION_LIMIT = 10000
+LIMITS = ("max_steps", "max_growth", "max_depth")  # the Interpreter's budget
+# seconds to wait before trying again to start a worker that failed to start,
+# doubling up to the most after each failure
+RESTART_DELAY = 0.1
+MAX_RESTART_DELAY = 5.0
+
+
+# A long-lived Brewin# service: programs are sent over a Unix socket and run
+# by a pool of worker processes that have already imported the interpreter,
+# built the parser and opened the parse cache, so a request only pays for
+# running its program.
+#
+# Clients send one JSON request per line:
+#   {"source": "...", "input": ["line", ...], "timeout": 2.5,
+#    "engine": "vm", "optimize": true}
+# where everything but source is optional (a timeout has to be a positive
+# number of seconds, and can only shorten the server's). The server answers each request,
+# in order, with zero or more {"output": ["line", ...]} messages as the
+# program prints, then
+#   {"done": true, "error": ..., "line": ..., "message": ..., "seconds": ...}
+# error is the name of the program's ErrorType, the class name of any other
+# exception that stopped it, or one of the server's own:
+#   BAD_REQUEST   the request isn't a JSON object with a source string, or
+#                 its timeout isn't a positive number
+#   BUSY          more requests are waiting than the server queues
+#   TIMEOUT       the program ran past its timeout; its worker is replaced
+#   WORKER_ERROR  the worker running it died; it's replaced
+# A worker is replaced in the background, after the request has its answer,
+# and a replacement that fails to start is retried until one does, so the
+# pool stays at its size.
+#
+# Every program runs with the server's limits (max_steps, max_growth and
+# max_depth, see budgetv4.Budget), which requests can't change; a program
+# that goes past one ends with a RESOURCE_ERROR and its worker carries on.
+#
+# Backpressure: a connection's next request isn't read until the last one is
+# answered, output is only read from a worker as fast as its client takes it,
+# and at most workers + queue_size requests are waiting or running at once.
+
+
+# Sends a request's output back to the server whenever it's flushed, as an
+# {"output": [...]} message
+class ReplySink(OutputSink):
+    def __init__(self, replies, buffer_size=STREAM_BUFFER_SIZE):
+        super().__init__(None, buffer_size)
+        self.replies = replies
+
+    def flush(self):
+        if not self.pending:
+            return
+        lines = self.pending
+        self.pending = []
+        self.pending_size = 0
+        send_message(self.replies, {"output": lines})
+
+
+def send_message(stream, message):
+    stream.write(json.dumps(message) + "\n")
+    stream.flush()
+
+
+# the {"done": ...} message for a request that ended with one of the server's
+# own errors
+def done(error, message):
+    return {"done": True, "error": error, "line": None, "message": message}
+
+
+# runs one request in a worker; output is sent as it's flushed and the
+# {"done": ...} message is returned
+def run_request(request, options, parse_cache, replies):
+    interpreter = None
+    # the parser prints where a syntax error is; it goes in the message
+    stray = io.StringIO()
+    start = time.perf_counter()
+    try:
+        interpreter = Interpreter(
+            inp=request.get("input") or None,
+            engine=request.get("engine", options["engine"]),
+            optimize=request.get("optimize", options["optimize"]),
+            parse_cache=parse_cache,
+            output=ReplySink(replies),
+            log_size=0,
+            **options["limits"],
+        )
+        with contextlib.redirect_stdout(stray):
+            interpreter.run(request["source"])
+        error, line, message = None, None, None
+    except Exception as exception:
+        error_type, line = None, None
+        if interpreter is not None:
+            error_type, line = interpreter.get_error_type_and_line()
+        if error_type is not None:
+            error = error_type.name
+        else:
+            error = type(exception).__name__
+        message = stray.getvalue().strip() or str(exception)
+    return {
+        "done": True,
+        "error": error,
+        "line": line,
+        "message": message,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+# The loop of a worker process: requests come in on stdin and replies go out
+# on stdout. Its fds 0 and 1 are pointed elsewhere first, so nothing a
+# program does (reading input it wasn't given, say) touches either one.
+def run_worker(engine, optimize, cache_dir, limits):
+    requests = os.fdopen(os.dup(0), "r", encoding="utf-8")
+    replies = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.close(null_fd)
+    os.dup2(2, 1)
+
+    sys.setrecursionlimit(RECURSION_LIMIT)
+    options = {"engine": engine, "optimize": optimize, "limits": limits}
+    parse_cache = ParseCache(cache_dir) if cache_dir else None
+    get_parser()
+    send_message(replies, {"ready": True})
+    for line in requests:
+        request = json.loads(line)
+        send_message(replies, run_request(request, options, parse_cache, replies))
+
+
+class WorkerError(Exception):
+    pass
+
+
+# The server's end of a worker process
+class Worker:
+    def __init__(self, options):
+        self.options = options
+        self.process = None
+
+    async def start(self):
+        args = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--worker",
+            "--engine",
+            self.options["engine"],
+        ]
+        if not self.options["optimize"]:
+            args.append("--no-optimize")
+        if self.options["cache_dir"]:
+            args += ["--cache-dir", self.options["cache_dir"]]
+        else:
+            args.append("--no-cache")
+        for name, limit in self.options["limits"].items():
+            args += ["--" + name.replace("_", "-"), str(limit)]
+        self.process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=MESSAGE_LIMIT,
+        )
+        await self.__receive()
+
+    # sends the request to the worker, passes each output message to forward
+    # and returns the {"done": ...} message
+    async def run(self, request, forward):
+        try:
+            self.process.stdin.write(json.dumps(request).encode("utf-8") + b"\n")
+            await self.process.stdin.drain()
+        except ConnectionError:
+            raise WorkerError("Worker exited")
+        while True:
+            message = await self.__receive()
+            if "output" not in message:
+                return message
+            await forward(message)
+
+    async def kill(self):
+        if self.process is None:
+            return
+        if self.process.returncode is None:
+            self.process.kill()
+        await self.process.wait()
+
+    async def __receive(self):
+        try:
+            line = await self.process.stdout.readline()
+        except ValueError:
+            raise WorkerError("Worker sent a message that's too long")
+        if not line:
+            raise WorkerError("Worker exited")
+        return json.loads(line)
+
+
+class InterpreterServer:
+    # workers defaults to one per core. timeout is the longest a program can
+    # run (a request can ask for less). cache_dir=None runs without a parse
+    # cache. limits are the Interpreter's max_steps, max_growth and max_depth
+    # for every program.
+    def __init__(
+        self,
+        path,
+        workers=None,
+        timeout=DEFAULT_TIMEOUT,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        engine="tree",
+        optimize=True,
+        cache_dir=DEFAULT_CACHE_DIR,
+        **limits,
+    ):
+        if engine not in Interpreter.ENGINES:
+            raise ValueError(f"Unknown engine {engine}")
+        for name in limits:
+            if name not in LIMITS:
+                raise TypeError(f"Unknown limit {name}")
+        self.path = path
+        self.num_workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_pending = self.num_workers + queue_size
+        self.options = {
+            "engine": engine,
+            "optimize": optimize,
+            "cache_dir": cache_dir,
+            "limits": limits,
+        }
+        self.pending = 0  # requests waiting for a worker or running
+        self.idle = None
+        self.workers = []
+        self.clients = set()  # the task serving each connection
+        self.restarts = set()  # the task replacing each worker that's gone
+        self.server = None
+
+    async def start(self):
+        self.idle = asyncio.Queue()
+        self.workers = [Worker(self.options) for _ in range(self.num_workers)]
+        await asyncio.gather(*(worker.start() for worker in self.workers))
+        for worker in self.workers:
+            self.idle.put_nowait(worker)
+        # a socket left behind by a server that didn't shut down cleanly
+        with contextlib.suppress(FileNotFoundError):
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(
+            self.__serve_client, self.path, limit=MESSAGE_LIMIT
+        )
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        for task in self.clients | self.restarts:
+            task.cancel()
+        await asyncio.gather(*self.clients, *self.restarts, return_exceptions=True)
+        if self.server is not None:
+            await self.server.wait_closed()
+        await asyncio.gather(*(worker.kill() for worker in self.workers))
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+    async def __serve_client(self, reader, writer):
+        self.clients.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = self.__parse_request(line)
+                if request is None:
+                    message = (
+                        "Requests are JSON objects with a source string and "
+                        "an optional positive timeout"
+                    )
+                    await self.__reply(writer, done("BAD_REQUEST", message))
+                    continue
+                await self.__handle(request, writer)
+        except (ConnectionError, ValueError):
+            pass  # the client went away, or sent a line that's too long
+        except asyncio.CancelledError:
+            pass  # the server is closing
+        finally:
+            self.clients.discard(asyncio.current_task())
+            writer.close()
+
+    def __parse_request(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(request, dict) or not isinstance(request.get("source"), str):
+            return None
+        timeout = request.get("timeout")
+        if timeout is not None and (
+            isinstance(timeout, bool)
+            or not isinstance(timeout, (int, float))
+            or not timeout > 0
+        ):
+            return None
+        return request
+
+    async def __handle(self, request, writer):
+        if self.pending >= self.max_pending:
+            await self.__reply(writer, done("BUSY", "Too many requests waiting"))
+            return
+
+        client_gone = False
+
+        # output goes to the client as it comes; if the client is gone the
+        # rest of it is still read, so the worker finishes the request
+        async def forward(message):
+            nonlocal client_gone
+            if client_gone:
+                return
+            try:
+                await self.__reply(writer, message)
+            except ConnectionError:
+                client_gone = True
+
+        self.pending += 1
+        try:
+            worker = await self.idle.get()
+            timeout = min(request.get("timeout") or self.timeout, self.timeout)
+            try:
+                result = await asyncio.wait_for(worker.run(request, forward), timeout)
+            except asyncio.TimeoutError:
+                self.__replace(worker)
+                result = done("TIMEOUT", f"Ran for more than {timeout}s")
+            except WorkerError as exception:
+                self.__replace(worker)
+                result = done("WORKER_ERROR", str(exception))
+            else:
+                self.idle.put_nowait(worker)
+        finally:
+            self.pending -= 1
+        if client_gone:
+            raise ConnectionResetError()
+        await self.__reply(writer, result)
+
+    # kills a worker and starts another in its place, which goes in the idle
+    # queue once it's ready
+    def __replace(self, worker):
+        task = asyncio.create_task(self.__restart(worker))
+        self.restarts.add(task)
+        task.add_done_callback(self.restarts.discard)
+
+    async def __restart(self, worker):
+        await worker.kill()
+        delay = RESTART_DELAY
+        while True:
+            replacement = Worker(self.options)
+            try:
+                await replacement.start()
+                break
+            except (WorkerError, OSError) as exception:
+                print(
+                    f"Couldn't start a worker ({exception}), trying again in "
+                    f"{delay}s",
+                    file=sys.stderr,
+                )
+                await replacement.kill()
+            except asyncio.CancelledError:
+                await replacement.kill()
+                raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+        self.workers[self.workers.index(worker)] = replacement
+        self.idle.put_nowait(replacement)
+
+    async def __reply(self, writer, message):
+        writer.write(json.dumps(message).encode("utf-8") + b"\n")
+        await writer.drain()
+
+
+# A connection to an InterpreterServer
+class Client:
+    def __init__(self, path):
+        self.path = path
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(
+            self.path, limit=MESSAGE_LIMIT
+        )
+
+    # runs a program and returns (output lines, the {"done": ...} message);
+    # options are any of the request's other fields
+    async def run(self, source, inp=None, **options):
+        request = dict(options, source=source)
+        if inp is not None:
+            request["input"] = inp
+        self.writer.write(json.dumps(request).encode("utf-8") + b"\n")
+        await self.writer.drain()
+        output = []
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError("Server closed the connection")
+            message = json.loads(line)
+            if "output" not in message:
+                return output, message
+            output.extend(message["output"])
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def serve(path, **options):
+    server = InterpreterServer(path, **options)
+    await server.start()
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve Brewin# programs over a Unix socket"
+    )
+    parser.add_argument("path", nargs="?", help="the socket to listen on")
+    parser.add_argument(
+        "-j", "--workers", type=int, help="worker processes (default: one per core)"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds per program"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help="requests that can wait for a worker",
+    )
+    parser.add_argument("--engine", default="tree", help="tree, vm or closure")
+    parser.add_argument(
+        "--no-optimize", action="store_true", help="skip the optimizer pass"
+    )
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="parse cache")
+    parser.add_argument("--no-cache", action="store_true", help="don't cache parses")
+    parser.add_argument("--max-steps", type=int, help="steps each program can run")
+    parser.add_argument(
+        "--max-growth", type=int, help="bytes the process can grow by per program"
+    )
+    parser.add_argument("--max-depth", type=int, help="how deep calls can go")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    limits = {}
+    for name in LIMITS:
+        if getattr(args, name) is not None:
+            limits[name] = getattr(args, name)
+    if args.worker:
+        run_worker(args.engine, not args.no_optimize, cache_dir, limits)
+        return
+    if args.path is None:
+        parser.error("the socket path is required")
+    try:
+        asyncio.run(
+            serve(
+                args.path,
+                workers=args.workers,
+                timeout=args.timeout,
+                queue_size=args.queue_size,
+                engine=args.engine,
+                optimize=not args.no_optimize,
+                cache_dir=cache_dir,
+                **limits,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
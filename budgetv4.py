@@ -0,0 +1,162 @@
+import os
+import sys
+
+from intbase import ErrorType, InterpreterBase
+from quickenv4 import QUICK_OPS, concat_strings, multiply_ints
+from type_valuev4 import Type
+
+# how many steps can go by between checks of the budget
+CHECK_INTERVAL = 10000
+PROC_STATM = "/proc/self/statm"
+
+
+# Limits on how much a program can do, for running programs that can't be
+# trusted to stop (or to stay small) on their own. Going past one stops the
+# program with a RESOURCE_ERROR.
+#
+# max_steps bounds the steps a program runs, roughly the statements it runs.
+# Steps are only counted where a program can go back over code it has already
+# run: every call counts the statements of its function's body, and every time
+# around a while loop counts the statements of the loop's body (Func.steps,
+# Lambda.steps and While.steps, see body_steps), so a program with no calls or
+# loops runs without counting anything. (The call depth is bounded by each
+# engine with the interpreter's max_depth.)
+#
+# max_growth bounds how many bytes the process's resident set grows by while
+# the program runs. It's a limit on the process, not an account of what the
+# program allocates: in a process that has run other programs, memory they
+# freed but the allocator kept counts as already there, so a program can use
+# that much more before it's stopped (and no more than max_growth past it).
+# It needs /proc/self/statm, so on platforms without it a Budget with
+# max_growth is a ValueError.
+#
+# Checking the budget on every step would slow every program down, so the
+# engines only count down fuel: the steps they're allowed to run before they
+# have to call refuel(), which does the checks and hands out the next
+# CHECK_INTERVAL steps (or however many are left, if that's fewer). The
+# process is only measured then, so a program can overshoot max_growth by
+# whatever it allocates in one interval. That's bounded for everything but the
+# operators whose result can be far bigger than their operands (s + s, n * n),
+# so with max_growth those check that they won't make a value bigger than
+# max_growth before they make it (see bounded_quick_ops and bound_ops).
+# Without any limits, the fuel never runs out.
+class Budget:
+    def __init__(self, interpreter, max_steps=None, max_growth=None):
+        self.interpreter = interpreter
+        self.max_steps = max_steps
+        self.max_growth = max_growth
+        self.enabled = max_steps is not None or max_growth is not None
+        self.steps = 0  # the steps run before the current fuel was handed out
+        self.base_size = None  # the process's resident set when the run began
+        if max_growth is not None:
+            self.base_size = process_size()
+        if self.enabled:
+            self.fuel = self.__next_fuel()
+        else:
+            self.fuel = sys.maxsize
+        self.granted = self.fuel
+
+    # called once fuel is below 0: checks the budget, and returns the fuel
+    # for the next steps
+    def refuel(self, fuel):
+        self.steps += self.granted - fuel
+        if self.max_steps is not None and self.steps > self.max_steps:
+            self.interpreter.error(
+                ErrorType.RESOURCE_ERROR,
+                f"Ran for more than {self.max_steps} steps",
+            )
+        if (
+            self.max_growth is not None
+            and process_size() - self.base_size > self.max_growth
+        ):
+            self.interpreter.error(
+                ErrorType.RESOURCE_ERROR,
+                f"Grew the process by more than {self.max_growth} bytes",
+            )
+        self.granted = self.__next_fuel()
+        return self.granted
+
+    def __next_fuel(self):
+        if self.max_steps is None:
+            return CHECK_INTERVAL
+        return min(CHECK_INTERVAL, self.max_steps - self.steps)
+
+
+# the steps of a function or loop body: one for each statement in it, in the
+# branches of its ifs included (whether they run or not) but not in the body
+# of a while loop, which counts its own
+def body_steps(statements):
+    steps = len(statements)
+    for statement in statements:
+        if statement.elem_type == InterpreterBase.IF_DEF:
+            steps += body_steps(statement.statements)
+            if statement.else_statements is not None:
+                steps += body_steps(statement.else_statements)
+    return steps
+
+
+# roughly how many bytes the result of a string + and of an int * take
+def concat_size(x, y):
+    return len(x) + len(y)
+
+
+def product_size(x, y):
+    return (x.bit_length() + y.bit_length()) // 8
+
+
+# (operator, type) -> the size of its result, for the operators that bound
+GROWING_OPS = {("+", Type.STRING): concat_size, ("*", Type.INT): product_size}
+
+
+def value_too_big(error, max_size):
+    error(ErrorType.RESOURCE_ERROR, f"Made a value bigger than {max_size} bytes")
+
+
+# quickenv4.QUICK_OPS, with the fast paths of GROWING_OPS checking the size
+# of their result first
+def bounded_quick_ops(max_size, error):
+    def bounded_concat(x, y):
+        if concat_size(x, y) > max_size:
+            value_too_big(error, max_size)
+        return concat_strings(x, y)
+
+    def bounded_multiply(x, y):
+        if product_size(x, y) > max_size:
+            value_too_big(error, max_size)
+        return multiply_ints(x, y)
+
+    quick_ops = dict(QUICK_OPS)
+    quick_ops[("+", Type.STRING, Type.STRING)] = bounded_concat
+    quick_ops[("*", Type.INT, Type.INT)] = bounded_multiply
+    return quick_ops
+
+
+# makes the GROWING_OPS in an interpreter's op_to_lambda check the size of
+# their result first
+def bound_ops(op_to_lambda, max_size, error):
+    for (op, t), size in GROWING_OPS.items():
+        f = op_to_lambda[t][op]
+
+        def bounded_op(x, y, f=f, size=size):
+            if size(x.v, y.v) > max_size:
+                value_too_big(error, max_size)
+            return f(x, y)
+
+        op_to_lambda[t][op] = bounded_op
+
+
+# the size of the process's resident set right now, in bytes. (getrusage only
+# reports the largest it has ever been, which a long-lived process that once
+# ran a big program would never grow past again, so it's no substitute.)
+def process_size():
+    try:
+        with open(PROC_STATM, "rb") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        raise ValueError(f"max_growth needs {PROC_STATM} to measure the process")
+
+
+if hasattr(os, "sysconf"):
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+else:
+    PAGE_SIZE = 4096
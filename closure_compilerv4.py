@@ -0,0 +1,497 @@
+from intbase import InterpreterBase, ErrorType
+from runtimev4 import CompiledRuntime, TailCall, tail_call
+from type_valuev4 import (
+    Object,
+    Cell,
+    Closure,
+    Type,
+    Value,
+    bool_value,
+    copy_value,
+    get_printable,
+    int_value,
+)
+
+
+# Turns every node of a program into a python closure that already holds its
+# children, operator function and names, so running the program never looks
+# at elem_type or reads a node field again.
+#
+# Statements compile to functions that return None to keep going, or the
+# Value being returned by a return statement (or the TailCall that runs in
+# the call's place, for return f(...) and return o.m(...)). Expressions compile
+# to functions that return a Value. Function bodies are compiled the first
+# time they're called.
+class ClosureCompiler(CompiledRuntime):
+    def __init__(self, interpreter):
+        super().__init__(interpreter)
+        self.body_for_func = {}
+        self.call_base = 0  # the index of the frame of the call that's running
+        self.depth = 0  # how many calls deep the running call is
+        self.max_depth = interpreter.max_depth
+        # function bodies and while loops only count steps against the budget
+        # when it has limits; otherwise they're compiled without it
+        self.budget = interpreter.budget
+        self.fuel = self.budget.fuel
+
+    def run(self, main_closure):
+        self.__call(main_closure, [])
+
+    def __body(self, func_ast):
+        body = self.body_for_func.get(func_ast)
+        if body is None:
+            body = self.__statements(func_ast.statements, func_ast.scoped)
+            if self.budget.enabled:
+                body = self.__charged_body(body, func_ast.steps)
+            self.body_for_func[func_ast] = body
+        return body
+
+    # runs a call, and then each tail call it returns in its place
+    def __call(self, target_closure, args, this=None):
+        env = self.env
+        call_base = self.call_base
+        depth = self.depth + 1
+        if depth > self.max_depth:
+            self.error(ErrorType.RESOURCE_ERROR, "Maximum call depth exceeded")
+        self.depth = depth
+        new_env = self.call_env(target_closure, args, this)
+        carried_env = None
+        while True:
+            self.call_base = len(env.frames)
+            if carried_env is not None:
+                env.push(carried_env)
+            env.push(new_env)
+            return_val = self.__body(target_closure.func_ast)()
+            env.pop()
+            if carried_env is not None:
+                env.pop()
+            if type(return_val) is not TailCall:
+                break
+            target_closure = return_val.target_closure
+            new_env = return_val.callee_env
+            carried_env = return_val.carried_env
+        self.call_base = call_base
+        self.depth = depth - 1
+        if return_val is None:
+            return self.nil_value
+        return return_val
+
+    # makes a call in tail position (see runtimev4.TailCall)
+    def __tail_call(self, target_closure, args, this=None):
+        new_env = self.call_env(target_closure, args, this)
+        return tail_call(self.env, self.call_base, target_closure, new_env)
+
+    # scoped is whether the statements run in a frame of their own (see
+    # optimizerv4)
+    def __statements(self, statements, scoped):
+        env = self.env
+        compiled = tuple(self.__statement(statement) for statement in statements)
+        compiled = tuple(statement for statement in compiled if statement is not None)
+
+        if not scoped:
+
+            def run_unscoped_statements():
+                for statement in compiled:
+                    return_val = statement()
+                    if return_val is not None:
+                        return return_val
+                return None
+
+            return run_unscoped_statements
+
+        def run_statements():
+            env.push()
+            for statement in compiled:
+                return_val = statement()
+                if return_val is not None:
+                    env.pop()
+                    return return_val
+            env.pop()
+            return None
+
+        return run_statements
+
+    def __statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_DEF or kind == InterpreterBase.MCALL_DEF:
+            call = self.__expr(statement)
+
+            def call_statement():
+                call()
+
+            return call_statement
+        if kind == "=":
+            return self.__assign(statement)
+        if kind == InterpreterBase.RETURN_DEF:
+            return self.__return(statement)
+        if kind == InterpreterBase.IF_DEF:
+            return self.__if(statement)
+        if kind == InterpreterBase.WHILE_DEF:
+            return self.__while(statement)
+        # any other expression statement is never evaluated by the interpreter
+        return None
+
+    def __assign(self, assign_ast):
+        env = self.env
+        expr = self.__expr(assign_ast.expression)
+        var_name = assign_ast.name
+        slot = assign_ast.slot
+        get_slot = env.get_slot
+
+        if "." in var_name:
+            field_name = var_name.split(".")[1]
+            error = self.error
+
+            def assign_field():
+                src = expr()
+                target = get_slot(slot)
+                if target is None:
+                    error(ErrorType.NAME_ERROR, f"no field found")
+                elif not isinstance(target.value.v, Object):
+                    error(ErrorType.TYPE_ERROR, f"no object found")
+                if field_name == "proto" and not isinstance(src.v, Object):
+                    error(
+                        ErrorType.TYPE_ERROR, "proto can only be assigned to an Object"
+                    )
+                target.value.v.set_field(field_name, src)
+
+            return assign_field
+
+        def assign_var():
+            src = expr()
+            target = get_slot(slot)
+            if target is None:
+                env.create_slot(slot, Cell(src))
+            else:
+                if target.value.t == Type.CLOSURE and src.t != Type.CLOSURE:
+                    target.value.v.set_type(src.t)
+                target.set(src)
+
+        return assign_var
+
+    def __return(self, return_ast):
+        expr_ast = return_ast.expression
+        if expr_ast is None:
+            nil_value = self.nil_value
+            return lambda: nil_value
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.MCALL_DEF:
+            return self.__mcall(expr_ast, self.__tail_call)
+        if kind == InterpreterBase.FCALL_DEF and expr_ast.name not in (
+            "print",
+            "inputi",
+        ):
+            return self.__fcall(expr_ast, self.__tail_call)
+        expr = self.__expr(expr_ast)
+        return lambda: copy_value(expr())
+
+    def __condition(self, cond_ast, statement_name):
+        cond = self.__expr(cond_ast)
+        error = self.error
+        message = f"Incompatible type for {statement_name} condition"
+
+        def condition():
+            result = cond()
+            if result.t == Type.INT:
+                return result.v != 0
+            if result.t != Type.BOOL:
+                error(ErrorType.TYPE_ERROR, message)
+            return result.v
+
+        return condition
+
+    def __if(self, if_ast):
+        condition = self.__condition(if_ast.condition, "if")
+        statements = self.__statements(if_ast.statements, if_ast.scoped)
+        else_statements = if_ast.else_statements
+
+        if else_statements is None:
+
+            def run_if():
+                if condition():
+                    return statements()
+                return None
+
+            return run_if
+
+        else_statements = self.__statements(else_statements, if_ast.else_scoped)
+
+        def run_if_else():
+            if condition():
+                return statements()
+            return else_statements()
+
+        return run_if_else
+
+    def __while(self, while_ast):
+        condition = self.__condition(while_ast.condition, "while")
+        statements = self.__statements(while_ast.statements, while_ast.scoped)
+        if self.budget.enabled:
+            return self.__charged_while(condition, statements, while_ast.steps)
+
+        def run_while():
+            while condition():
+                return_val = statements()
+                if return_val is not None:
+                    return return_val
+            return None
+
+        return run_while
+
+    # a function body that counts its steps against the budget every call
+    def __charged_body(self, body, steps):
+        budget = self.budget
+
+        def run_charged_body():
+            self.fuel -= steps
+            if self.fuel < 0:
+                self.fuel = budget.refuel(self.fuel)
+            return body()
+
+        return run_charged_body
+
+    # a while loop that counts its steps against the budget each time around
+    def __charged_while(self, condition, statements, steps):
+        budget = self.budget
+
+        def run_charged_while():
+            while True:
+                self.fuel -= steps
+                if self.fuel < 0:
+                    self.fuel = budget.refuel(self.fuel)
+                if not condition():
+                    return None
+                return_val = statements()
+                if return_val is not None:
+                    return return_val
+
+        return run_charged_while
+
+    def __expr(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.NIL_DEF:
+            nil_value = self.nil_value
+            return lambda: nil_value
+        if kind == InterpreterBase.INT_DEF:
+            return self.__const(expr_ast.value)
+        if kind == InterpreterBase.STRING_DEF:
+            return self.__const(expr_ast.value)
+        if kind == InterpreterBase.BOOL_DEF:
+            return self.__const(expr_ast.value)
+        if kind == InterpreterBase.VAR_DEF:
+            return self.__var(expr_ast)
+        if kind == InterpreterBase.FCALL_DEF:
+            return self.__fcall(expr_ast)
+        if kind in self.binary_ops:
+            return self.__binary_op(expr_ast)
+        if kind == InterpreterBase.NEG_DEF:
+            return self.__neg(expr_ast)
+        if kind == InterpreterBase.NOT_DEF:
+            return self.__not(expr_ast)
+        if kind == InterpreterBase.LAMBDA_DEF:
+            env = self.env
+            return lambda: Value(Type.CLOSURE, Closure(expr_ast, env))
+        if kind == InterpreterBase.OBJ_DEF:
+            return lambda: Value(Type.OBJECT, Object())
+        if kind == InterpreterBase.MCALL_DEF:
+            return self.__mcall(expr_ast)
+        return lambda: None
+
+    # Values are immutable, so a literal evaluates to the same Value every time
+    def __const(self, value):
+        return lambda: value
+
+    def __var(self, var_ast):
+        var_name = var_ast.name
+        slot = var_ast.slot
+        get_slot = self.env.get_slot
+
+        if "." in var_name:
+            field_name = var_name.split(".")[1]
+            field_value = self.field_value
+
+            def load_field():
+                return field_value(get_slot(slot), field_name)
+
+            return load_field
+
+        func_value = self.func_value
+
+        def load_var():
+            cell = get_slot(slot)
+            if cell is None:
+                return func_value(var_name)
+            return cell.value
+
+        return load_var
+
+    # the cell a ref param is bound to when var_ast is passed to it
+    def __var_ref(self, var_ast):
+        var_name = var_ast.name
+        slot = var_ast.slot
+        get_slot = self.env.get_slot
+
+        if "." in var_name:
+            field_name = var_name.split(".")[1]
+            field_ref = self.field_ref
+            return lambda: field_ref(get_slot(slot), field_name)
+
+        var_ref = self.var_ref
+        return lambda: var_ref(get_slot(slot), var_name)
+
+    def __binary_op(self, arith_ast):
+        left = self.__expr(arith_ast.op1)
+        right = self.__expr(arith_ast.op2)
+        binary_op = self.binary_ops[arith_ast.elem_type]
+        site = arith_ast.site
+
+        # quickened like Interpreter.__eval_op
+        def quickened_op():
+            left_value = left()
+            right_value = right()
+            if left_value.t is site.left_t and right_value.t is site.right_t:
+                return site.fast(left_value.v, right_value.v)
+            result = binary_op(left_value, right_value)
+            site.observe(left_value.t, right_value.t)
+            return result
+
+        return quickened_op
+
+    def __neg(self, arith_ast):
+        operand = self.__expr(arith_ast.op1)
+        error = self.error
+
+        def neg():
+            value = operand()
+            if value.t != Type.INT:
+                error(ErrorType.TYPE_ERROR, f"Incompatible type for neg operation")
+            return int_value(-value.v)
+
+        return neg
+
+    def __not(self, arith_ast):
+        operand = self.__expr(arith_ast.op1)
+        error = self.error
+
+        def not_():
+            value = operand()
+            if value.t == Type.INT:
+                return bool_value(value.v == 0)
+            if value.t != Type.BOOL:
+                error(ErrorType.TYPE_ERROR, f"Incompatible type for ! operation")
+            return bool_value(not value.v)
+
+        return not_
+
+    # call makes the call once it's resolved: __call, or __tail_call for a
+    # call in tail position
+    def __fcall(self, call_ast, call=None):
+        func_name = call_ast.name
+        args = call_ast.args
+        if func_name == "print":
+            return self.__print(args)
+        if func_name == "inputi":
+            return self.__inputi(args)
+
+        num_args = len(args)
+        target = call_ast.target
+        arg_exprs = self.__args(args)
+        resolve_func = self.resolve_func
+        if call is None:
+            call = self.__call
+
+        if target is None:
+
+            def fcall():
+                target_closure = resolve_func(func_name, num_args)
+                return call(target_closure, arg_exprs(target_closure))
+
+            return fcall
+
+        def linked_fcall():
+            if target.type != Type.CLOSURE:
+                resolve_func(func_name, num_args, target)
+            return call(target, arg_exprs(target))
+
+        return linked_fcall
+
+    def __mcall(self, method_call_ast, call=None):
+        slot = method_call_ast.slot
+        method_name = method_call_ast.name
+        args = method_call_ast.args
+        num_args = len(args)
+        cache = method_call_ast.cache
+        arg_exprs = self.__args(args)
+        get_slot = self.env.get_slot
+        resolve_method = self.resolve_method
+        if call is None:
+            call = self.__call
+
+        def mcall():
+            target_object = get_slot(slot)
+            target_closure = resolve_method(target_object, method_name, num_args, cache)
+            return call(target_closure, arg_exprs(target_closure), target_object)
+
+        return mcall
+
+    # evaluates the actual arguments for a resolved target into the cells the
+    # params are bound to, copying each one that's passed by value right after
+    # it's evaluated. A ref param gets the cell of a variable or field passed
+    # to it, and a new cell for any other expression.
+    def __args(self, args):
+        arg_exprs = []
+        for arg in args:
+            arg_expr = self.__expr(arg)
+            if arg.elem_type == InterpreterBase.VAR_DEF:
+                ref_expr = self.__var_ref(arg)
+            else:
+                ref_expr = self.__new_cell(arg_expr)
+            arg_exprs.append((arg_expr, ref_expr))
+        arg_exprs = tuple(arg_exprs)
+
+        def evaluate_args(target_closure):
+            cells = []
+            for formal_ast, (arg_expr, ref_expr) in zip(
+                target_closure.func_ast.args, arg_exprs
+            ):
+                if formal_ast.elem_type == InterpreterBase.REFARG_DEF:
+                    cells.append(ref_expr())
+                else:
+                    cells.append(Cell(copy_value(arg_expr())))
+            return cells
+
+        return evaluate_args
+
+    def __new_cell(self, expr):
+        return lambda: Cell(expr())
+
+    def __print(self, args):
+        arg_exprs = tuple(self.__expr(arg) for arg in args)
+        output = self.interpreter.output
+        nil_value = self.nil_value
+
+        def call_print():
+            text = ""
+            for arg_expr in arg_exprs:
+                text = text + get_printable(arg_expr())
+            output(text)
+            return nil_value
+
+        return call_print
+
+    def __inputi(self, args):
+        interpreter = self.interpreter
+        error = self.error
+        prompt = self.__expr(args[0]) if len(args) == 1 else None
+        too_many_args = len(args) > 1
+
+        def call_inputi():
+            if prompt is not None:
+                interpreter.output(get_printable(prompt()))
+            elif too_many_args:
+                error(
+                    ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter"
+                )
+            return int_value(int(interpreter.get_input()))
+
+        return call_inputi
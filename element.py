@@ -1,14 +1,33 @@
+from intbase import InterpreterBase
+
+
+# Base class of every AST node. Each kind of node has its own class with
+# __slots__ for its fields, so a node is a small fixed-size object instead of
+# an object plus a dict, and fields are read as plain attributes
+# (call_ast.args). get() and dict are kept for code that still reads nodes by
+# field name.
 class Element:
-    def __init__(self, elem_type, **kwargs):
-        self.elem_type = elem_type
-        self.dict = {}
-        for key, value in kwargs.items():
-            self.dict[key] = value
+    __slots__ = ()
+    fields = ()
 
     def get(self, key):
-        if key not in self.dict:
-            return None
-        return self.dict[key]
+        if key in self.fields:
+            return getattr(self, key)
+        return None
+
+    @property
+    def dict(self):
+        return {key: getattr(self, key) for key in self.fields}
+
+    # values that hold on to a node (like closures) share it when they're deep
+    # copied. Nodes aren't immutable: the optimizer and the resolver fill in
+    # their fields (scoped, slot, value, site, cache, steps, target) before the
+    # program runs, and the only state that changes while it runs is the
+    # type feedback and inline caches of operator and method call sites, which
+    # make those sites faster but never change what they evaluate to. A copy
+    # of the node would have the same fields and behave the same.
+    def __deepcopy__(self, memo):
+        return self
 
     def __str__(self):
         s = f"{self.elem_type}: "
@@ -27,3 +46,238 @@ class Element:
                 return "[" + s[0:-2] + "]"
             return "[" + s + "]"
         return str(v)
+
+
+# Nodes whose class covers a single kind keep elem_type as a class attribute;
+# the others (operators, literals, args) store it per node. Nodes that name a
+# variable also have a slot, filled in by resolverv4.resolve_program.
+
+
+class Program(Element):
+    __slots__ = ("functions", "symbols")
+    fields = ("functions",)
+    elem_type = InterpreterBase.PROGRAM_DEF
+
+    # symbols is the program's resolverv4.SymbolTable, made by
+    # resolverv4.resolve_program
+    def __init__(self, functions):
+        self.functions = functions
+        self.symbols = None
+
+
+class Func(Element):
+    __slots__ = ("name", "args", "statements", "free", "scoped", "steps")
+    fields = ("name", "args", "statements")
+    elem_type = InterpreterBase.FUNC_DEF
+
+    # free is the set of slots a call to the function can read from the
+    # frames below its own, or None if it could read any (see
+    # resolverv4.analyze_captures). scoped is whether the body runs in a
+    # frame of its own, on top of the call's (see optimizerv4). steps is what
+    # a call counts against a budget (see budgetv4.body_steps).
+    def __init__(self, name, args, statements):
+        self.name = name
+        self.args = args
+        self.statements = statements
+        self.free = None
+        self.scoped = True
+        self.steps = 0
+
+
+class Lambda(Element):
+    __slots__ = ("args", "statements", "captures", "free", "scoped", "steps")
+    fields = ("args", "statements")
+    elem_type = InterpreterBase.LAMBDA_DEF
+
+    # captures is the tuple of slots the lambda closes over, or None to close
+    # over every visible variable, and free the same slots as a set, like
+    # Func.free (see resolverv4.analyze_captures). scoped and steps are as in
+    # Func.
+    def __init__(self, args, statements):
+        self.args = args
+        self.statements = statements
+        self.captures = None
+        self.free = None
+        self.scoped = True
+        self.steps = 0
+
+
+# a formal parameter, either ARG_DEF or REFARG_DEF
+class Arg(Element):
+    __slots__ = ("elem_type", "name", "slot")
+    fields = ("name",)
+
+    def __init__(self, elem_type, name):
+        self.elem_type = elem_type
+        self.name = name
+        self.slot = None
+
+
+class Assign(Element):
+    __slots__ = ("name", "expression", "slot")
+    fields = ("name", "expression")
+    elem_type = "="
+
+    def __init__(self, name, expression):
+        self.name = name
+        self.expression = expression
+        self.slot = None
+
+
+class If(Element):
+    __slots__ = (
+        "condition",
+        "statements",
+        "else_statements",
+        "scoped",
+        "else_scoped",
+    )
+    fields = ("condition", "statements", "else_statements")
+    elem_type = InterpreterBase.IF_DEF
+
+    # scoped and else_scoped are whether each branch runs in a frame of its
+    # own (see optimizerv4)
+    def __init__(self, condition, statements, else_statements):
+        self.condition = condition
+        self.statements = statements
+        self.else_statements = else_statements
+        self.scoped = True
+        self.else_scoped = True
+
+
+class While(Element):
+    __slots__ = ("condition", "statements", "scoped", "steps")
+    fields = ("condition", "statements")
+    elem_type = InterpreterBase.WHILE_DEF
+
+    # scoped is whether each run of the body gets a frame of its own (see
+    # optimizerv4), and steps what each time around the loop counts against a
+    # budget (see budgetv4.body_steps)
+    def __init__(self, condition, statements):
+        self.condition = condition
+        self.statements = statements
+        self.scoped = True
+        self.steps = 0
+
+
+class Return(Element):
+    __slots__ = ("expression",)
+    fields = __slots__
+    elem_type = InterpreterBase.RETURN_DEF
+
+    def __init__(self, expression):
+        self.expression = expression
+
+
+# NEG_DEF or NOT_DEF
+class UnaryOp(Element):
+    __slots__ = ("elem_type", "op1")
+    fields = ("op1",)
+
+    def __init__(self, elem_type, op1):
+        self.elem_type = elem_type
+        self.op1 = op1
+
+
+# arithmetic, comparison and logical operators; elem_type is the operator.
+# site is the operator's quickenv4.BinaryOpSite, filled in by
+# resolverv4.resolve_program.
+class BinaryOp(Element):
+    __slots__ = ("elem_type", "op1", "op2", "site")
+    fields = ("op1", "op2")
+
+    def __init__(self, elem_type, op1, op2):
+        self.elem_type = elem_type
+        self.op1 = op1
+        self.op2 = op2
+        self.site = None
+
+
+# INT_DEF, STRING_DEF or BOOL_DEF. value is the literal's runtime Value,
+# filled in by resolverv4.resolve_program.
+class Literal(Element):
+    __slots__ = ("elem_type", "val", "value")
+    fields = ("val",)
+
+    def __init__(self, elem_type, val):
+        self.elem_type = elem_type
+        self.val = val
+        self.value = None
+
+
+class Nil(Element):
+    __slots__ = ()
+    elem_type = InterpreterBase.NIL_DEF
+
+
+class NewObject(Element):
+    __slots__ = ()
+    elem_type = InterpreterBase.OBJ_DEF
+
+
+class Var(Element):
+    __slots__ = ("name", "slot")
+    fields = ("name",)
+    elem_type = InterpreterBase.VAR_DEF
+
+    def __init__(self, name):
+        self.name = name
+        self.slot = None
+
+
+class FCall(Element):
+    __slots__ = ("name", "args", "slot", "target")
+    fields = ("name", "args")
+    elem_type = InterpreterBase.FCALL_DEF
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.slot = None
+        self.target = None
+
+
+class MCall(Element):
+    __slots__ = ("objref", "name", "args", "slot", "cache")
+    fields = ("objref", "name", "args")
+    elem_type = InterpreterBase.MCALL_DEF
+
+    def __init__(self, objref, name, args):
+        self.objref = objref
+        self.name = name
+        self.args = args
+        self.slot = None
+        self.cache = None
+
+
+NODE_CLASSES = {
+    InterpreterBase.PROGRAM_DEF: Program,
+    InterpreterBase.FUNC_DEF: Func,
+    InterpreterBase.LAMBDA_DEF: Lambda,
+    InterpreterBase.ARG_DEF: Arg,
+    InterpreterBase.REFARG_DEF: Arg,
+    "=": Assign,
+    InterpreterBase.IF_DEF: If,
+    InterpreterBase.WHILE_DEF: While,
+    InterpreterBase.RETURN_DEF: Return,
+    InterpreterBase.NEG_DEF: UnaryOp,
+    InterpreterBase.NOT_DEF: UnaryOp,
+    InterpreterBase.INT_DEF: Literal,
+    InterpreterBase.STRING_DEF: Literal,
+    InterpreterBase.BOOL_DEF: Literal,
+    InterpreterBase.NIL_DEF: Nil,
+    InterpreterBase.OBJ_DEF: NewObject,
+    InterpreterBase.VAR_DEF: Var,
+    InterpreterBase.FCALL_DEF: FCall,
+    InterpreterBase.MCALL_DEF: MCall,
+}
+for op in ("+", "-", "*", "/", "==", "!=", "<", "<=", ">", ">=", "&&", "||"):
+    NODE_CLASSES[op] = BinaryOp
+
+
+# builds a node of any kind from its field values, in the order of its fields
+def make_node(elem_type, values):
+    node_class = NODE_CLASSES[elem_type]
+    if "elem_type" in node_class.__slots__:
+        return node_class(elem_type, *values)
+    return node_class(*values)
@@ -1,54 +1,115 @@
+from resolverv4 import SymbolTable
+
+
 # The EnvironmentManager class keeps a mapping between each variable name (aka symbol)
-# in a brewin program and the Value object, which stores a type, and a value.
+# in a brewin program and the Cell that holds its current Value.
+#
+# Brewin# scopes are dynamic: a name refers to its innermost binding on the
+# whole stack of frames, including the frames of the calls below. Rather than
+# searching the frames for it, the environment uses shallow binding: it keeps
+# the innermost binding of every variable, indexed by the variable's slot (see
+# resolverv4), and each frame records the bindings it shadowed so they can be
+# put back when it's popped. Lookups and assignments are a list index no
+# matter how deeply blocks and calls are nested.
+# symbols is the SymbolTable of the program the environment is for, which has
+# a slot for every variable the program names.
 class EnvironmentManager:
-    def __init__(self):
-        self.environment = [{}]
+    def __init__(self, symbols=None):
+        if symbols is None:
+            symbols = SymbolTable()
+        self.symbols = symbols
+        self.values = [None] * len(symbols)  # slot -> innermost Cell, or None
+        # slot -> index of the frame that binds it, or -1
+        self.owners = [-1] * len(symbols)
+        # per frame, (slot, shadowed value, shadowed owner) for every slot
+        # that frame binds
+        self.frames = [[]]
 
-    # returns a VariableDef object
+    # returns the variable's Cell
     def get(self, symbol):
-        for env in reversed(self.environment):
-            if symbol in env:
-                return env[symbol]
+        return self.get_slot(self.symbols.slot(symbol))
 
-        return None
+    def get_slot(self, slot):
+        try:
+            return self.values[slot]
+        except IndexError:
+            return None
 
     def set(self, symbol, value, force_new_var_creation=False):
         if force_new_var_creation:
-            self.environment[-1][symbol] = value
-            return
-
-        for env in reversed(self.environment):
-            if symbol in env:
-                env[symbol] = value
-                return
+            self.create_slot(self.symbols.slot(symbol), value)
+        else:
+            self.set_slot(self.symbols.slot(symbol), value)
 
-        # symbol not found anywhere in the environment
-        self.environment[-1][symbol] = value
+    # rebinds the innermost binding of a slot, or creates one in the top-most
+    # frame if it isn't bound anywhere
+    def set_slot(self, slot, value):
+        if self.get_slot(slot) is None:
+            self.create_slot(slot, value)
+        else:
+            self.values[slot] = value
 
     # create a new symbol in the top-most environment, regardless of whether that symbol exists
     # in a lower environment
     def create(self, symbol, value):
-        self.environment[-1][symbol] = value
+        self.create_slot(self.symbols.slot(symbol), value)
 
-    # used when we enter a nested block to create a new environment for that block
-    def push(self, env = None):
-        if env is None:
-            self.environment.append({})  # [{}] -> [{}, {}]
-        else:
-            self.environment.append(env)
+    def create_slot(self, slot, value):
+        values = self.values
+        if slot >= len(values):
+            missing = slot + 1 - len(values)
+            values.extend([None] * missing)
+            self.owners.extend([-1] * missing)
+        top = len(self.frames) - 1
+        owner = self.owners[slot]
+        if owner != top:
+            self.frames[top].append((slot, values[slot], owner))
+            self.owners[slot] = top
+        values[slot] = value
+
+    # used when we enter a nested block to create a new environment for that
+    # block; bindings optionally maps slots to the values the new frame starts
+    # with
+    def push(self, bindings=None):
+        self.frames.append([])
+        if bindings is not None:
+            for slot, value in bindings.items():
+                self.create_slot(slot, value)
 
     # used when we exit a nested block to discard the environment for that block
     def pop(self):
-        self.environment.pop()
+        values = self.values
+        owners = self.owners
+        for slot, value, owner in self.frames.pop():
+            values[slot] = value
+            owners[slot] = owner
+
+    # {slot: cell} for every visible variable that frame base or one above it
+    # binds
+    def bindings_from(self, base):
+        values = self.values
+        owners = self.owners
+        bindings = {}
+        for index in range(base, len(self.frames)):
+            for slot, _, _ in self.frames[index]:
+                if owners[slot] == index:
+                    bindings[slot] = values[slot]
+        return bindings
+
+    # (slot, cell) for every variable that's visible right now, innermost
+    # frame first. Every binding was logged by the frame that made it, and the
+    # visible one is the one whose frame still owns the slot.
+    def bindings(self):
+        values = self.values
+        owners = self.owners
+        for index in range(len(self.frames) - 1, -1, -1):
+            for slot, _, _ in self.frames[index]:
+                if owners[slot] == index:
+                    yield (slot, values[slot])
 
     def __enumerate(self):
-        captured_so_far = set()
-        for captured in reversed(self.environment):
-            for var_name, value in captured.items():
-                if var_name in captured_so_far:
-                    continue
-                captured_so_far.add(var_name)
-                yield (var_name, value)
+        for slot, value in self.bindings():
+            yield (self.symbols.name(slot), value)
 
     def __iter__(self):
         return self.__enumerate()
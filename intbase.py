@@ -1,11 +1,14 @@
 # Base class for our interpreter
 from enum import Enum
 
+from brewio import ConsoleSink, FileInput, make_output_log, make_sink
+
 
 class ErrorType(Enum):
     TYPE_ERROR = 1
     NAME_ERROR = 2  # if a variable or function name can't be found
     FAULT_ERROR = 3  # used if an object reference is null and used to make a call
+    RESOURCE_ERROR = 4  # if a program goes past a limit it runs under
     # Add others here
 
 
@@ -34,14 +37,27 @@ class InterpreterBase:
     NOT_DEF = "!"
 
     # methods
-    def __init__(self, console_output=True, inp=None):
+    # output is where output goes: a brewio sink, or a file-like object or fd
+    # that a buffered brewio.OutputSink writes to. Without one, output is
+    # printed line by line if console_output is set. log_size bounds the log
+    # get_output() returns (see brewio.make_output_log).
+    def __init__(self, console_output=True, inp=None, output=None, log_size=None):
         self.console_output = console_output
-        self.inp = inp  # if not none, then read input from passed-in list
+        # if not none, then read input from passed-in list, or from a
+        # brewio.FileInput
+        self.inp = inp
+        if output is not None:
+            self.sink = make_sink(output)
+        elif console_output:
+            self.sink = ConsoleSink()
+        else:
+            self.sink = None
+        self.log_size = log_size
         self.reset()
 
     # Call to reset I/O for another run of the program
     def reset(self):
-        self.output_log = []
+        self.output_log = make_output_log(self.log_size)
         self.input_cursor = 0
         self.error_type = None
         self.error_line = None
@@ -52,7 +68,10 @@ class InterpreterBase:
 
     def get_input(self):
         if not self.inp:
+            self.flush_output()  # so a prompt shows up before we wait
             return input()  # Get input from keyboard if not input list provided
+        if isinstance(self.inp, FileInput):
+            return self.inp.read_line()
 
         if self.input_cursor < len(self.inp):
             cur_input = self.inp[self.input_cursor]
@@ -75,12 +94,19 @@ class InterpreterBase:
         raise Exception(f"{error_type} on line {line_num}{description}")
 
     def output(self, v):
-        if self.console_output:
-            print(v)
+        if self.sink is not None:
+            self.sink.write(v)
         self.output_log.append(v)
 
+    # writes out whatever output the sink is still holding on to
+    def flush_output(self):
+        if self.sink is not None:
+            self.sink.flush()
+
     def get_output(self):
-        return self.output_log
+        if isinstance(self.output_log, list):
+            return self.output_log
+        return list(self.output_log)
 
     def get_error_type_and_line(self):
         return self.error_type, self.error_line
@@ -1,10 +1,29 @@
-import copy
 from enum import Enum
 
+from brewio import OutputSink
 from brewparse import parse_program
+from budgetv4 import Budget, bound_ops, bounded_quick_ops
+from closure_compilerv4 import ClosureCompiler
 from env_v4 import EnvironmentManager
 from intbase import InterpreterBase, ErrorType
-from type_valuev4 import Object, Closure, Type, Value, create_value, get_printable
+from optimizerv4 import optimize_program
+from quickenv4 import QUICK_OPS
+from resolverv4 import THIS_SLOT, link_calls, resolve_program
+from runtimev4 import TailCall, tail_call
+from type_valuev4 import (
+    Object,
+    Cell,
+    Closure,
+    Type,
+    Value,
+    NIL_VALUE,
+    TRUE_VALUE,
+    bool_value,
+    copy_value,
+    get_printable,
+    int_value,
+)
+from vmv4 import DEFAULT_MAX_DEPTH, VirtualMachine
 
 
 class ExecStatus(Enum):
@@ -14,51 +33,120 @@ class ExecStatus(Enum):
 
 # Main interpreter class
 class Interpreter(InterpreterBase):
-    # constants
-    NIL_VALUE = create_value(InterpreterBase.NIL_DEF)
-    TRUE_VALUE = create_value(InterpreterBase.TRUE_DEF)
+    # constants; Values are immutable, so these are shared by every
+    # variable, param and field that holds nil or true
+    NIL_VALUE = NIL_VALUE
+    TRUE_VALUE = TRUE_VALUE
     BIN_OPS = {"+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<=", "||", "&&"}
+    # "tree" walks the AST directly, "vm" compiles it to bytecode first and
+    # "closure" compiles each AST node to a python closure first
+    ENGINES = {"tree", "vm", "closure"}
 
     # methods
-    def __init__(self, console_output=True, inp=None, trace_output=False):
-        super().__init__(console_output, inp)
+    # parse_cache is an optional brewcache.ParseCache that run() parses through.
+    # optimize=False runs programs without optimizerv4's pass.
+    # max_depth is how deep calls can go. The vm engine's calls don't use the
+    # python stack; on the others, going past python's recursion limit is
+    # reported the same way.
+    # max_steps and max_growth are a budgetv4.Budget for each run.
+    # output and log_size are as in InterpreterBase, except that console
+    # output goes through a buffered brewio.OutputSink by default, which run()
+    # flushes before it returns.
+    def __init__(
+        self,
+        console_output=True,
+        inp=None,
+        trace_output=False,
+        engine="tree",
+        parse_cache=None,
+        optimize=True,
+        max_depth=DEFAULT_MAX_DEPTH,
+        output=None,
+        log_size=None,
+        max_steps=None,
+        max_growth=None,
+    ):
+        if output is None and console_output:
+            output = OutputSink()
+        super().__init__(console_output, inp, output, log_size)
+        if engine not in Interpreter.ENGINES:
+            raise ValueError(f"Unknown engine {engine}")
         self.trace_output = trace_output
+        self.engine = engine
+        self.parse_cache = parse_cache
+        self.optimize = optimize
+        self.max_depth = max_depth
+        self.max_steps = max_steps
+        self.max_growth = max_growth
+        self.call_base = 0  # the index of the frame of the call that's running
         self.__setup_ops()
+        self.quick_ops = QUICK_OPS
+        if max_growth is not None:
+            bound_ops(self.op_to_lambda, max_growth, self.error)
+            self.quick_ops = bounded_quick_ops(max_growth, self.error)
 
     # run a program that's provided in a string
     # usese the provided Parser found in brewparse.py to parse the program
     # into an abstract syntax tree (ast)
     def run(self, program):
-        ast = parse_program(program)
+        try:
+            self.__run_program(program)
+        except RecursionError:
+            super().error(ErrorType.RESOURCE_ERROR, "Maximum call depth exceeded")
+        except MemoryError:
+            super().error(ErrorType.RESOURCE_ERROR, "Out of memory")
+        finally:
+            self.flush_output()
+
+    def __run_program(self, program):
+        if self.parse_cache is not None:
+            ast = self.parse_cache.parse(program)
+        else:
+            ast = parse_program(program)
+        if self.optimize:
+            optimize_program(ast, self.op_to_lambda, self.max_growth)
+        resolve_program(ast, self.quick_ops)
         self.__set_up_function_table(ast)
-        self.env = EnvironmentManager()
+        link_calls(ast, self.func_name_to_ast)
+        self.env = EnvironmentManager(ast.symbols)
+        self.budget = Budget(self, self.max_steps, self.max_growth)
+        # the steps left before the budget has to be checked again
+        self.fuel = self.budget.fuel
+        self.depth = 0  # how many calls deep the running call is
         main_func = self.__get_func_by_name("main", 0)
         if main_func is None:
-            super().error(ErrorType.NAME_ERROR, f"Function {name} not found")
-        self.__run_statements(main_func.func_ast.get("statements"))
+            super().error(ErrorType.NAME_ERROR, f"Function main not found")
+        if self.engine == "vm":
+            VirtualMachine(self).run(main_func)
+            return
+        if self.engine == "closure":
+            ClosureCompiler(self).run(main_func)
+            return
+        self.__run_call(main_func, {})
 
     def __set_up_function_table(self, ast):
         self.func_name_to_ast = {}
-        empty_env = EnvironmentManager()
-        for func_def in ast.get("functions"):
-            func_name = func_def.get("name")
-            num_params = len(func_def.get("args"))
+        empty_env = EnvironmentManager(ast.symbols)
+        for func_def in ast.functions:
+            func_name = func_def.name
+            num_params = len(func_def.args)
             if func_name not in self.func_name_to_ast:
                 self.func_name_to_ast[func_name] = {}
             self.func_name_to_ast[func_name][num_params] = Closure(func_def, empty_env)
 
     def __get_func_by_name(self, name, num_params):
         if name not in self.func_name_to_ast:
-            closure_val_obj = self.env.get(name)
-            if closure_val_obj is None:
+            closure_cell = self.env.get(name)
+            if closure_cell is None:
                 return None
                 # super().error(ErrorType.NAME_ERROR, f"Function {name} not found")
+            closure_val_obj = closure_cell.value
             if closure_val_obj.type() != Type.CLOSURE:
                 super().error(
                     ErrorType.TYPE_ERROR, "Trying to call function with non-closure"
                 )
             closure = closure_val_obj.value()
-            num_formal_params = len(closure.func_ast.get("args"))
+            num_formal_params = len(closure.func_ast.args)
             if num_formal_params != num_params:
                 super().error(ErrorType.TYPE_ERROR, "Invalid # of args to lambda")
             return closure_val_obj.value()
@@ -84,10 +172,14 @@ class Interpreter(InterpreterBase):
             )
         return candidate_funcs[num_params]
 
-    def __run_statements(self, statements):
-        self.env.push()
+    # scoped is whether the statements run in a frame of their own (see
+    # optimizerv4)
+    def __run_statements(self, statements, scoped=True):
+        if scoped:
+            self.env.push()
         for statement in statements:
             if self.trace_output:
+                self.flush_output()
                 print(statement)
             status = ExecStatus.CONTINUE
             if statement.elem_type == InterpreterBase.FCALL_DEF:
@@ -104,22 +196,31 @@ class Interpreter(InterpreterBase):
                 status, return_val = self.__do_while(statement)
 
             if status == ExecStatus.RETURN:
-                self.env.pop()
+                if scoped:
+                    self.env.pop()
                 return (status, return_val)
 
-        self.env.pop()
+        if scoped:
+            self.env.pop()
         return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
 
 
     def __call_func(self, call_ast):
-        func_name = call_ast.get("name")
+        func_name = call_ast.name
         if func_name == "print":
             return self.__call_print(call_ast)
         if func_name == "inputi":
             return self.__call_input(call_ast)
-
-        actual_args = call_ast.get("args")
-        target_closure = self.__get_func_by_name(func_name, len(actual_args))
+        target_closure, new_env = self.__prepare_func_call(call_ast)
+        return self.__run_call(target_closure, new_env)
+
+    # the closure a call to a function runs, and the bindings of its frame
+    def __prepare_func_call(self, call_ast):
+        func_name = call_ast.name
+        actual_args = call_ast.args
+        target_closure = call_ast.target
+        if target_closure is None:
+            target_closure = self.__get_func_by_name(func_name, len(actual_args))
         if target_closure == None:
             super().error(ErrorType.NAME_ERROR, f"Name error")
         if target_closure.type != Type.CLOSURE:
@@ -129,21 +230,59 @@ class Interpreter(InterpreterBase):
         new_env = {}
         self.__prepare_env_with_closed_variables(target_closure, new_env)
         self.__prepare_params(target_ast,call_ast, new_env)
-        self.env.push(new_env)
-        _, return_val = self.__run_statements(target_ast.get("statements"))
-        self.env.pop()
+        return target_closure, new_env
+
+    # runs a call, and then each tail call it returns in its place
+    def __run_call(self, target_closure, new_env):
+        env = self.env
+        call_base = self.call_base
+        depth = self.depth + 1
+        if depth > self.max_depth:
+            super().error(ErrorType.RESOURCE_ERROR, "Maximum call depth exceeded")
+        self.depth = depth
+        carried_env = None
+        while True:
+            # the index of the call's first frame
+            self.call_base = len(env.frames)
+            if carried_env is not None:
+                env.push(carried_env)
+            env.push(new_env)
+            func_ast = target_closure.func_ast
+            self.fuel -= func_ast.steps
+            if self.fuel < 0:
+                self.fuel = self.budget.refuel(self.fuel)
+            _, return_val = self.__run_statements(func_ast.statements, func_ast.scoped)
+            env.pop()
+            if carried_env is not None:
+                env.pop()
+            if type(return_val) is not TailCall:
+                break
+            target_closure = return_val.target_closure
+            new_env = return_val.callee_env
+            carried_env = return_val.carried_env
+        self.call_base = call_base
+        self.depth = depth - 1
         return return_val
 
+    # return f(...) or return o.m(...), which runs in place of the current
+    # call (see runtimev4.TailCall)
+    def __tail_call(self, call_ast):
+        if call_ast.elem_type == InterpreterBase.MCALL_DEF:
+            target_closure, new_env = self.__prepare_method_call(call_ast)
+        else:
+            target_closure, new_env = self.__prepare_func_call(call_ast)
+        return tail_call(self.env, self.call_base, target_closure, new_env)
+
     def __prepare_env_with_closed_variables(self, target_closure, temp_env):
-        for var_name, value in target_closure.captured_env:
+        for slot, value in target_closure.captured_env:
             # Updated here - ignore updates to the scope if we
             #   altered a parameter, or if the argument is a similarly named variable
-            temp_env[var_name] = value
+            temp_env[slot] = value
 
 
     def __prepare_params(self, target_ast, call_ast, temp_env):
-        actual_args = call_ast.get("args")
-        formal_args = target_ast.get("args")
+        actual_args = call_ast.args
+        formal_args = target_ast.args
         if len(actual_args) != len(formal_args):
             super().error(
                 ErrorType.NAME_ERROR,
@@ -152,22 +291,33 @@ class Interpreter(InterpreterBase):
 
         for formal_ast, actual_ast in zip(formal_args, actual_args):
             if formal_ast.elem_type == InterpreterBase.REFARG_DEF:
-                result = self.__eval_expr(actual_ast)
+                result = self.__eval_ref(actual_ast)
             else:
-                result = copy.deepcopy(self.__eval_expr(actual_ast))
-            arg_name = formal_ast.get("name")
-            temp_env[arg_name] = result
+                result = Cell(copy_value(self.__eval_expr(actual_ast)))
+            temp_env[formal_ast.slot] = result
+
+    # the cell a ref param is bound to: the variable or field passed in, or a
+    # cell of its own for any other expression
+    def __eval_ref(self, expr_ast):
+        if expr_ast.elem_type != InterpreterBase.VAR_DEF:
+            return Cell(self.__eval_expr(expr_ast))
+        if "." in expr_ast.name:
+            return self.__eval_field(expr_ast, as_ref=True)
+        cell = self.env.get_slot(expr_ast.slot)
+        if cell is not None:
+            return cell
+        return Cell(self.__eval_name(expr_ast))
 
     def __call_print(self, call_ast):
         output = ""
-        for arg in call_ast.get("args"):
+        for arg in call_ast.args:
             result = self.__eval_expr(arg)  # result is a Value object
             output = output + get_printable(result)
         super().output(output)
         return Interpreter.NIL_VALUE
 
     def __call_input(self, call_ast):
-        args = call_ast.get("args")
+        args = call_ast.args
         if args is not None and len(args) == 1:
             result = self.__eval_expr(args[0])
             super().output(get_printable(result))
@@ -176,14 +326,14 @@ class Interpreter(InterpreterBase):
                 ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter"
             )
         inp = super().get_input()
-        if call_ast.get("name") == "inputi":
-            return Value(Type.INT, int(inp))
-        if call_ast.get("name") == "inputs":
+        if call_ast.name == "inputi":
+            return int_value(int(inp))
+        if call_ast.name == "inputs":
             return Value(Type.STRING, inp)
 
     def __assign(self, assign_ast):
-        var_name = assign_ast.get("name")
-        src_value_obj = copy.copy(self.__eval_expr(assign_ast.get("expression")))
+        var_name = assign_ast.name
+        src_value_obj = self.__eval_expr(assign_ast.expression)
 
         # if LHS has a '.', then assign the field to the RHS value
         is_obj = False
@@ -191,28 +341,28 @@ class Interpreter(InterpreterBase):
             object_name, field_name = var_name.split(".")
             # obj = self.env.get(object_name).value() 
             # obj.fields_to_value[field_name] = src_value_obj
-            target_value_obj = self.env.get(object_name)
+            target_value_obj = self.env.get_slot(assign_ast.slot)
             is_obj = True
 
             if target_value_obj is None:
                 super().error(
                 ErrorType.NAME_ERROR, f"no field found"
                 )
-            elif not isinstance(target_value_obj.value(), Object):
+            elif not isinstance(target_value_obj.value.value(), Object):
                 super().error(
                 ErrorType.TYPE_ERROR, f"no object found"
                 )
 
         else:
-            target_value_obj = self.env.get(var_name)
+            target_value_obj = self.env.get_slot(assign_ast.slot)
 
         # doesn't exist, so set it 
         if target_value_obj is None:
-            self.env.set(var_name, src_value_obj)
+            self.env.create_slot(assign_ast.slot, Cell(src_value_obj))
         else:
                         # if a close is changed to another type such as int, we cannot make function calls on it any more 
-            if target_value_obj.t == Type.CLOSURE and src_value_obj.t != Type.CLOSURE:
-                target_value_obj.v.type = src_value_obj.t
+            if target_value_obj.value.t == Type.CLOSURE and src_value_obj.t != Type.CLOSURE:
+                target_value_obj.value.v.set_type(src_value_obj.t)
 
             elif is_obj:
                 if field_name == "proto":
@@ -223,10 +373,7 @@ class Interpreter(InterpreterBase):
 
 
                 # point directly towards original object/closure  
-                if not (src_value_obj.t == Type.OBJECT or src_value_obj.t == Type.CLOSURE):
-                    target_value_obj.value().fields_to_value[field_name] = copy.deepcopy(src_value_obj)
-                else:
-                    target_value_obj.value().fields_to_value[field_name] = src_value_obj
+                target_value_obj.value.value().set_field(field_name, src_value_obj)
                 return
             target_value_obj.set(src_value_obj)
 
@@ -236,11 +383,11 @@ class Interpreter(InterpreterBase):
         if expr_ast.elem_type == InterpreterBase.NIL_DEF:
             return Interpreter.NIL_VALUE
         if expr_ast.elem_type == InterpreterBase.INT_DEF:
-            return Value(Type.INT, expr_ast.get("val"))
+            return expr_ast.value
         if expr_ast.elem_type == InterpreterBase.STRING_DEF:
-            return Value(Type.STRING, expr_ast.get("val"))
+            return expr_ast.value
         if expr_ast.elem_type == InterpreterBase.BOOL_DEF:
-            return Value(Type.BOOL, expr_ast.get("val"))
+            return expr_ast.value
         if expr_ast.elem_type == InterpreterBase.VAR_DEF:
             return self.__eval_name(expr_ast)
         if expr_ast.elem_type == InterpreterBase.FCALL_DEF:
@@ -259,19 +406,24 @@ class Interpreter(InterpreterBase):
             return self.__eval_mcall(expr_ast)
     
     def __eval_mcall(self, method_call_ast):
+        target_closure, new_env = self.__prepare_method_call(method_call_ast)
+        return self.__run_call(target_closure, new_env)
+
+    # the closure a method call runs, and the bindings of its frame
+    def __prepare_method_call(self, method_call_ast):
         # Traverse variables in the environment stack
 
-        method_name = method_call_ast.get("name")
-        obj_reference = method_call_ast.get("objref")
+        method_name = method_call_ast.name
+        obj_reference = method_call_ast.objref
 
-        target_object = self.env.get(obj_reference) 
+        target_object = self.env.get_slot(method_call_ast.slot)
 
         if target_object is None:
             super().error(
             ErrorType.NAME_ERROR, f"method does not exist"
             )
 
-        if not isinstance(target_object.value(), Object):
+        if not isinstance(target_object.value.value(), Object):
             super().error(
             ErrorType.TYPE_ERROR, f"object does not exist"
             )
@@ -279,8 +431,11 @@ class Interpreter(InterpreterBase):
         # Validate that it's an object type
         # assert(target_object.value() == Type.OBJECT)
 
-        # Check if the object type and names match
-        method_value = target_object.value().get(method_name)
+        # Check if the object type and names match, through the call site's
+        # inline cache
+        method_value = target_object.value.value().get_cached(
+            method_name, method_call_ast.cache
+        )
 
         if method_value == None:
             super().error(ErrorType.NAME_ERROR, f"method not found")
@@ -299,46 +454,24 @@ class Interpreter(InterpreterBase):
 
         # create new environment
         environment = {}
-        environment["this"] = target_object
+        environment[THIS_SLOT] = target_object
         # prepare new environment
         self.__prepare_env_with_closed_variables(target_closure, environment)
         self.__prepare_params(new_ast, method_call_ast, environment)
-
-        # push new envioronment onto stack
-        self.env.push(environment)
-        _, result_value = self.__run_statements(new_ast.get("statements"))
-
-        # result value is stored, so pop environment 
-        self.env.pop()
-        return result_value
+        return target_closure, environment
 
 
             
 
     def __eval_name(self, name_ast):
-        var_name = name_ast.get("name")
+        var_name = name_ast.name
 
         if "." in var_name:
-            object_name, field_name = var_name.split(".")
-            object_node = self.env.get(object_name)
-
-            # error checks 
-            if not isinstance(object_node.value(), Object):
-                super().error(
-                    ErrorType.TYPE_ERROR, f"object name not found"
-                )
-
-            if object_node.value().get(field_name) == None:
-                 super().error(
-                    ErrorType.NAME_ERROR, f"field name not found"
-                 )                
+            return self.__eval_field(name_ast)
 
-
-            return object_node.value().get(field_name)
-
-        val = self.env.get(var_name)
-        if val is not None:
-            return val
+        cell = self.env.get_slot(name_ast.slot)
+        if cell is not None:
+            return cell.value
         closure = self.__get_func_by_name(var_name, None)
         if closure is None:
             super().error(
@@ -346,13 +479,43 @@ class Interpreter(InterpreterBase):
             )
         return Value(Type.CLOSURE, closure)
 
-    
+    # the value of the field a dotted name refers to, or the field's cell if
+    # it's passed to a ref param
+    def __eval_field(self, name_ast, as_ref=False):
+        object_name, field_name = name_ast.name.split(".")
+        object_node = self.env.get_slot(name_ast.slot)
 
-    def __eval_op(self, arith_ast):
-        left_value_obj = self.__eval_expr(arith_ast.get("op1"))
-        right_value_obj = self.__eval_expr(arith_ast.get("op2"))
+        # error checks 
+        if not isinstance(object_node.value.value(), Object):
+            super().error(
+                ErrorType.TYPE_ERROR, f"object name not found"
+            )
+
+        if object_node.value.value().get(field_name) == None:
+             super().error(
+                ErrorType.NAME_ERROR, f"field name not found"
+             )                
 
 
+        if as_ref:
+            return object_node.value.value().get_cell(field_name)
+        return object_node.value.value().get(field_name)
+
+
+    def __eval_op(self, arith_ast):
+        left_value_obj = self.__eval_expr(arith_ast.op1)
+        right_value_obj = self.__eval_expr(arith_ast.op2)
+
+        # the fast path the operator was quickened to, if the operands still
+        # have the types it's specialized for (see quickenv4)
+        site = arith_ast.site
+        if left_value_obj.t is site.left_t and right_value_obj.t is site.right_t:
+            return site.fast(left_value_obj.v, right_value_obj.v)
+        result = self.__eval_generic_op(arith_ast, left_value_obj, right_value_obj)
+        site.observe(left_value_obj.t, right_value_obj.t)
+        return result
+
+    def __eval_generic_op(self, arith_ast, left_value_obj, right_value_obj):
         left_value_obj, right_value_obj = self.__bin_op_promotion(
             arith_ast.elem_type, left_value_obj, right_value_obj
         )
@@ -400,11 +563,11 @@ class Interpreter(InterpreterBase):
 
     @staticmethod
     def __int_to_bool(value):
-        return Value(Type.BOOL, value.value() != 0)
+        return bool_value(value.value() != 0)
 
     @staticmethod
     def __bool_to_int(value):
-        return Value(Type.INT, 1 if value.value() else 0)
+        return int_value(1 if value.value() else 0)
 
     def __compatible_types(self, oper, obj1, obj2):
         # DOCUMENT: allow comparisons ==/!= of anything against anything
@@ -413,7 +576,7 @@ class Interpreter(InterpreterBase):
         return obj1.type() == obj2.type()
 
     def __eval_unary(self, arith_ast, t, f):
-        value_obj = self.__eval_expr(arith_ast.get("op1"))
+        value_obj = self.__eval_expr(arith_ast.op1)
         value_obj = self.__unary_op_promotion(arith_ast.elem_type, value_obj)
 
         if value_obj.type() != t:
@@ -421,99 +584,101 @@ class Interpreter(InterpreterBase):
                 ErrorType.TYPE_ERROR,
                 f"Incompatible type for {arith_ast.elem_type} operation",
             )
-        return Value(t, f(value_obj.value()))
+        if t == Type.INT:
+            return int_value(f(value_obj.value()))
+        return bool_value(f(value_obj.value()))
 
     def __setup_ops(self):
         self.op_to_lambda = {}
         # set up operations on integers
         self.op_to_lambda[Type.INT] = {}
-        self.op_to_lambda[Type.INT]["+"] = lambda x, y: Value(
-            x.type(), x.value() + y.value()
+        self.op_to_lambda[Type.INT]["+"] = lambda x, y: int_value(
+            x.value() + y.value()
         )
-        self.op_to_lambda[Type.INT]["-"] = lambda x, y: Value(
-            x.type(), x.value() - y.value()
+        self.op_to_lambda[Type.INT]["-"] = lambda x, y: int_value(
+            x.value() - y.value()
         )
-        self.op_to_lambda[Type.INT]["*"] = lambda x, y: Value(
-            x.type(), x.value() * y.value()
+        self.op_to_lambda[Type.INT]["*"] = lambda x, y: int_value(
+            x.value() * y.value()
         )
-        self.op_to_lambda[Type.INT]["/"] = lambda x, y: Value(
-            x.type(), x.value() // y.value()
+        self.op_to_lambda[Type.INT]["/"] = lambda x, y: int_value(
+            x.value() // y.value()
         )
-        self.op_to_lambda[Type.INT]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
+        self.op_to_lambda[Type.INT]["=="] = lambda x, y: bool_value(
+            x.value() == y.value()
         )
-        self.op_to_lambda[Type.INT]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
+        self.op_to_lambda[Type.INT]["!="] = lambda x, y: bool_value(
+            x.value() != y.value()
         )
-        self.op_to_lambda[Type.INT]["<"] = lambda x, y: Value(
-            Type.BOOL, x.value() < y.value()
+        self.op_to_lambda[Type.INT]["<"] = lambda x, y: bool_value(
+            x.value() < y.value()
         )
-        self.op_to_lambda[Type.INT]["<="] = lambda x, y: Value(
-            Type.BOOL, x.value() <= y.value()
+        self.op_to_lambda[Type.INT]["<="] = lambda x, y: bool_value(
+            x.value() <= y.value()
         )
-        self.op_to_lambda[Type.INT][">"] = lambda x, y: Value(
-            Type.BOOL, x.value() > y.value()
+        self.op_to_lambda[Type.INT][">"] = lambda x, y: bool_value(
+            x.value() > y.value()
         )
-        self.op_to_lambda[Type.INT][">="] = lambda x, y: Value(
-            Type.BOOL, x.value() >= y.value()
+        self.op_to_lambda[Type.INT][">="] = lambda x, y: bool_value(
+            x.value() >= y.value()
         )
         #  set up operations on strings
         self.op_to_lambda[Type.STRING] = {}
         self.op_to_lambda[Type.STRING]["+"] = lambda x, y: Value(
             x.type(), x.value() + y.value()
         )
-        self.op_to_lambda[Type.STRING]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
+        self.op_to_lambda[Type.STRING]["=="] = lambda x, y: bool_value(
+            x.value() == y.value()
         )
-        self.op_to_lambda[Type.STRING]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
+        self.op_to_lambda[Type.STRING]["!="] = lambda x, y: bool_value(
+            x.value() != y.value()
         )
         #  set up operations on bools
         self.op_to_lambda[Type.BOOL] = {}
-        self.op_to_lambda[Type.BOOL]["&&"] = lambda x, y: Value(
-            x.type(), x.value() and y.value()
+        self.op_to_lambda[Type.BOOL]["&&"] = lambda x, y: bool_value(
+            x.value() and y.value()
         )
-        self.op_to_lambda[Type.BOOL]["||"] = lambda x, y: Value(
-            x.type(), x.value() or y.value()
+        self.op_to_lambda[Type.BOOL]["||"] = lambda x, y: bool_value(
+            x.value() or y.value()
         )
-        self.op_to_lambda[Type.BOOL]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
+        self.op_to_lambda[Type.BOOL]["=="] = lambda x, y: bool_value(
+            x.value() == y.value()
         )
-        self.op_to_lambda[Type.BOOL]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
+        self.op_to_lambda[Type.BOOL]["!="] = lambda x, y: bool_value(
+            x.value() != y.value()
         )
 
         #  set up operations on nil
         self.op_to_lambda[Type.NIL] = {}
-        self.op_to_lambda[Type.NIL]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
+        self.op_to_lambda[Type.NIL]["=="] = lambda x, y: bool_value(
+            x.value() == y.value()
         )
-        self.op_to_lambda[Type.NIL]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
+        self.op_to_lambda[Type.NIL]["!="] = lambda x, y: bool_value(
+            x.value() != y.value()
         )
 
         #  set up operations on closures
         self.op_to_lambda[Type.CLOSURE] = {}
-        self.op_to_lambda[Type.CLOSURE]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
+        self.op_to_lambda[Type.CLOSURE]["=="] = lambda x, y: bool_value(
+            x.value() == y.value()
         )
-        self.op_to_lambda[Type.CLOSURE]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
+        self.op_to_lambda[Type.CLOSURE]["!="] = lambda x, y: bool_value(
+            x.value() != y.value()
         )
 
          #  set up operations on objects
         self.op_to_lambda[Type.OBJECT] = {}
-        self.op_to_lambda[Type.OBJECT]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() is y.value()
+        self.op_to_lambda[Type.OBJECT]["=="] = lambda x, y: bool_value(
+            x.value() is y.value()
         )
-        self.op_to_lambda[Type.OBJECT]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() is not y.value()
+        self.op_to_lambda[Type.OBJECT]["!="] = lambda x, y: bool_value(
+            x.value() is not y.value()
         )
 
 
 
     def __do_if(self, if_ast):
-        cond_ast = if_ast.get("condition")
+        cond_ast = if_ast.condition
         result = self.__eval_expr(cond_ast)
         if result.type() == Type.INT:
             result = Interpreter.__int_to_bool(result)
@@ -523,21 +688,26 @@ class Interpreter(InterpreterBase):
                 "Incompatible type for if condition",
             )
         if result.value():
-            statements = if_ast.get("statements")
-            status, return_val = self.__run_statements(statements)
+            statements = if_ast.statements
+            status, return_val = self.__run_statements(statements, if_ast.scoped)
             return (status, return_val)
         else:
-            else_statements = if_ast.get("else_statements")
+            else_statements = if_ast.else_statements
             if else_statements is not None:
-                status, return_val = self.__run_statements(else_statements)
+                status, return_val = self.__run_statements(
+                    else_statements, if_ast.else_scoped
+                )
                 return (status, return_val)
 
         return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
 
     def __do_while(self, while_ast):
-        cond_ast = while_ast.get("condition")
+        cond_ast = while_ast.condition
         run_while = Interpreter.TRUE_VALUE
         while run_while.value():
+            self.fuel -= while_ast.steps
+            if self.fuel < 0:
+                self.fuel = self.budget.refuel(self.fuel)
             run_while = self.__eval_expr(cond_ast)
             if run_while.type() == Type.INT:
                 run_while = Interpreter.__int_to_bool(run_while)
@@ -547,18 +717,24 @@ class Interpreter(InterpreterBase):
                     "Incompatible type for while condition",
                 )
             if run_while.value():
-                statements = while_ast.get("statements")
-                status, return_val = self.__run_statements(statements)
+                statements = while_ast.statements
+                status, return_val = self.__run_statements(statements, while_ast.scoped)
                 if status == ExecStatus.RETURN:
                     return status, return_val
 
         return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
 
     def __do_return(self, return_ast):
-        expr_ast = return_ast.get("expression")
+        expr_ast = return_ast.expression
         if expr_ast is None:
             return (ExecStatus.RETURN, Interpreter.NIL_VALUE)
-        value_obj = copy.deepcopy(self.__eval_expr(expr_ast))
+        if expr_ast.elem_type == InterpreterBase.MCALL_DEF or (
+            expr_ast.elem_type == InterpreterBase.FCALL_DEF
+            and expr_ast.name != "print"
+            and expr_ast.name != "inputi"
+        ):
+            return (ExecStatus.RETURN, self.__tail_call(expr_ast))
+        value_obj = copy_value(self.__eval_expr(expr_ast))
         return (ExecStatus.RETURN, value_obj)
 
 
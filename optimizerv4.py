@@ -0,0 +1,214 @@
+from budgetv4 import GROWING_OPS
+from element import (
+    Assign,
+    BinaryOp,
+    FCall,
+    If,
+    Lambda,
+    Literal,
+    MCall,
+    Nil,
+    Return,
+    UnaryOp,
+    While,
+)
+from intbase import InterpreterBase
+from resolverv4 import LITERAL_TYPES
+from type_valuev4 import NIL_VALUE, Type, bool_value, int_value, literal_value
+
+# the literal node kind for each type an operator can produce
+LITERAL_KINDS = {t: kind for kind, t in LITERAL_TYPES.items()}
+
+
+# An optional pass over a parsed program, run before it's resolved (see
+# Interpreter.run), that does the work the program would otherwise repeat
+# every time it runs:
+# - an operator whose operands are literals is folded into a literal, with
+#   the promotions and operator table Interpreter.__eval_op uses. An operator
+#   that would fail when evaluated (a type error or dividing by zero) is left
+#   alone, so it still fails at the same point.
+# - an if or while whose condition is a literal loses the branch that can
+#   never run. A branch that always runs is spliced into the enclosing block
+#   if it can't create a variable (the frame it would have pushed could never
+#   hold anything, see below), and is kept as an if (true) otherwise.
+# - blocks that can't create a variable run without a frame of their own
+#   (see element.If). Only assigning a name that isn't bound anywhere creates
+#   one, in the innermost frame, and a name is certainly bound if it's a
+#   param or it was assigned earlier in a block that's still running: a
+#   binding only goes away when the frame holding it is popped. Function and
+#   lambda bodies never need a frame either: their variables live in the
+#   call's frame, which is popped right after.
+# Literals already evaluate to a Value made once per node (see
+# resolverv4.resolve_program).
+# max_size is the interpreter's max_growth: an operator that would make a
+# value bigger than that is left to fail when it runs, like any other.
+class Optimizer:
+    def __init__(self, op_to_lambda, max_size=None):
+        self.op_to_lambda = op_to_lambda
+        self.max_size = max_size
+
+    def optimize(self, ast):
+        for func in ast.functions:
+            func.statements = self.__body(func)
+            func.scoped = False
+        return ast
+
+    # the optimized body of a function or lambda
+    def __body(self, func_ast):
+        return self.__block(func_ast.statements, {arg.name for arg in func_ast.args})
+
+    # bound is the set of names that are certainly bound when the block starts
+    def __block(self, statements, bound):
+        bound = set(bound)
+        optimized = []
+        for statement in statements:
+            optimized.extend(self.__statement(statement, bound))
+            if type(statement) is Assign and "." not in statement.name:
+                bound.add(statement.name)
+        return optimized
+
+    # the statements that statement optimizes to
+    def __statement(self, statement, bound):
+        kind = type(statement)
+        if kind is Assign or kind is Return:
+            if statement.expression is not None:
+                statement.expression = self.__expr(statement.expression)
+        elif kind is FCall or kind is MCall:
+            statement.args = [self.__expr(arg) for arg in statement.args]
+        elif kind is If:
+            return self.__if(statement, bound)
+        elif kind is While:
+            statement.condition = self.__expr(statement.condition)
+            statement.statements = self.__block(statement.statements, bound)
+            if self.__truth(statement.condition) is False:
+                return []
+            statement.scoped = self.__creates(statement.statements, bound)
+        # any other expression statement is never evaluated, so it's kept as
+        # it is
+        return [statement]
+
+    def __if(self, if_ast, bound):
+        if_ast.condition = self.__expr(if_ast.condition)
+        if_ast.statements = self.__block(if_ast.statements, bound)
+        if if_ast.else_statements is not None:
+            if_ast.else_statements = self.__block(if_ast.else_statements, bound)
+        truth = self.__truth(if_ast.condition)
+        if truth is None:
+            if_ast.scoped = self.__creates(if_ast.statements, bound)
+            if if_ast.else_statements is not None:
+                if_ast.else_scoped = self.__creates(if_ast.else_statements, bound)
+            return [if_ast]
+        taken = if_ast.statements if truth else if_ast.else_statements
+        if taken is None:
+            return []
+        if self.__creates(taken, bound):
+            return [If(Literal(InterpreterBase.BOOL_DEF, True), taken, None)]
+        return taken
+
+    # whether running a block could create a variable in the block's frame,
+    # when the names in bound are certainly bound as it starts
+    def __creates(self, statements, bound):
+        for statement in statements:
+            if type(statement) is Assign and "." not in statement.name:
+                if statement.name not in bound:
+                    return True
+        return False
+
+    def __expr(self, expr_ast):
+        kind = type(expr_ast)
+        if kind is BinaryOp:
+            expr_ast.op1 = self.__expr(expr_ast.op1)
+            expr_ast.op2 = self.__expr(expr_ast.op2)
+            left = self.__constant(expr_ast.op1)
+            right = self.__constant(expr_ast.op2)
+            if left is not None and right is not None:
+                value = self.__fold_binary(expr_ast.elem_type, left, right)
+                return self.__literal(value, expr_ast)
+        elif kind is UnaryOp:
+            expr_ast.op1 = self.__expr(expr_ast.op1)
+            operand = self.__constant(expr_ast.op1)
+            if operand is not None:
+                value = self.__fold_unary(expr_ast.elem_type, operand)
+                return self.__literal(value, expr_ast)
+        elif kind is FCall or kind is MCall:
+            expr_ast.args = [self.__expr(arg) for arg in expr_ast.args]
+        elif kind is Lambda:
+            expr_ast.statements = self.__body(expr_ast)
+            expr_ast.scoped = False
+        return expr_ast
+
+    # the Value of a literal or nil node, or None for any other node
+    def __constant(self, expr_ast):
+        if type(expr_ast) is Literal:
+            return literal_value(LITERAL_TYPES[expr_ast.elem_type], expr_ast.val)
+        if type(expr_ast) is Nil:
+            return NIL_VALUE
+        return None
+
+    # whether a condition is always true or always false, following the
+    # promotions Interpreter.__do_if does, or None if that isn't known
+    def __truth(self, cond_ast):
+        value = self.__constant(cond_ast)
+        if value is None:
+            return None
+        if value.t == Type.INT:
+            return value.v != 0
+        if value.t == Type.BOOL:
+            return value.v
+        return None
+
+    # the literal node for value, or expr_ast itself if it couldn't be folded
+    def __literal(self, value, expr_ast):
+        if value is None:
+            return expr_ast
+        return Literal(LITERAL_KINDS[value.t], value.v)
+
+    # Interpreter.__eval_op on two constants, or None where it would fail
+    def __fold_binary(self, op, left, right):
+        op_to_lambda = self.op_to_lambda
+        if op in op_to_lambda[Type.BOOL]:
+            if not (
+                op in op_to_lambda[Type.INT]
+                and left.t == Type.INT
+                and right.t == Type.INT
+            ):
+                if left.t == Type.INT:
+                    left = bool_value(left.v != 0)
+                if right.t == Type.INT:
+                    right = bool_value(right.v != 0)
+        if op in op_to_lambda[Type.INT]:
+            if left.t == Type.BOOL:
+                left = int_value(1 if left.v else 0)
+            if right.t == Type.BOOL:
+                right = int_value(1 if right.v else 0)
+        if op not in ("==", "!=") and left.t != right.t:
+            return None
+        f = op_to_lambda[left.t].get(op)
+        if f is None:
+            return None
+        if op == "/" and right.v == 0:
+            return None
+        size = GROWING_OPS.get((op, left.t))
+        if (
+            size is not None
+            and self.max_size is not None
+            and size(left.v, right.v) > self.max_size
+        ):
+            return None
+        return f(left, right)
+
+    # Interpreter.__eval_unary on a constant, or None where it would fail
+    def __fold_unary(self, op, operand):
+        if op == InterpreterBase.NEG_DEF:
+            if operand.t != Type.INT:
+                return None
+            return int_value(-operand.v)
+        if operand.t == Type.INT:
+            operand = bool_value(operand.v != 0)
+        if operand.t != Type.BOOL:
+            return None
+        return bool_value(not operand.v)
+
+
+def optimize_program(ast, op_to_lambda, max_size=None):
+    return Optimizer(op_to_lambda, max_size).optimize(ast)
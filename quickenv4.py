@@ -0,0 +1,157 @@
+from type_valuev4 import (
+    FALSE_VALUE,
+    SMALL_INT_MAX,
+    SMALL_INT_MIN,
+    SMALL_INTS,
+    TRUE_VALUE,
+    Type,
+    Value,
+)
+
+
+# Type-feedback quickening of binary operators. Every operator node gets a
+# BinaryOpSite (see resolverv4.resolve_program) that records the types of the
+# operands it's evaluated with. Once it sees a pair of types with a fast path
+# in QUICK_OPS, it specializes to it: the engines check the operands' types
+# against the site's (the guard) and, when they match, call the fast path on
+# the operands' python values, skipping promotion, type checks and the
+# operator table. Fast paths only exist for pairs of types that need no
+# promotion, so they give the same results as the generic path.
+#
+# When the guard fails, the engine evaluates the operator the generic way and
+# the site deoptimizes: it specializes to the new types instead (or to none,
+# if they have no fast path). A site that keeps changing stays generic after
+# MAX_DEOPTS of those.
+class BinaryOpSite:
+    __slots__ = ("op", "quick_ops", "left_t", "right_t", "fast", "observed", "deopts")
+    MAX_DEOPTS = 4
+
+    # quick_ops is the table of fast paths to specialize to, QUICK_OPS unless
+    # the interpreter bounds some of them (see budgetv4.bounded_quick_ops)
+    def __init__(self, op, quick_ops=None):
+        self.op = op
+        self.quick_ops = quick_ops if quick_ops is not None else QUICK_OPS
+        # the operand types the site is specialized for, and their fast path;
+        # None when the site isn't specialized, which no operand matches
+        self.left_t = None
+        self.right_t = None
+        self.fast = None
+        self.observed = False
+        self.deopts = 0
+
+    # called with the operand types every time the guard fails
+    def observe(self, left_t, right_t):
+        if self.deopts == self.MAX_DEOPTS:
+            return
+        if self.observed:
+            self.deopts += 1
+            if self.deopts == self.MAX_DEOPTS:
+                self.left_t = self.right_t = self.fast = None
+                return
+        self.observed = True
+        fast = self.quick_ops.get((self.op, left_t, right_t))
+        if fast is None:
+            self.left_t = self.right_t = None
+        else:
+            self.left_t = left_t
+            self.right_t = right_t
+        self.fast = fast
+
+
+def add_ints(x, y):
+    n = x + y
+    if SMALL_INT_MIN <= n <= SMALL_INT_MAX:
+        return SMALL_INTS[n - SMALL_INT_MIN]
+    return Value(Type.INT, n)
+
+
+def subtract_ints(x, y):
+    n = x - y
+    if SMALL_INT_MIN <= n <= SMALL_INT_MAX:
+        return SMALL_INTS[n - SMALL_INT_MIN]
+    return Value(Type.INT, n)
+
+
+def multiply_ints(x, y):
+    n = x * y
+    if SMALL_INT_MIN <= n <= SMALL_INT_MAX:
+        return SMALL_INTS[n - SMALL_INT_MIN]
+    return Value(Type.INT, n)
+
+
+def divide_ints(x, y):
+    n = x // y
+    if SMALL_INT_MIN <= n <= SMALL_INT_MAX:
+        return SMALL_INTS[n - SMALL_INT_MIN]
+    return Value(Type.INT, n)
+
+
+def concat_strings(x, y):
+    return Value(Type.STRING, x + y)
+
+
+def equal(x, y):
+    return TRUE_VALUE if x == y else FALSE_VALUE
+
+
+def not_equal(x, y):
+    return TRUE_VALUE if x != y else FALSE_VALUE
+
+
+def less(x, y):
+    return TRUE_VALUE if x < y else FALSE_VALUE
+
+
+def less_equal(x, y):
+    return TRUE_VALUE if x <= y else FALSE_VALUE
+
+
+def greater(x, y):
+    return TRUE_VALUE if x > y else FALSE_VALUE
+
+
+def greater_equal(x, y):
+    return TRUE_VALUE if x >= y else FALSE_VALUE
+
+
+def both(x, y):
+    return TRUE_VALUE if x and y else FALSE_VALUE
+
+
+def either(x, y):
+    return TRUE_VALUE if x or y else FALSE_VALUE
+
+
+# objects are compared by identity, and nil (None) is only equal to nil
+def same(x, y):
+    return TRUE_VALUE if x is y else FALSE_VALUE
+
+
+def not_same(x, y):
+    return TRUE_VALUE if x is not y else FALSE_VALUE
+
+
+# (operator, left operand type, right operand type) -> fast path
+QUICK_OPS = {
+    ("+", Type.INT, Type.INT): add_ints,
+    ("-", Type.INT, Type.INT): subtract_ints,
+    ("*", Type.INT, Type.INT): multiply_ints,
+    ("/", Type.INT, Type.INT): divide_ints,
+    ("==", Type.INT, Type.INT): equal,
+    ("!=", Type.INT, Type.INT): not_equal,
+    ("<", Type.INT, Type.INT): less,
+    ("<=", Type.INT, Type.INT): less_equal,
+    (">", Type.INT, Type.INT): greater,
+    (">=", Type.INT, Type.INT): greater_equal,
+    ("+", Type.STRING, Type.STRING): concat_strings,
+    ("==", Type.STRING, Type.STRING): equal,
+    ("!=", Type.STRING, Type.STRING): not_equal,
+    ("&&", Type.BOOL, Type.BOOL): both,
+    ("||", Type.BOOL, Type.BOOL): either,
+    ("==", Type.BOOL, Type.BOOL): equal,
+    ("!=", Type.BOOL, Type.BOOL): not_equal,
+}
+for left_t in (Type.OBJECT, Type.NIL):
+    for right_t in (Type.OBJECT, Type.NIL):
+        QUICK_OPS[("==", left_t, right_t)] = same
+        QUICK_OPS[("!=", left_t, right_t)] = not_same
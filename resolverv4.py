@@ -0,0 +1,229 @@
+from budgetv4 import body_steps
+from element import (
+    Arg,
+    Assign,
+    BinaryOp,
+    Element,
+    FCall,
+    Func,
+    Lambda,
+    Literal,
+    MCall,
+    Var,
+    While,
+)
+from intbase import InterpreterBase
+from quickenv4 import BinaryOpSite
+from type_valuev4 import InlineCache, Type, literal_value
+
+
+# Interns a program's variable names to small integer slots. The environment
+# keeps one entry per slot, so once a name has been resolved to its slot a
+# variable is read or written with a list index instead of a dict probe per
+# frame. Every program gets a table of its own (Program.symbols), so a process
+# that runs many programs doesn't size every environment for all of them.
+class SymbolTable:
+    def __init__(self):
+        self.slot_for_name = {}
+        self.names = []
+        self.slot(InterpreterBase.THIS_DEF)  # always THIS_SLOT
+
+    def slot(self, name):
+        slot = self.slot_for_name.get(name)
+        if slot is None:
+            slot = len(self.names)
+            self.slot_for_name[name] = slot
+            self.names.append(name)
+        return slot
+
+    def name(self, slot):
+        return self.names[slot]
+
+    def __len__(self):
+        return len(self.names)
+
+
+THIS_SLOT = 0
+
+# the field of each kind of node that names a variable. For a dotted name
+# (a.b) the slot is the one of the object variable.
+NAME_FIELD = {Var: "name", Assign: "name", Arg: "name", FCall: "name", MCall: "objref"}
+
+LITERAL_TYPES = {
+    InterpreterBase.INT_DEF: Type.INT,
+    InterpreterBase.STRING_DEF: Type.STRING,
+    InterpreterBase.BOOL_DEF: Type.BOOL,
+}
+
+
+# Gives the program a SymbolTable of its own (ast.symbols) and annotates every
+# node that reads, writes or binds a variable with the slot of that variable
+# in it (node.slot), every literal with its Value (node.value), every method
+# call with its inline cache (node.cache), every binary operator with its type
+# feedback (node.site) and every function, lambda and while loop with the
+# steps it counts against a budget (node.steps), then works out what each
+# lambda captures.
+# Brewin# scopes are dynamic, so a name can only be resolved to a slot, not to
+# the frame that will hold it: that depends on the calls that are active when
+# it runs.
+# quick_ops is the table of fast paths the operators' sites specialize to.
+def resolve_program(ast, quick_ops=None):
+    ast.symbols = SymbolTable()
+    slot = ast.symbols.slot
+    nodes = [ast]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, list):
+            nodes.extend(node)
+            continue
+        if not isinstance(node, Element):
+            continue
+        name_field = NAME_FIELD.get(type(node))
+        if name_field is not None:
+            node.slot = slot(getattr(node, name_field).split(".")[0])
+            if type(node) is MCall:
+                node.cache = InlineCache()
+        elif type(node) is Literal:
+            node.value = literal_value(LITERAL_TYPES[node.elem_type], node.val)
+        elif type(node) is BinaryOp:
+            node.site = BinaryOpSite(node.elem_type, quick_ops)
+        elif type(node) is Func or type(node) is Lambda:
+            node.steps = body_steps(node.statements)
+        elif type(node) is While:
+            node.steps = body_steps(node.statements) + 1
+        for key in node.fields:
+            nodes.append(getattr(node, key))
+    return analyze_captures(ast)
+
+
+# calls handled by the interpreter itself, which never look up a function
+BUILTIN_FUNCS = {"print", "inputi"}
+
+
+# Links every call to a top-level function to that function's Closure
+# (node.target) once the interpreter has made its function table, so the
+# call doesn't look the function up by name every time it runs. A call goes
+# to the top-level function with its name and number of args whenever there
+# is one, even if a variable has the same name, so a link never goes stale;
+# the engines still check the closure's type on every call, since assigning
+# a non-closure to a variable holding it changes it (Closure.set_type).
+def link_calls(ast, func_name_to_ast):
+    nodes = [ast]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, list):
+            nodes.extend(node)
+            continue
+        if not isinstance(node, Element):
+            continue
+        if type(node) is FCall and node.name not in BUILTIN_FUNCS:
+            node.target = func_name_to_ast.get(node.name, {}).get(len(node.args))
+        for key in node.fields:
+            nodes.append(getattr(node, key))
+
+
+# What the body of a function or lambda can reach, apart from what its
+# callees and nested lambdas reach
+class BodySummary:
+    def __init__(self, body, funcs, func_names):
+        self.params = {arg.slot for arg in body.args}
+        self.names = set()  # slots read or assigned directly in the body
+        self.callees = set()  # top-level functions it calls
+        self.lambdas = []  # lambdas created directly in the body
+        # calls a method or a function held in a variable, which could be
+        # any closure
+        self.opaque = False
+
+        nodes = list(body.statements)
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, list):
+                nodes.extend(node)
+                continue
+            if not isinstance(node, Element):
+                continue
+            kind = type(node)
+            if kind is Lambda:
+                self.lambdas.append(node)
+                continue
+            if kind is FCall:
+                target = funcs.get((node.name, len(node.args)))
+                if target is not None:
+                    self.callees.add(target)
+                elif node.name not in BUILTIN_FUNCS and node.name not in func_names:
+                    self.opaque = True
+            elif kind is MCall:
+                self.opaque = True
+            elif kind is Var or kind is Assign:
+                self.names.add(node.slot)
+            for key in node.fields:
+                nodes.append(getattr(node, key))
+
+
+# Works out which variables each lambda has to capture, and stores them in
+# lambda_ast.captures. Scopes are dynamic, so a captured variable can be read
+# not just by the lambda's own body but by every function that runs while its
+# frame is on the stack. A lambda therefore captures the names its body uses
+# and the names used by the top-level functions it calls (transitively) and
+# the lambdas it creates, minus its parameters, which shadow anything captured.
+# A lambda that calls a method or a closure held in a variable could reach
+# any name, so it keeps capturing everything that's visible.
+#
+# The same set is stored in body.free for every function and lambda: the
+# variables a call to it can read or assign in the frames below its own.
+#
+# Function calls always go to the top-level function with that name and
+# number of args when there is one, so those callees are known statically.
+def analyze_captures(ast):
+    funcs = {}
+    for func in ast.functions:
+        funcs[(func.name, len(func.args))] = func
+    func_names = {func.name for func in ast.functions}
+
+    summaries = {}
+    pending = list(ast.functions)
+    while pending:
+        body = pending.pop()
+        summary = BodySummary(body, funcs, func_names)
+        summaries[body] = summary
+        pending.extend(summary.lambdas)
+
+    dependents = {body: [] for body in summaries}
+    for body, summary in summaries.items():
+        for dependency in summary.callees:
+            dependents[dependency].append(body)
+        for dependency in summary.lambdas:
+            dependents[dependency].append(body)
+
+    # the set of free slots of every body, None meaning any name at all.
+    # Start from nothing and grow each set until none of them changes.
+    free = {body: frozenset() for body in summaries}
+
+    def free_slots(body):
+        summary = summaries[body]
+        if summary.opaque:
+            return None
+        slots = set(summary.names)
+        for dependency in summary.callees:
+            if free[dependency] is None:
+                return None
+            slots |= free[dependency]
+        for dependency in summary.lambdas:
+            if free[dependency] is None:
+                return None
+            slots |= free[dependency]
+        return frozenset(slots - summary.params)
+
+    pending = list(summaries)
+    while pending:
+        body = pending.pop()
+        slots = free_slots(body)
+        if slots != free[body]:
+            free[body] = slots
+            pending.extend(dependents[body])
+
+    for body, slots in free.items():
+        body.free = slots
+        if type(body) is Lambda:
+            body.captures = None if slots is None else tuple(sorted(slots))
+    return ast
@@ -0,0 +1,218 @@
+from intbase import ErrorType
+from resolverv4 import THIS_SLOT
+from type_valuev4 import Cell, Object, Type, Value, bool_value, int_value
+
+
+# A call in tail position (return f(...) or return o.m(...)) that runs in
+# place of the call it's made from instead of on top of it: the caller's
+# frames are popped before the callee's is pushed, so tail calls run in
+# constant stack depth. The callee's return value is returned as it is, since
+# it's already a copy nothing else refers to.
+#
+# Scopes are dynamic, so the callee could still see the caller's variables.
+# Unless it can't (see sees_caller), carried_env has the caller's visible
+# bindings (the same cells), and it's pushed as a frame of its own under the
+# callee's. A tail call made from there carries that frame along with the
+# caller's, so a chain of tail calls never holds more than one.
+class TailCall:
+    __slots__ = ("target_closure", "callee_env", "carried_env")
+
+    def __init__(self, target_closure, callee_env, carried_env):
+        self.target_closure = target_closure
+        self.callee_env = callee_env
+        self.carried_env = carried_env
+
+
+# the TailCall for a call made in tail position from the call whose frames
+# start at index call_base
+def tail_call(env, call_base, target_closure, callee_env):
+    carried_env = None
+    if sees_caller(env, call_base, target_closure, callee_env):
+        carried_env = env.bindings_from(call_base)
+    return TailCall(target_closure, callee_env, carried_env)
+
+
+# Whether a callee could see a variable bound from frame call_base up: the
+# callee sees the caller's binding of each of its free slots (see
+# resolverv4.analyze_captures) that its own frame (callee_env: captured
+# variables, this and the params) doesn't bind.
+def sees_caller(env, call_base, target_closure, callee_env):
+    free = target_closure.func_ast.free
+    if free is None:
+        return True
+    owners = env.owners
+    for slot in free:
+        if slot not in callee_env and slot < len(owners) and owners[slot] >= call_base:
+            return True
+    return False
+
+
+# State and helpers shared by the engines that compile a program before running
+# it (vmv4 and closure_compilerv4). They share the function table, environment,
+# operator table and I/O of the Interpreter that owns them, and every check
+# here mirrors the matching one in interpreterv4 so all engines report the same
+# errors.
+class CompiledRuntime:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.env = interpreter.env
+        self.func_name_to_ast = interpreter.func_name_to_ast
+        self.nil_value = interpreter.NIL_VALUE
+        self.binary_ops = {}
+        for op in interpreter.BIN_OPS:
+            self.binary_ops[op] = self.__make_binary_op(op, interpreter.op_to_lambda)
+
+    def error(self, error_type, description):
+        self.interpreter.error(error_type, description)
+
+    # Builds a function that evaluates a single operator with the same
+    # promotion and type rules as Interpreter.__eval_op. Which promotions apply
+    # depends only on the operator, so they're decided once here.
+    def __make_binary_op(self, op, op_to_lambda):
+        coerce_to_bool = op in op_to_lambda[Type.BOOL]
+        coerce_to_int = op in op_to_lambda[Type.INT]
+        int_op_too = coerce_to_bool and coerce_to_int
+        any_types = op in ("==", "!=")
+        op_for_type = {}
+        for t, ops in op_to_lambda.items():
+            if op in ops:
+                op_for_type[t] = ops[op]
+        int_op = op_for_type.get(Type.INT)
+        error = self.error
+
+        def binary_op(left, right):
+            # int-int is by far the most common case and needs no promotion
+            if left.t is Type.INT and right.t is Type.INT and int_op is not None:
+                return int_op(left, right)
+            if coerce_to_bool and not (
+                int_op_too and left.t == Type.INT and right.t == Type.INT
+            ):
+                if left.t == Type.INT:
+                    left = bool_value(left.v != 0)
+                if right.t == Type.INT:
+                    right = bool_value(right.v != 0)
+            if coerce_to_int:
+                if left.t == Type.BOOL:
+                    left = int_value(1 if left.v else 0)
+                if right.t == Type.BOOL:
+                    right = int_value(1 if right.v else 0)
+            if not any_types and left.t != right.t:
+                error(ErrorType.TYPE_ERROR, f"Incompatible types for {op} operation")
+            f = op_for_type.get(left.t)
+            if f is None:
+                error(
+                    ErrorType.TYPE_ERROR,
+                    f"Incompatible operator {op} for type {left.t}",
+                )
+            return f(left, right)
+
+        return binary_op
+
+    # same lookup rules as Interpreter.__get_func_by_name
+    def get_func_by_name(self, name, num_params):
+        candidate_funcs = self.func_name_to_ast.get(name)
+        if candidate_funcs is None:
+            closure_cell = self.env.get(name)
+            if closure_cell is None:
+                return None
+            closure_val_obj = closure_cell.value
+            if closure_val_obj.t != Type.CLOSURE:
+                self.error(
+                    ErrorType.TYPE_ERROR, "Trying to call function with non-closure"
+                )
+            closure = closure_val_obj.v
+            if num_params is not None and len(closure.func_ast.args) != num_params:
+                self.error(ErrorType.TYPE_ERROR, "Invalid # of args to lambda")
+            return closure
+
+        if num_params is None:
+            if len(candidate_funcs) > 1:
+                self.error(ErrorType.NAME_ERROR, f"Func ")
+            return candidate_funcs[next(iter(candidate_funcs))]
+
+        if num_params not in candidate_funcs:
+            self.error(ErrorType.NAME_ERROR, f"Funcs not found")
+        return candidate_funcs[num_params]
+
+    # the target of an fcall, checked the way Interpreter.__call_func does.
+    # target is the closure the call was linked to (resolverv4.link_calls),
+    # if any.
+    def resolve_func(self, name, num_params, target=None):
+        if target is not None and target.type == Type.CLOSURE:
+            return target
+        target_closure = target or self.get_func_by_name(name, num_params)
+        if target_closure is None:
+            self.error(ErrorType.NAME_ERROR, f"Name error")
+        if target_closure.type != Type.CLOSURE:
+            self.error(ErrorType.TYPE_ERROR, f"Type error")
+        return target_closure
+
+    # the value of a variable name that isn't bound in the environment
+    def func_value(self, name):
+        closure = self.get_func_by_name(name, None)
+        if closure is None:
+            self.error(ErrorType.NAME_ERROR, f"Variable/function {name} not found")
+        return Value(Type.CLOSURE, closure)
+
+    # the target of an mcall on the object in target_cell, looked up through
+    # the call site's inline cache and checked the way Interpreter.__eval_mcall
+    # does
+    def resolve_method(self, target_cell, method_name, num_args, cache):
+        if target_cell is None:
+            self.error(ErrorType.NAME_ERROR, f"method does not exist")
+        if not isinstance(target_cell.value.v, Object):
+            self.error(ErrorType.TYPE_ERROR, f"object does not exist")
+        method_value = target_cell.value.v.get_cached(method_name, cache)
+        if method_value is None:
+            self.error(ErrorType.NAME_ERROR, f"method not found")
+        if method_value.t != Type.CLOSURE:
+            self.error(ErrorType.TYPE_ERROR, f"cannot change method to other type")
+        target_closure = method_value.v
+        if target_closure is None:
+            self.error(ErrorType.NAME_ERROR, f"func not found")
+        if target_closure.type != Type.CLOSURE:
+            self.error(ErrorType.TYPE_ERROR, f"cannot change method to other type")
+        if len(target_closure.func_ast.args) != num_args:
+            self.error(
+                ErrorType.NAME_ERROR,
+                f"Function {method_name} with {num_args} args not found",
+            )
+        return target_closure
+
+    # the cells (by slot) a call runs with: "this" for methods, then the
+    # closure's captured variables, then the (already evaluated) parameters
+    def call_env(self, target_closure, args, this=None):
+        new_env = {}
+        if this is not None:
+            new_env[THIS_SLOT] = this
+        for slot, cell in target_closure.captured_env:
+            new_env[slot] = cell
+        for formal_ast, cell in zip(target_closure.func_ast.args, args):
+            new_env[formal_ast.slot] = cell
+        return new_env
+
+    # the cell a ref param is bound to when the argument is a plain name:
+    # the variable's cell, or a new one for a function name
+    def var_ref(self, cell, name):
+        if cell is None:
+            return Cell(self.func_value(name))
+        return cell
+
+    # the value of field_name of the object in object_cell, checked the way
+    # Interpreter.__eval_field does
+    def field_value(self, object_cell, field_name):
+        if not isinstance(object_cell.value.v, Object):
+            self.error(ErrorType.TYPE_ERROR, f"object name not found")
+        value = object_cell.value.v.get(field_name)
+        if value is None:
+            self.error(ErrorType.NAME_ERROR, f"field name not found")
+        return value
+
+    # the cell of field_name a ref param is bound to
+    def field_ref(self, object_cell, field_name):
+        if not isinstance(object_cell.value.v, Object):
+            self.error(ErrorType.TYPE_ERROR, f"object name not found")
+        cell = object_cell.value.v.get_cell(field_name)
+        if cell is None:
+            self.error(ErrorType.NAME_ERROR, f"field name not found")
+        return cell
@@ -0,0 +1,131 @@
+import pytest
+
+from intbase import ErrorType
+from interpreterv4 import Interpreter
+
+ENGINES = ("tree", "vm", "closure")
+# the engines whose calls recurse on the python stack
+RECURSIVE_ENGINES = ("tree", "closure")
+MAX_GROWTH = 8 * 1024 * 1024
+
+RUNAWAY_LOOP = """
+func main() {
+  x = 0;
+  while (true) {
+    x = x + 1;
+  }
+}
+"""
+
+SHORT_LOOP = """
+func main() {
+  i = 0;
+  while (i < 10) {
+    i = i + 1;
+  }
+  print(i);
+}
+"""
+
+# recurses until it's stopped, or n calls deep
+RECURSION = """
+func down(n) {
+  if (n == 0) {
+    return 0;
+  }
+  return 1 + down(n - 1);
+}
+
+func main() {
+  print(down(%d));
+}
+"""
+
+# a big value made from literals, which the optimizer mustn't fold, so that
+# it fails when it runs
+BIG_CONSTANT = """
+func main() {
+  print("start");
+  x = "aaaaaaaaaaaa" + "bbbbbbbbbbbb";
+  print(x);
+}
+"""
+
+# programs that keep growing until they're stopped: one that holds on to
+# every object it makes, which is caught when the process is measured, and
+# one that doubles a string, which is caught before the string is made
+GROWING_PROGRAMS = {
+    "objects": """
+func main() {
+  head = nil;
+  while (true) {
+    node = @;
+    node.next = head;
+    node.a = 1;
+    node.b = 2;
+    head = node;
+  }
+}
+""",
+    "strings": """
+func main() {
+  s = "abcdefgh";
+  while (true) {
+    s = s + s;
+  }
+}
+""",
+}
+
+
+# (output, error type) of running a program
+def run_program(program, engine, **options):
+    interpreter = Interpreter(console_output=False, engine=engine, **options)
+    try:
+        interpreter.run(program)
+    except Exception:
+        pass
+    error_type, _ = interpreter.get_error_type_and_line()
+    return interpreter.get_output(), error_type
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_max_steps(engine):
+    assert run_program(RUNAWAY_LOOP, engine, max_steps=1000) == (
+        [],
+        ErrorType.RESOURCE_ERROR,
+    )
+    assert run_program(SHORT_LOOP, engine, max_steps=1000) == (["10"], None)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_max_depth(engine):
+    assert run_program(RECURSION % 100, engine, max_depth=10) == (
+        [],
+        ErrorType.RESOURCE_ERROR,
+    )
+    assert run_program(RECURSION % 5, engine, max_depth=10) == (["5"], None)
+
+
+# going past python's recursion limit is a RESOURCE_ERROR too
+@pytest.mark.parametrize("engine", RECURSIVE_ENGINES)
+def test_recursion_limit(engine):
+    assert run_program(RECURSION % 1000000, engine) == ([], ErrorType.RESOURCE_ERROR)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("name", GROWING_PROGRAMS)
+def test_max_growth(name, engine):
+    _, error_type = run_program(
+        GROWING_PROGRAMS[name], engine, max_growth=MAX_GROWTH
+    )
+    assert error_type == ErrorType.RESOURCE_ERROR
+
+
+@pytest.mark.parametrize("optimize", (False, True))
+@pytest.mark.parametrize("engine", ENGINES)
+def test_max_growth_constant(engine, optimize):
+    assert run_program(BIG_CONSTANT, engine, max_growth=16, optimize=optimize) == (
+        ["start"],
+        ErrorType.RESOURCE_ERROR,
+    )
@@ -0,0 +1,42 @@
+import pytest
+
+from interpreterv4 import Interpreter
+
+ENGINES = ("tree", "vm", "closure")
+
+# programs that print nil, with what the original interpreter printed
+PRINT_NIL_PROGRAMS = {
+    "literal": ("func main() { print(nil); }", ["nil"]),
+    "variable": ("func main() { x = nil; print(x); }", ["nil"]),
+    "return": (
+        "func f() { return; } func g() { return nil; } "
+        "func main() { print(f()); print(g()); }",
+        ["nil", "nil"],
+    ),
+    "no return": ("func f() { x = 1; } func main() { print(f()); }", ["nil"]),
+    "print result": ("func main() { x = print(1); print(x); }", ["1", "nil"]),
+    "with others": ('func main() { print("x", nil, 1); }', ["xnil1"]),
+    "field": ("func main() { o = @; o.a = nil; print(o.a); }", ["nil"]),
+    "param": ("func f(a) { print(a); } func main() { f(nil); }", ["nil"]),
+}
+
+
+def run(program, engine):
+    interpreter = Interpreter(console_output=False, engine=engine)
+    interpreter.run(program)
+    return interpreter.get_output()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("name", PRINT_NIL_PROGRAMS)
+def test_print_nil(name, engine):
+    program, expected = PRINT_NIL_PROGRAMS[name]
+    assert run(program, engine) == expected
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nil_is_not_a_string(engine):
+    program = 'func main() { print(nil == "nil"); print(nil == nil); }'
+    assert run(program, engine) == ["false", "true"]
+    with pytest.raises(Exception):
+        run('func main() { print("a" + nil); }', engine)
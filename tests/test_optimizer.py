@@ -0,0 +1,138 @@
+import pytest
+
+from interpreterv4 import Interpreter
+
+ENGINES = ("tree", "vm", "closure")
+
+# programs that give optimizerv4 something to do: operators on literals to
+# fold (with promotions, and some that have to be left to fail at runtime),
+# if and while conditions it can decide, and blocks that may or may not need
+# a frame of their own
+OPTIMIZER_PROGRAMS = {
+    "arithmetic": """
+func main() {
+  print(1 + 2 * 3 - 4 / 2);
+  print(-(5 - 8) * 2);
+  print(7 / 2, " ", 0 - 7 / 2);
+}
+""",
+    "comparisons": """
+func main() {
+  print(1 < 2, 2 <= 2, 3 > 4, 4 >= 5, 1 == 1, 1 != 1);
+  print("a" == "a", "a" != "b", true == false, !true);
+}
+""",
+    "strings": """
+func main() {
+  x = "con" + "cat" + "enate";
+  print(x, "!" + "" + "?");
+}
+""",
+    "promotions": """
+func main() {
+  print(true + 1, false * 3, 2 - true);
+  print(1 && true, 0 || false, !0, 5 == true, 0 != false);
+}
+""",
+    "divide by zero": """
+func main() {
+  print("before");
+  print(1 / 0);
+}
+""",
+    "type error": """
+func main() {
+  print("before");
+  print("a" + 1);
+}
+""",
+    "dead error": """
+func main() {
+  if (false) {
+    print(1 / 0);
+  }
+  while (false) {
+    print("a" - 1);
+  }
+  print("done");
+}
+""",
+    "literal conditions": """
+func main() {
+  if (true) {
+    print("then");
+  } else {
+    print("else");
+  }
+  if (0) {
+    print("zero");
+  } else {
+    print("not zero");
+  }
+  if (1 + 1 == 2) {
+    x = 5;
+  }
+  print(x);
+}
+""",
+    "bad condition": """
+func main() {
+  if ("yes") {
+    print("then");
+  }
+}
+""",
+    "spliced block": """
+func main() {
+  x = 1;
+  if (true) {
+    x = x + 1;
+    y = 10;
+  }
+  print(x);
+  print(y);
+}
+""",
+    "block locals": """
+func main() {
+  x = 1;
+  i = 0;
+  while (i < 3) {
+    x = x + i;
+    t = i * 2;
+    i = i + 1;
+  }
+  print(x);
+  print(t);
+}
+""",
+    "folded args": """
+func add(a, b) {
+  return a + b;
+}
+func main() {
+  f = lambda(n) { return n * (2 + 3); };
+  print(add(2 * 3, 4 - 1), f(1 + 1));
+}
+""",
+}
+
+
+# (output, error type, exception class) of running a program
+def run_program(program, engine, optimize):
+    interpreter = Interpreter(console_output=False, engine=engine, optimize=optimize)
+    exception_class = None
+    try:
+        interpreter.run(program)
+    except Exception as exception:
+        exception_class = type(exception)
+    error_type, _ = interpreter.get_error_type_and_line()
+    return interpreter.get_output(), error_type, exception_class
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("name", OPTIMIZER_PROGRAMS)
+def test_optimizer_keeps_results(name, engine):
+    program = OPTIMIZER_PROGRAMS[name]
+    expected = run_program(program, engine, optimize=False)
+    assert run_program(program, engine, optimize=True) == expected
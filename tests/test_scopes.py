@@ -0,0 +1,224 @@
+import pytest
+
+from intbase import ErrorType
+from interpreterv4 import Interpreter
+
+ENGINES = ("tree", "vm", "closure")
+
+
+# Programs that exercise block scoping: variables that must disappear when
+# their block ends, blocks that only touch existing variables, and callees
+# that read, assign and create variables through dynamic scope. Each has the
+# output and error type the original interpreter gave it.
+SCOPE_PROGRAMS = {
+    "block_local": (
+        """
+func main() {
+  c = 1;
+  if (c) { x = 1; print(x); }
+  print(x);
+}
+""",
+        ["1"],
+        ErrorType.NAME_ERROR,
+    ),
+    "else_local": (
+        """
+func main() {
+  c = 0;
+  if (c) { print("then"); } else { e = 2; print(e); }
+  print(e);
+}
+""",
+        ["2"],
+        ErrorType.NAME_ERROR,
+    ),
+    "fresh_iteration": (
+        """
+func main() {
+  i = 0;
+  while (i < 3) {
+    if (i > 0) { print(y); }
+    y = i;
+    i = i + 1;
+  }
+}
+""",
+        [],
+        ErrorType.NAME_ERROR,
+    ),
+    "outer_assign": (
+        """
+func main() {
+  x = 1;
+  i = 0;
+  while (i < 4) {
+    if (i / 2 * 2 == i) { x = x + i; } else { x = x * 2; }
+    i = i + 1;
+  }
+  print(x, " ", i);
+}
+""",
+        ["8 4"],
+        None,
+    ),
+    "shadowing": (
+        """
+func show() { print(v); }
+func shadow(v) { show(); if (v > 0) { v = v - 1; show(); } show(); }
+func main() {
+  v = "outer";
+  c = true;
+  if (c) { v = "assigned"; show(); }
+  shadow(2);
+  show();
+}
+""",
+        ["assigned", "2", "1", "1", "assigned"],
+        None,
+    ),
+    "callee_locals": (
+        """
+func twice() { return w * 2; }
+func set_w() { w = 9; }
+func make_fresh() { fresh = 1; }
+func f() { w = 4; print(twice() + 1); set_w(); print(w); }
+func main() {
+  f();
+  c = 1;
+  if (c) { make_fresh(); }
+  print(fresh);
+}
+""",
+        ["9", "9"],
+        ErrorType.NAME_ERROR,
+    ),
+    "ref_params": (
+        """
+func inc(ref v) { v = v + 1; }
+func main() {
+  n = 0;
+  i = 0;
+  while (i < 3) { inc(n); i = i + 1; }
+  if (n) { inc(n); }
+  print(n);
+}
+""",
+        ["4"],
+        None,
+    ),
+    "body_locals": (
+        """
+func count(a) {
+  b = a + 1;
+  if (a > 0) { return count(a - 1) + b; }
+  print(b);
+  return b;
+}
+func main() { print(count(3)); }
+""",
+        ["1", "4"],
+        None,
+    ),
+    "return_from_blocks": (
+        """
+func find() {
+  i = 0;
+  while (true) {
+    if (i == 3) { return i; }
+    i = i + 1;
+  }
+}
+func main() { x = 5; print(find()); print(x); print(i); }
+""",
+        ["3", "5"],
+        ErrorType.NAME_ERROR,
+    ),
+    "lambdas": (
+        """
+func main() {
+  k = 10;
+  add = lambda(x) { y = x + k; if (x > 0) { print(y); } return y; };
+  c = 1;
+  if (c) { print(add(1)); }
+  k = 20;
+  print(add(2));
+  print(y);
+}
+""",
+        ["11", "11", "12", "12"],
+        ErrorType.NAME_ERROR,
+    ),
+    "popped_binding": (
+        """
+func main() {
+  c = 1;
+  i = 0;
+  if (c) { z = 1; }
+  while (i < 2) { z = i; i = i + 1; }
+  print(z);
+}
+""",
+        [],
+        ErrorType.NAME_ERROR,
+    ),
+    "bound_earlier": (
+        """
+func main() {
+  c = 1;
+  y = 0;
+  if (c) { y = 5; if (y > 1) { y = y + 1; } }
+  x = 1;
+  if (true) { x = 2; }
+  print(y, " ", x);
+}
+""",
+        ["6 2"],
+        None,
+    ),
+    "params": (
+        """
+func down(n) {
+  total = 0;
+  while (n > 0) { total = total + n; n = n - 1; }
+  return total;
+}
+func main() { print(down(4)); }
+""",
+        ["10"],
+        None,
+    ),
+    "methods": (
+        """
+func main() {
+  o = @;
+  o.x = 3;
+  o.step = lambda() { while (this.x > 0) { this.x = this.x - 1; print(this.x); } };
+  c = 1;
+  if (c) { o.step(); }
+  print(o.x);
+}
+""",
+        ["2", "1", "0", "0"],
+        None,
+    ),
+}
+
+
+# (output, error type) of running a program
+def run_program(program, engine, optimize):
+    interpreter = Interpreter(console_output=False, engine=engine, optimize=optimize)
+    try:
+        interpreter.run(program)
+    except Exception:
+        pass
+    error_type, _ = interpreter.get_error_type_and_line()
+    return interpreter.get_output(), error_type
+
+
+@pytest.mark.parametrize("optimize", (False, True))
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("name", SCOPE_PROGRAMS)
+def test_scopes(name, engine, optimize):
+    program, output, error_type = SCOPE_PROGRAMS[name]
+    assert run_program(program, engine, optimize) == (output, error_type)
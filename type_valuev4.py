@@ -1,4 +1,5 @@
 import copy
+import weakref
 
 from enum import Enum
 from intbase import InterpreterBase
@@ -16,44 +17,359 @@ class Type(Enum):
 
 class Closure:
     def __init__(self, func_ast, env):
-        self.captured_env = copy.deepcopy(env)
+        self.captured_env = capture(env, getattr(func_ast, "captures", None))
         self.func_ast = func_ast
         self.type = Type.CLOSURE
 
+    # a closure variable assigned a value of another type keeps the closure
+    # but can't be called any more
+    def set_type(self, t):
+        heap_write()
+        self.type = t
 
+
+# The variables a lambda closes over, as a tuple of (slot, HeapCell) pairs:
+# the bindings of slots that are visible in env when the lambda is evaluated
+# (all of them if slots is None), each in a cell of its own so later
+# assignments on either side don't leak into the other. Values are immutable,
+# so ints, strings, bools and nil are captured by value, while objects and
+# closures are shared by reference. Variables that alias the same cell
+# (through ref params) still alias it in the capture.
+def capture(env, slots=None):
+    if slots is None:
+        bindings = env.bindings()
+    else:
+        bindings = [(slot, env.get_slot(slot)) for slot in slots]
+    copies = {}
+    captured = []
+    for slot, cell in bindings:
+        if cell is None:
+            continue
+        captured_cell = copies.get(id(cell))
+        if captured_cell is None:
+            captured_cell = HeapCell(cell.value)
+            copies[id(cell)] = captured_cell
+        captured.append((slot, captured_cell))
+    return tuple(captured)
+
+
+# Passing an object by value (or returning it) deep copies it, but the copy is
+# made lazily: copy.deepcopy returns an empty Object that remembers what it's a
+# copy of, and its fields are only copied the first time they're used. Nested
+# objects are copied the same way, so a call only pays for the objects it
+# actually touches.
+#
+# A lazy copy has to end up with the fields the source had when it was made.
+# Every write to something reachable from an object (a field, a cell that's
+# a field or captured by a closure, a closure's type) calls heap_write()
+# first, which finishes every pending copy before anything changes.
+PENDING_COPIES = set()  # weak references to lazy copies not made yet
+
+
+def heap_write():
+    while PENDING_COPIES:
+        pending_copy = PENDING_COPIES.pop()()
+        if pending_copy is not None:
+            pending_copy.finish_copy()
+
+
+# The layout of an object: the index of each of its fields in the object's
+# list of fields. Objects that got the same fields in the same order share a
+# Shape (a hidden class), so each object only stores the fields themselves,
+# not a dict. Adding a field moves an object to a child shape, which is made
+# once and then reused by every object that adds the same field to the same
+# shape.
+class Shape:
+    __slots__ = ("index", "transitions")
+
+    def __init__(self, index):
+        self.index = index  # field name -> index in the object's fields
+        self.transitions = {}  # field name -> shape with that field added
+
+    def with_field(self, field_name):
+        shape = self.transitions.get(field_name)
+        if shape is None:
+            index = dict(self.index)
+            index[field_name] = len(index)
+            shape = Shape(index)
+            self.transitions[field_name] = shape
+        return shape
+
+
+# every object starts out with a proto field set to None (not nil), always at
+# index 0
+ROOT_SHAPE = Shape({"proto": 0})
+PROTO_INDEX = 0
+
+# Inherited field lookups are cached per object (see Object.get) and per call
+# site (see InlineCache), and every cache is stamped with the epoch it was
+# filled in. Anything that can change where an inherited field is found bumps
+# the epoch, which drops every cache at once: assigning any object's proto, or
+# adding a field to an object that is some object's proto.
+PROTO_EPOCH = 0
+
+
+def invalidate_inherited():
+    global PROTO_EPOCH
+    PROTO_EPOCH += 1
+
+
+# called whenever a proto field is assigned value
+def proto_assigned(value):
+    invalidate_inherited()
+    if isinstance(value.v, Object):
+        value.v.is_proto = True
+
+
+# Each field holds its Value directly. Only a field that's passed to a ref
+# param is turned into a HeapCell (in place), so the param and the field
+# share it; assigning to the field puts a plain Value back, and the param no
+# longer sees the field.
 class Object:
+    __slots__ = ("shape", "is_proto", "__fields", "__copy_of", "__inherited", "__weakref__")
+    type = Type.OBJECT
+
     def __init__(self):
-        self.fields_to_value = {"proto": None}
-        self.type = Type.OBJECT
+        self.shape = ROOT_SHAPE
+        self.is_proto = False  # set once the object is some object's proto
+        self.__fields = [None]
+        self.__copy_of = None
+        # (epoch, {field name: (fields, index) of the proto that has it})
+        self.__inherited = None
+
+    # the Values (or cells) of the fields, in the order of shape.index
+    @property
+    def fields(self):
+        fields = self.__fields
+        if fields is None:
+            self.finish_copy()
+            fields = self.__fields
+        return fields
+
+    # the field name -> Value mapping
+    @property
+    def fields_to_value(self):
+        fields = self.fields
+        return {
+            name: field_value(fields[index]) for name, index in self.shape.index.items()
+        }
+
+    def set_field(self, field_name, value):
+        heap_write()
+        fields = self.__fields
+        if fields is None:
+            fields = self.fields
+        index = self.shape.index.get(field_name)
+        if index is None:
+            self.shape = self.shape.with_field(field_name)
+            fields.append(value)
+            if self.is_proto:
+                invalidate_inherited()
+        else:
+            fields[index] = value
+            if index == PROTO_INDEX:
+                proto_assigned(value)
 
-    #  returns the dict mapping
+    def __deepcopy__(self, memo):
+        lazy_copy = Object.__new__(Object)
+        lazy_copy.shape = self.shape
+        lazy_copy.is_proto = self.is_proto
+        lazy_copy.__fields = None
+        lazy_copy.__inherited = None
+        pending_ref = weakref.ref(lazy_copy, PENDING_COPIES.discard)
+        lazy_copy.__copy_of = (self, memo, pending_ref)
+        PENDING_COPIES.add(pending_ref)
+        return lazy_copy
+
+    # copies the fields of the object this is a lazy copy of, if it hasn't
+    # already. The memo is the one copy.deepcopy started with, so objects that
+    # were shared (or cyclic) in the source are still shared in the copy.
+    # The source can't have changed since the copy was made (see heap_write),
+    # so the copy already has the right shape.
+    def finish_copy(self):
+        if self.__copy_of is None:
+            return
+        source, memo, pending_ref = self.__copy_of
+        self.__copy_of = None
+        PENDING_COPIES.discard(pending_ref)
+        fields = []
+        for field in source.fields:
+            if field is not None:
+                field = deepcopy_value(field_value(field), memo)
+            fields.append(field)
+        self.__fields = fields
+
+    #  returns the Value of the field
     def get(self, fieldNeeded):
-        if fieldNeeded in self.fields_to_value:
-            return self.fields_to_value[fieldNeeded]
-
-        # # Check the prototype chain recursively
-        # prototype = self.fields_to_value.get("proto")
-        # if prototype and prototype.value() != InterpreterBase.NIL_DEF:
-        #     return prototype.value().get(fieldNeeded)
-
-        proto = self.fields_to_value["proto"]
-        #print (proto.v)
-        if proto is not None:
-            #proto_obj = self.proto
-            while proto and proto.value() != InterpreterBase.NIL_DEF:
-                print("proto", proto.value())
-                if fieldNeeded in proto.v.fields_to_value:
-                    return proto.v.fields_to_value[fieldNeeded] # Be careful, does this work on recursive calls to proto? and will it call fields correctly from derived object?
-                proto = proto.v.fields_to_value["proto"]
+        fields = self.__fields
+        if fields is None:
+            fields = self.fields
+        index = self.shape.index
+        if fieldNeeded in index:
+            field = fields[index[fieldNeeded]]
+        else:
+            fields, index = self.find_inherited(fieldNeeded)
+            if fields is None:
+                return None
+            field = fields[index]
+        if type(field) is Value or field is None:
+            return field
+        return field.value
+
+    # the cell a ref param passed this field is bound to
+    def get_cell(self, field_name):
+        fields = self.fields
+        index = self.shape.index.get(field_name)
+        if index is None:
+            fields, index = self.find_inherited(field_name)
+            if fields is None:
+                return None
+        field = fields[index]
+        if field is None:
+            return None
+        if type(field) is Value:
+            # a proto field needs a cell that still invalidates lookups
+            field = ProtoCell(field) if index == PROTO_INDEX else HeapCell(field)
+            fields[index] = field
+        return field
+
+    # the fields of the proto that has the field, and the field's index in
+    # them. The chain is only walked the first time a field is looked up on
+    # this object (after any change to the protos), so inherited fields and
+    # methods cost the same however deep the chain is.
+    def find_inherited(self, fieldNeeded):
+        inherited = self.__inherited
+        if inherited is None or inherited[0] != PROTO_EPOCH:
+            inherited = self.__inherited = (PROTO_EPOCH, {})
+        found = inherited[1].get(fieldNeeded)
+        if found is None:
+            found = self.__walk_protos(fieldNeeded)
+            if found[0] is not None:
+                inherited[1][fieldNeeded] = found
+        return found
+
+    def __walk_protos(self, fieldNeeded):
+        proto = field_value(self.fields[PROTO_INDEX])
+        while proto is not None:
+            proto_fields = proto.v.fields
+            index = proto.v.shape.index
+            if fieldNeeded in index:
+                return proto_fields, index[fieldNeeded]
+            proto = field_value(proto_fields[PROTO_INDEX])
 
         # Field not found in the current object or its prototype chain
-        return None
+        return None, None
+
+    # get(), through the inline cache of the call site doing the lookup
+    def get_cached(self, fieldNeeded, cache):
+        fields = self.__fields
+        if fields is None:
+            fields = self.fields
+        index = self.shape.index
+        if fieldNeeded in index:
+            field = fields[index[fieldNeeded]]
+        elif cache.megamorphic:
+            fields, index = self.find_inherited(fieldNeeded)
+            if fields is None:
+                return None
+            field = fields[index]
+        else:
+            proto = fields[PROTO_INDEX]
+            if type(proto) is not Value:
+                proto = field_value(proto)
+            if proto is not None:
+                proto = proto.v
+            entry = cache.entries.get(id(proto))
+            if (
+                entry is not None
+                and entry[0] is self.shape
+                and entry[1] == PROTO_EPOCH
+                and entry[2]() is proto
+            ):
+                field = entry[3]().__fields[entry[4]]
+            else:
+                fields, index = self.find_inherited(fieldNeeded)
+                if fields is None:
+                    return None
+                cache.add(self, fields, index)
+                field = fields[index]
+        if type(field) is Value:
+            return field
+        return field_value(field)
+
 
+# The inline cache of a method call site: where an inherited method was found
+# for each kind of object the site was called on, so a repeat call only
+# checks a guard and reads one field (see Object.get_cached). Own fields
+# aren't cached here, since the object's shape already finds them with a
+# single lookup. It remembers where the method is, not the closure, since the
+# field can be assigned another one without anything else changing.
+#
+# Objects with the same shape and the same proto find an inherited field in
+# the same proto, until PROTO_EPOCH changes, so entries are keyed by the id of
+# the proto and checked against the shape and epoch. The cache only holds
+# weak references to the protos, so a site doesn't keep a dead prototype (or
+# anything it refers to) alive; an entry whose proto has died never matches,
+# since the id may have been reused, and is dropped to make room. A site that
+# sees more than MAX_ENTRIES protos goes megamorphic and from then on skips
+# the cache and does the plain lookup, which has each object's own cache.
+class InlineCache:
+    __slots__ = ("entries", "megamorphic")
+    MAX_ENTRIES = 4
 
+    def __init__(self):
+        # id of the proto -> (shape, epoch, weak ref to the proto, weak ref
+        # to the proto that has the field, index of the field in its fields)
+        self.entries = {}
+        self.megamorphic = False
+
+    # records that obj finds the field at index in owner_fields
+    def add(self, obj, owner_fields, index):
+        proto = field_value(obj.fields[PROTO_INDEX]).v
+        owner = proto
+        while owner.fields is not owner_fields:
+            owner = field_value(owner.fields[PROTO_INDEX]).v
+        entries = self.entries
+        key = id(proto)
+        if key not in entries and len(entries) == self.MAX_ENTRIES:
+            # entries a proto change made stale, or whose proto died, don't
+            # count
+            stale = [
+                proto_id
+                for proto_id, entry in entries.items()
+                if entry[1] != PROTO_EPOCH or entry[2]() is None
+            ]
+            for proto_id in stale:
+                del entries[proto_id]
+            if len(entries) == self.MAX_ENTRIES:
+                self.megamorphic = True
+                entries.clear()
+                return
+        entries[key] = (
+            obj.shape,
+            PROTO_EPOCH,
+            weakref.ref(proto),
+            weakref.ref(owner),
+            index,
+        )
+
+
+# the Value of a field, which is either a Value, a cell or None
+def field_value(field):
+    if type(field) is Value or field is None:
+        return field
+    return field.value
 
 
-# Represents a value, which has a type and its value
+# Represents a value, which has a type and its value. Values are immutable:
+# variables, params and fields hold them in Cells, and assigning to one of
+# those puts a different Value in the cell, so the same Value can be shared by
+# any number of them. nil, true, false and small ints are the shared
+# singletons below, and literals are created once per node (see
+# resolverv4.resolve_program).
 class Value:
+    __slots__ = ("t", "v")
+
     def __init__(self, t, v=None):
         self.t = t
         self.v = v
@@ -64,21 +380,109 @@ class Value:
     def type(self):
         return self.t
 
-    def set(self, other):
-        self.t = other.t
-        self.v = other.v
+    def __deepcopy__(self, memo):
+        return deepcopy_value(self, memo)
+
+
+# an int, string, bool or nil is its own copy
+def deepcopy_value(value, memo):
+    if value.t == Type.OBJECT or value.t == Type.CLOSURE:
+        return Value(value.t, copy.deepcopy(value.v, memo))
+    return value
+
+
+# nil has a type of its own. (Before Values were immutable it was the string
+# "nil", so nil == "nil" was true and + joined nil to strings; now those are
+# false and a TYPE_ERROR. It still prints as nil.)
+NIL_VALUE = Value(Type.NIL, None)
+TRUE_VALUE = Value(Type.BOOL, True)
+FALSE_VALUE = Value(Type.BOOL, False)
+
+# ints in this range are always the same Value
+SMALL_INT_MIN = -5
+SMALL_INT_MAX = 1024
+SMALL_INTS = tuple(Value(Type.INT, n) for n in range(SMALL_INT_MIN, SMALL_INT_MAX + 1))
+
+
+def int_value(n):
+    if SMALL_INT_MIN <= n <= SMALL_INT_MAX:
+        return SMALL_INTS[n - SMALL_INT_MIN]
+    return Value(Type.INT, n)
+
+
+def bool_value(b):
+    return TRUE_VALUE if b else FALSE_VALUE
+
+
+# the Value of a literal node of type t
+def literal_value(t, val):
+    if t == Type.INT:
+        return int_value(val)
+    if t == Type.BOOL:
+        return bool_value(val)
+    if t == Type.NIL:
+        return NIL_VALUE
+    return Value(t, val)
+
+
+# A variable, parameter or field: the storage a Value is assigned to. Ref
+# params are bound to the caller's cell, and "this" to the cell of the
+# variable a method was called on, so assigning to them assigns to the
+# caller's variable (or field).
+class Cell:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def set(self, value):
+        self.value = value
+
+    def __deepcopy__(self, memo):
+        return type(self)(deepcopy_value(self.value, memo))
+
+
+# A cell that an object or closure can reach: an object's field that was
+# passed to a ref param, or a variable captured by a lambda. Assigning to one
+# has to finish any lazy copies first.
+class HeapCell(Cell):
+    __slots__ = ()
+
+    def set(self, value):
+        if PENDING_COPIES:
+            heap_write()
+        self.value = value
+
+
+# the cell of a proto field that's passed to a ref param
+class ProtoCell(HeapCell):
+    __slots__ = ()
+
+    def set(self, value):
+        super().set(value)
+        proto_assigned(value)
+
+
+# pass-by-value and return semantics: a deep copy of the value. Ints, bools,
+# strings and nil are immutable, so they're their own copy; objects are copied
+# lazily (see Object.__deepcopy__)
+def copy_value(value):
+    if value.t == Type.OBJECT or value.t == Type.CLOSURE:
+        return Value(value.t, copy.deepcopy(value.v))
+    return value
+
 
 def create_value(val):
     if val == InterpreterBase.TRUE_DEF:
-        return Value(Type.BOOL, True)
+        return TRUE_VALUE
     elif val == InterpreterBase.FALSE_DEF:
-        return Value(Type.BOOL, False)
+        return FALSE_VALUE
     elif isinstance(val, str):
         return Value(Type.STRING, val)
     elif isinstance(val, int):
-        return Value(Type.INT, val)
+        return int_value(val)
     elif val == InterpreterBase.NIL_DEF:
-        return Value(Type.NIL, None)
+        return NIL_VALUE
     else:
         raise ValueError("Unknown type")
 
@@ -92,4 +496,6 @@ def get_printable(val):
         if val.value() is True:
             return "true"
         return "false"
+    if val.type() == Type.NIL:
+        return InterpreterBase.NIL_DEF
     return None
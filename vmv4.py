@@ -0,0 +1,581 @@
+from intbase import InterpreterBase, ErrorType
+from runtimev4 import CompiledRuntime, tail_call
+from type_valuev4 import (
+    Object,
+    Cell,
+    Closure,
+    Type,
+    Value,
+    bool_value,
+    copy_value,
+    get_printable,
+    int_value,
+)
+
+
+# Opcodes for the bytecode VM. Every instruction is an (opcode, arg) tuple.
+# The hot ops and the ones that change which code runs are executed inline by
+# the dispatch chain in VirtualMachine.__execute, which tests them in the
+# order they're numbered, roughly how often they run. The rest, from
+# FIRST_HANDLER_OP on, are run by VirtualMachine's handler for them, looked up
+# in a table indexed by opcode, so a rare op costs the same as any other.
+# arg: (slot, variable name, Value, quickenv4.BinaryOpSite, binary-op function)
+BINARY_VAR_CONST = 0
+LOAD_VAR = 1  # arg: (slot, variable name)
+LOAD_CONST = 2  # arg: Value
+BINARY_OP = 3  # arg: (quickenv4.BinaryOpSite, generic binary-op function)
+STORE_VAR = 4  # arg: slot
+JUMP_IF_FALSE = 5  # arg: (target pc, "if" or "while")
+LOAD_FIELD = 6  # arg: (object slot, field name)
+JUMP = 7  # arg: target pc
+# arg: (slot, variable name, slot, variable name, site, binary-op function)
+BINARY_VAR_VAR = 8
+CALL = 9  # arg: # of args
+RETURN = 10
+CALL_METHOD = 11  # arg: # of args
+TAIL_CALL = 12  # arg: # of args
+TAIL_CALL_METHOD = 13  # arg: # of args
+RETURN_NIL = 14
+CHARGE = 15  # arg: steps to count against the budget (see budgetv4)
+FIRST_HANDLER_OP = 16
+RESOLVE_FUNC = 16  # arg: (func name, # of args, linked closure or None)
+PASS_ARG = 17  # arg: index of the argument (a Value) on top of the stack
+PASS_CONST = 18  # arg: Value
+PASS_VAR_REF = 19  # arg: (slot, variable name, index of the argument)
+PASS_FIELD_REF = 20  # arg: (object slot, field name, index of the argument)
+RESOLVE_METHOD = 21  # arg: (object slot, method name, # of args, inline cache)
+POP_TOP = 22
+STORE_FIELD = 23  # arg: (object slot, field name)
+LOAD_NIL = 24
+NEG = 25
+NOT = 26
+MAKE_CLOSURE = 27  # arg: lambda ast
+MAKE_OBJECT = 28
+PUSH_SCOPE = 29
+POP_SCOPE = 30
+BEGIN_PRINT = 31
+PRINT_ARG = 32
+PRINT = 33
+INPUT = 34  # arg: # of args
+NUM_OPS = 35
+
+# the kinds of literal, whose nodes resolve_program gives their Value
+LITERAL_KINDS = (
+    InterpreterBase.INT_DEF,
+    InterpreterBase.STRING_DEF,
+    InterpreterBase.BOOL_DEF,
+)
+
+
+# whether an expression is a variable that isn't an object's field
+def is_plain_var(expr_ast):
+    return expr_ast.elem_type == InterpreterBase.VAR_DEF and "." not in expr_ast.name
+
+
+# how many calls deep a program can go by default before it's stopped with a
+# RESOURCE_ERROR
+DEFAULT_MAX_DEPTH = 2_000_000
+
+
+# Lowers the statements of a function or lambda into a flat list of
+# instructions. Lambdas are compiled lazily by the VM the first time they're
+# called, so the compiler never descends into LAMBDA_DEF bodies.
+class Compiler:
+    # with charge_steps, functions and while loops count their steps against
+    # the budget with CHARGE; without it, they aren't counted at all
+    def __init__(self, binary_ops, charge_steps=False):
+        self.binary_ops = binary_ops
+        self.charge_steps = charge_steps
+
+    def compile_function(self, func_ast):
+        self.code = []
+        if self.charge_steps:
+            self.__emit(CHARGE, func_ast.steps)
+        self.__statements(func_ast.statements, func_ast.scoped)
+        self.__emit(RETURN_NIL)
+        return self.code
+
+    def __emit(self, op, arg=None):
+        self.code.append((op, arg))
+        return len(self.code) - 1
+
+    def __patch_jump(self, index, target):
+        op, arg = self.code[index]
+        if op == JUMP:
+            self.code[index] = (op, target)
+        else:
+            self.code[index] = (op, (target, arg[1]))
+
+    # scoped is whether the statements run in a frame of their own (see
+    # optimizerv4)
+    def __statements(self, statements, scoped):
+        if scoped:
+            self.__emit(PUSH_SCOPE)
+        for statement in statements:
+            self.__statement(statement)
+        if scoped:
+            self.__emit(POP_SCOPE)
+
+    def __statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_DEF or kind == InterpreterBase.MCALL_DEF:
+            self.__expr(statement)
+            self.__emit(POP_TOP)
+        elif kind == "=":
+            self.__expr(statement.expression)
+            var_name = statement.name
+            if "." in var_name:
+                self.__emit(STORE_FIELD, (statement.slot, var_name.split(".")[1]))
+            else:
+                self.__emit(STORE_VAR, statement.slot)
+        elif kind == InterpreterBase.RETURN_DEF:
+            expr_ast = statement.expression
+            if expr_ast is None:
+                self.__emit(RETURN_NIL)
+            elif expr_ast.elem_type == InterpreterBase.MCALL_DEF or (
+                expr_ast.elem_type == InterpreterBase.FCALL_DEF
+                and expr_ast.name != "print"
+                and expr_ast.name != "inputi"
+            ):
+                # the call's CALL or CALL_METHOD becomes a tail call, which
+                # returns in the current call's place
+                self.__expr(expr_ast)
+                op, num_args = self.code[-1]
+                self.code[-1] = (
+                    TAIL_CALL if op == CALL else TAIL_CALL_METHOD,
+                    num_args,
+                )
+            else:
+                self.__expr(expr_ast)
+                self.__emit(RETURN)
+        elif kind == InterpreterBase.IF_DEF:
+            self.__if(statement)
+        elif kind == InterpreterBase.WHILE_DEF:
+            self.__while(statement)
+        # any other expression statement is never evaluated by the interpreter
+
+    def __if(self, if_ast):
+        self.__expr(if_ast.condition)
+        jump_to_else = self.__emit(JUMP_IF_FALSE, (None, "if"))
+        self.__statements(if_ast.statements, if_ast.scoped)
+        else_statements = if_ast.else_statements
+        if else_statements is None:
+            self.__patch_jump(jump_to_else, len(self.code))
+            return
+        jump_to_end = self.__emit(JUMP)
+        self.__patch_jump(jump_to_else, len(self.code))
+        self.__statements(else_statements, if_ast.else_scoped)
+        self.__patch_jump(jump_to_end, len(self.code))
+
+    def __while(self, while_ast):
+        top = len(self.code)
+        if self.charge_steps:
+            self.__emit(CHARGE, while_ast.steps)
+        self.__expr(while_ast.condition)
+        jump_to_end = self.__emit(JUMP_IF_FALSE, (None, "while"))
+        self.__statements(while_ast.statements, while_ast.scoped)
+        self.__emit(JUMP, top)
+        self.__patch_jump(jump_to_end, len(self.code))
+
+    def __expr(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.NIL_DEF:
+            self.__emit(LOAD_NIL)
+        elif kind == InterpreterBase.INT_DEF:
+            self.__emit(LOAD_CONST, expr_ast.value)
+        elif kind == InterpreterBase.STRING_DEF:
+            self.__emit(LOAD_CONST, expr_ast.value)
+        elif kind == InterpreterBase.BOOL_DEF:
+            self.__emit(LOAD_CONST, expr_ast.value)
+        elif kind == InterpreterBase.VAR_DEF:
+            var_name = expr_ast.name
+            if "." in var_name:
+                self.__emit(LOAD_FIELD, (expr_ast.slot, var_name.split(".")[1]))
+            else:
+                self.__emit(LOAD_VAR, (expr_ast.slot, var_name))
+        elif kind == InterpreterBase.FCALL_DEF:
+            self.__fcall(expr_ast)
+        elif kind in self.binary_ops:
+            self.__binary_op(expr_ast)
+        elif kind == InterpreterBase.NEG_DEF:
+            self.__expr(expr_ast.op1)
+            self.__emit(NEG)
+        elif kind == InterpreterBase.NOT_DEF:
+            self.__expr(expr_ast.op1)
+            self.__emit(NOT)
+        elif kind == InterpreterBase.LAMBDA_DEF:
+            self.__emit(MAKE_CLOSURE, expr_ast)
+        elif kind == InterpreterBase.OBJ_DEF:
+            self.__emit(MAKE_OBJECT)
+        elif kind == InterpreterBase.MCALL_DEF:
+            args = expr_ast.args
+            method = (expr_ast.slot, expr_ast.name, len(args), expr_ast.cache)
+            self.__emit(RESOLVE_METHOD, method)
+            self.__args(args)
+            self.__emit(CALL_METHOD, len(args))
+
+    # an operator on a variable and a literal or another variable, the most
+    # common operands by far, is a single instruction that loads them itself
+    def __binary_op(self, expr_ast):
+        op1 = expr_ast.op1
+        op2 = expr_ast.op2
+        operator = (expr_ast.site, self.binary_ops[expr_ast.elem_type])
+        if is_plain_var(op1):
+            if op2.elem_type in LITERAL_KINDS:
+                self.__emit(BINARY_VAR_CONST, (op1.slot, op1.name, op2.value) + operator)
+                return
+            if is_plain_var(op2):
+                self.__emit(
+                    BINARY_VAR_VAR, (op1.slot, op1.name, op2.slot, op2.name) + operator
+                )
+                return
+        self.__expr(op1)
+        self.__expr(op2)
+        self.__emit(BINARY_OP, operator)
+
+    def __fcall(self, call_ast):
+        func_name = call_ast.name
+        args = call_ast.args
+        if func_name == "print":
+            self.__emit(BEGIN_PRINT)
+            for arg in args:
+                self.__expr(arg)
+                self.__emit(PRINT_ARG)
+            self.__emit(PRINT)
+        elif func_name == "inputi":
+            if len(args) == 1:
+                self.__expr(args[0])
+            self.__emit(INPUT, len(args))
+        else:
+            self.__emit(RESOLVE_FUNC, (func_name, len(args), call_ast.target))
+            self.__args(args)
+            self.__emit(CALL, len(args))
+
+    # each argument is copied (or not, for ref params) right after it's
+    # evaluated, just like the tree-walker does in __prepare_params. A
+    # variable or field is passed as its cell, which a ref param is bound to.
+    # A literal never needs copying, so it's passed in a new cell either way.
+    def __args(self, args):
+        for index, arg in enumerate(args):
+            if arg.elem_type in LITERAL_KINDS:
+                self.__emit(PASS_CONST, arg.value)
+                continue
+            if arg.elem_type != InterpreterBase.VAR_DEF:
+                self.__expr(arg)
+                self.__emit(PASS_ARG, index)
+                continue
+            var_name = arg.name
+            if "." in var_name:
+                self.__emit(
+                    PASS_FIELD_REF, (arg.slot, var_name.split(".")[1], index)
+                )
+            else:
+                self.__emit(PASS_VAR_REF, (arg.slot, var_name, index))
+
+
+# Executes programs compiled by Compiler, on top of the state the engine
+# shares with the Interpreter that owns it (see runtimev4.CompiledRuntime).
+#
+# The VM is stackless: a call saves where the caller is up to on a list of
+# call frames and carries on in the callee's code, in the same python frame,
+# so the depth of Brewin recursion isn't limited by python's. Every call
+# shares one operand stack; a call's operands sit above its caller's, and a
+# return leaves the return value where the call's target and args were.
+# Going deeper than max_depth calls is a RESOURCE_ERROR, as is running past
+# the interpreter's budget.
+class VirtualMachine(CompiledRuntime):
+    def __init__(self, interpreter):
+        super().__init__(interpreter)
+        self.budget = interpreter.budget
+        self.compiler = Compiler(self.binary_ops, self.budget.enabled)
+        self.code_for_func = {}
+        self.max_depth = interpreter.max_depth
+        # opcode -> handler(stack, arg), for the ops from FIRST_HANDLER_OP on
+        self.handlers = [None] * NUM_OPS
+        for op, handler in (
+            (RESOLVE_FUNC, self.__resolve_func),
+            (PASS_ARG, self.__pass_arg),
+            (PASS_CONST, self.__pass_const),
+            (PASS_VAR_REF, self.__pass_var_ref),
+            (PASS_FIELD_REF, self.__pass_field_ref),
+            (RESOLVE_METHOD, self.__resolve_method),
+            (POP_TOP, self.__pop_top),
+            (STORE_FIELD, self.__store_field),
+            (LOAD_NIL, self.__load_nil),
+            (NEG, self.__neg),
+            (NOT, self.__not),
+            (MAKE_CLOSURE, self.__make_closure),
+            (MAKE_OBJECT, self.__make_object),
+            (PUSH_SCOPE, self.__push_scope),
+            (POP_SCOPE, self.__pop_scope),
+            (BEGIN_PRINT, self.__begin_print),
+            (PRINT_ARG, self.__print_arg),
+            (PRINT, self.__print),
+            (INPUT, self.__input),
+        ):
+            self.handlers[op] = handler
+
+    def run(self, main_closure):
+        self.__execute(main_closure)
+
+    def __code(self, func_ast):
+        code = self.code_for_func.get(func_ast)
+        if code is None:
+            code = self.compiler.compile_function(func_ast)
+            self.code_for_func[func_ast] = code
+        return code
+
+    def __execute(self, main_closure):
+        env = self.env
+        # slot -> innermost cell. The program is resolved before its env is
+        # made, so the list has room for every slot the code uses and is
+        # indexed directly rather than through env.get_slot.
+        values = env.values
+        code_for_func = self.code_for_func
+        handlers = self.handlers
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        error = self.error
+        # (code, pc, call_base) of every call below the running one
+        frames = []
+        # a call can be made while there are fewer frames below than this
+        max_frames = self.max_depth - 1
+        budget = self.budget
+        fuel = budget.fuel
+        # the index of the running call's first env frame
+        call_base = len(env.frames)
+        env.push(self.call_env(main_closure, ()))
+        code = self.__code(main_closure.func_ast)
+        pc = 0
+
+        while True:
+            op, arg = code[pc]
+            pc += 1
+
+            if op == BINARY_VAR_CONST:
+                cell = values[arg[0]]
+                left = self.func_value(arg[1]) if cell is None else cell.value
+                right = arg[2]
+                site = arg[3]
+                if left.t is site.left_t and right.t is site.right_t:
+                    push(site.fast(left.v, right.v))
+                else:
+                    push(arg[4](left, right))
+                    site.observe(left.t, right.t)
+            elif op == LOAD_VAR:
+                cell = values[arg[0]]
+                if cell is None:
+                    push(self.func_value(arg[1]))
+                else:
+                    push(cell.value)
+            elif op == LOAD_CONST:
+                push(arg)
+            elif op == BINARY_OP:
+                right = pop()
+                left = stack[-1]
+                site = arg[0]
+                if left.t is site.left_t and right.t is site.right_t:
+                    stack[-1] = site.fast(left.v, right.v)
+                else:
+                    stack[-1] = arg[1](left, right)
+                    site.observe(left.t, right.t)
+            elif op == STORE_VAR:
+                src = pop()
+                target = values[arg]
+                if target is None:
+                    env.create_slot(arg, Cell(src))
+                else:
+                    if target.value.t == Type.CLOSURE and src.t != Type.CLOSURE:
+                        target.value.v.set_type(src.t)
+                    target.set(src)
+            elif op == JUMP_IF_FALSE:
+                cond = pop()
+                if cond.t == Type.INT:
+                    if cond.v == 0:
+                        pc = arg[0]
+                elif cond.t != Type.BOOL:
+                    error(
+                        ErrorType.TYPE_ERROR,
+                        f"Incompatible type for {arg[1]} condition",
+                    )
+                elif not cond.v:
+                    pc = arg[0]
+            elif op == LOAD_FIELD:
+                push(self.field_value(values[arg[0]], arg[1]))
+            elif op == JUMP:
+                pc = arg
+            elif op == BINARY_VAR_VAR:
+                cell = values[arg[0]]
+                left = self.func_value(arg[1]) if cell is None else cell.value
+                cell = values[arg[2]]
+                right = self.func_value(arg[3]) if cell is None else cell.value
+                site = arg[4]
+                if left.t is site.left_t and right.t is site.right_t:
+                    push(site.fast(left.v, right.v))
+                else:
+                    push(arg[5](left, right))
+                    site.observe(left.t, right.t)
+            elif op >= FIRST_HANDLER_OP:
+                handlers[op](stack, arg)
+            elif op == CALL or op == CALL_METHOD:
+                if arg:
+                    args = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    args = ()
+                target_closure = pop()
+                this = pop() if op == CALL_METHOD else None
+                if len(frames) >= max_frames:
+                    error(ErrorType.RESOURCE_ERROR, "Maximum call depth exceeded")
+                frames.append((code, pc, call_base))
+                call_base = len(env.frames)
+                env.push(self.call_env(target_closure, args, this))
+                func_ast = target_closure.func_ast
+                code = code_for_func.get(func_ast)
+                if code is None:
+                    code = self.__code(func_ast)
+                pc = 0
+            elif op == RETURN or op == RETURN_NIL:
+                if op == RETURN:
+                    return_val = copy_value(pop())
+                else:
+                    return_val = self.nil_value
+                while len(env.frames) > call_base:
+                    env.pop()
+                if not frames:
+                    return return_val
+                code, pc, call_base = frames.pop()
+                push(return_val)
+            elif op == TAIL_CALL or op == TAIL_CALL_METHOD:
+                # runs in place of the current call (see runtimev4.TailCall),
+                # which keeps its call_base and its place in frames
+                if arg:
+                    args = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    args = ()
+                target_closure = pop()
+                this = pop() if op == TAIL_CALL_METHOD else None
+                callee_env = self.call_env(target_closure, args, this)
+                tail = tail_call(env, call_base, target_closure, callee_env)
+                while len(env.frames) > call_base:
+                    env.pop()
+                if tail.carried_env is not None:
+                    env.push(tail.carried_env)
+                env.push(callee_env)
+                func_ast = target_closure.func_ast
+                code = code_for_func.get(func_ast)
+                if code is None:
+                    code = self.__code(func_ast)
+                pc = 0
+            elif op == CHARGE:
+                fuel -= arg
+                if fuel < 0:
+                    fuel = budget.refuel(fuel)
+
+    # the handlers of the ops that only use the operand stack and the env
+
+    def __resolve_func(self, stack, arg):
+        target_closure = arg[2]
+        if target_closure is None or target_closure.type != Type.CLOSURE:
+            target_closure = self.resolve_func(arg[0], arg[1], target_closure)
+        stack.append(target_closure)
+
+    def __pass_arg(self, stack, arg):
+        target_closure = stack[-arg - 2]
+        formal_ast = target_closure.func_ast.args[arg]
+        if formal_ast.elem_type == InterpreterBase.REFARG_DEF:
+            stack[-1] = Cell(stack[-1])
+        else:
+            stack[-1] = Cell(copy_value(stack[-1]))
+
+    def __pass_const(self, stack, arg):
+        stack.append(Cell(arg))
+
+    def __pass_var_ref(self, stack, arg):
+        cell = self.var_ref(self.env.get_slot(arg[0]), arg[1])
+        self.__pass_ref(stack, cell, arg[2])
+
+    def __pass_field_ref(self, stack, arg):
+        cell = self.field_ref(self.env.get_slot(arg[0]), arg[1])
+        self.__pass_ref(stack, cell, arg[2])
+
+    # the cell of the index'th argument, or a copy of its value when the
+    # param isn't a ref param
+    def __pass_ref(self, stack, cell, index):
+        target_closure = stack[-index - 1]
+        formal_ast = target_closure.func_ast.args[index]
+        if formal_ast.elem_type != InterpreterBase.REFARG_DEF:
+            cell = Cell(copy_value(cell.value))
+        stack.append(cell)
+
+    def __resolve_method(self, stack, arg):
+        target_cell = self.env.get_slot(arg[0])
+        stack.append(target_cell)
+        stack.append(self.resolve_method(target_cell, arg[1], arg[2], arg[3]))
+
+    def __pop_top(self, stack, arg):
+        stack.pop()
+
+    def __store_field(self, stack, arg):
+        src = stack.pop()
+        target = self.env.get_slot(arg[0])
+        if target is None:
+            self.error(ErrorType.NAME_ERROR, f"no field found")
+        elif not isinstance(target.value.v, Object):
+            self.error(ErrorType.TYPE_ERROR, f"no object found")
+        field_name = arg[1]
+        if field_name == "proto" and not isinstance(src.v, Object):
+            self.error(ErrorType.TYPE_ERROR, "proto can only be assigned to an Object")
+        target.value.v.set_field(field_name, src)
+
+    def __load_nil(self, stack, arg):
+        stack.append(self.nil_value)
+
+    def __neg(self, stack, arg):
+        value = stack.pop()
+        if value.t != Type.INT:
+            self.error(ErrorType.TYPE_ERROR, f"Incompatible type for neg operation")
+        stack.append(int_value(-value.v))
+
+    def __not(self, stack, arg):
+        value = stack.pop()
+        if value.t == Type.INT:
+            value = bool_value(value.v != 0)
+        if value.t != Type.BOOL:
+            self.error(ErrorType.TYPE_ERROR, f"Incompatible type for ! operation")
+        stack.append(bool_value(not value.v))
+
+    def __make_closure(self, stack, arg):
+        stack.append(Value(Type.CLOSURE, Closure(arg, self.env)))
+
+    def __make_object(self, stack, arg):
+        stack.append(Value(Type.OBJECT, Object()))
+
+    def __push_scope(self, stack, arg):
+        self.env.push()
+
+    def __pop_scope(self, stack, arg):
+        self.env.pop()
+
+    def __begin_print(self, stack, arg):
+        stack.append("")
+
+    def __print_arg(self, stack, arg):
+        value = stack.pop()
+        stack[-1] = stack[-1] + get_printable(value)
+
+    def __print(self, stack, arg):
+        self.interpreter.output(stack.pop())
+        stack.append(self.nil_value)
+
+    def __input(self, stack, arg):
+        if arg == 1:
+            self.interpreter.output(get_printable(stack.pop()))
+        elif arg > 1:
+            self.error(
+                ErrorType.NAME_ERROR,
+                "No inputi() function that takes > 1 parameter",
+            )
+        stack.append(int_value(int(self.interpreter.get_input())))